@@ -0,0 +1,128 @@
+"""Per-drone battery discharge model fitted online from the telemetry readings."""
+import threading
+import time
+
+import numpy as np
+
+
+class BatteryTrend:
+    """Last window readings of one drone in a fixed NumPy ring, with the fitted discharge rate."""
+
+    def __init__(self, window):
+        self.window = window
+        self.t = np.zeros(window, dtype=np.float64)
+        self.level = np.zeros(window, dtype=np.float64)
+        self.count = 0
+        self.rate = None            # %/s over the window (negative while discharging)
+        self.flight_rate = None     # %/s learned while flying
+        self.flying = False
+
+    def add(self, t, level, flying):
+        if self.count and (level > self.level[(self.count - 1) % self.window] + 5 or flying != self.flying):
+            # Battery swapped or charged, or the drone took off/landed: the old slope no longer applies
+            self.count = 0
+            self.rate = None
+        self.flying = flying
+        index = self.count % self.window
+        self.t[index] = t
+        self.level[index] = level
+        self.count += 1
+        n = min(self.count, self.window)
+        if n >= 3:
+            t_window = self.t[:n] - self.t[:n].mean()
+            denominator = float(t_window @ t_window)
+            if denominator > 0:
+                self.rate = float(t_window @ (self.level[:n] - self.level[:n].mean())) / denominator
+                if flying and self.rate < 0:
+                    self.flight_rate = self.rate if self.flight_rate is None else 0.7 * self.flight_rate + 0.3 * self.rate
+
+    def latest(self):
+        if not self.count:
+            return None
+        index = (self.count - 1) % self.window
+        return float(self.t[index]), float(self.level[index])
+
+
+class BatteryModel:
+    """Predicts remaining flight time and picks the battery polling interval per drone.
+
+    Each reading updates a least-squares fit of level over time on the last
+    window readings. Until a drone has flown long enough for its own rate,
+    flight predictions use flight_rate (%/s). Everything is in memory, so
+    command handlers can check a prediction without any I/O.
+    """
+
+    def __init__(self, window=32, reserve=20.0, flight_rate=0.125, min_interval=5.0, max_interval=120.0,
+                 default_interval=30.0):
+        self.window = window
+        self.reserve = reserve
+        self.default_flight_rate = flight_rate
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self._lock = threading.Lock()
+        self._trends = {}
+
+    def record(self, drone_id, level, flying, t=None):
+        with self._lock:
+            trend = self._trends.get(drone_id)
+            if trend is None:
+                trend = self._trends[drone_id] = BatteryTrend(self.window)
+            trend.add(t or time.time(), float(level), flying)
+
+    def flight_rate(self, drone_id):
+        """Discharge while flying in %/s (positive)."""
+        trend = self._trends.get(drone_id)
+        if trend is not None and trend.flight_rate is not None:
+            return -trend.flight_rate
+        return self.default_flight_rate
+
+    def remaining_flight_s(self, drone_id, level=None):
+        """Seconds of flight left before the reserve, from level or the last reading."""
+        if level is None:
+            latest = self._trends.get(drone_id) and self._trends[drone_id].latest()
+            if not latest:
+                return None
+            level = latest[1]
+        return max(0.0, float(level) - self.reserve) / self.flight_rate(drone_id)
+
+    def can_fly(self, drone_id, seconds, level=None):
+        """True if the drone is predicted to fly for seconds more before reaching the reserve."""
+        remaining = self.remaining_flight_s(drone_id, level)
+        return remaining is None or remaining >= seconds
+
+    def poll_interval(self, drone_id):
+        """Battery polling interval: fast when low or dropping fast, slow when idle."""
+        trend = self._trends.get(drone_id)
+        if trend is None or trend.latest() is None:
+            return self.default_interval
+        _, level = trend.latest()
+        if trend.rate is None:
+            interval = self.default_interval
+        elif trend.rate < 0:
+            # About two readings per percent lost
+            interval = 0.5 / -trend.rate
+        else:
+            interval = self.max_interval
+        if not trend.flying and (trend.rate is None or trend.rate > -0.01):
+            interval = max(interval, self.default_interval)
+        if level <= self.reserve + 10:
+            interval = min(interval, self.min_interval * 2)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def predict(self, drone_id):
+        trend = self._trends.get(drone_id)
+        latest = trend.latest() if trend else None
+        if latest is None:
+            return None
+        t, level = latest
+        return {
+            "level": level,
+            "updated": t,
+            "samples": min(trend.count, self.window),
+            "flying": trend.flying,
+            "rate_per_min": round(trend.rate * 60, 3) if trend.rate is not None else None,
+            "flight_rate_per_min": round(self.flight_rate(drone_id) * 60, 3),
+            "remaining_flight_s": round(self.remaining_flight_s(drone_id, level), 1),
+            "poll_interval_s": round(self.poll_interval(drone_id), 1),
+        }
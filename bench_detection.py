@@ -0,0 +1,148 @@
+"""Benchmark of the reference map marker detection: single pass against coarse-to-fine.
+
+The single pass is what compute_map_geometry used to do (decode the full
+BGR image, convert to gray, detectMarkers). The coarse-to-fine mode decodes
+the JPEG reduced, detects there and refines the corners with cornerSubPix
+at full resolution. For every map and reduction it reports the time, the
+decoded bytes, the markers found and, against the single pass, the corner
+deviation and the map scale and grid fit error that come out of them:
+
+    python bench_detection.py
+    python bench_detection.py --reductions 2 4 --repeat 5 --json bench.json
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2 as cv
+import numpy as np
+
+from vision import (detect_markers_pyramid, estimate_marker_poses, fit_marker_grid, read_gray,
+                    relative_positions, stack_corners)
+from vision_context import create_detector
+
+MARKER_SIZE = 9  # cm, as in compute_map_geometry
+
+
+def single_pass(path, detector):
+    frame = cv.imread(path)
+    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    corners, ids, _ = detector.detectMarkers(gray)
+    if ids is None:
+        return np.empty((0, 4, 2), np.float32), np.empty(0, int), frame.nbytes + gray.nbytes
+    return stack_corners(corners), np.asarray(ids).ravel(), frame.nbytes + gray.nbytes
+
+
+def coarse_to_fine(path, detector, reduction):
+    result = detect_markers_pyramid(path, detector, reduction)
+    if result is None:
+        return np.empty((0, 4, 2), np.float32), np.empty(0, int), None
+    corners, ids, (width, height) = result
+    return corners, ids, width * height
+
+
+def grid_scale(corners, ids, calibration):
+    """(scale x, scale y, rms px) of the grid fit, as compute_map_geometry computes them."""
+    if calibration is None or 0 not in ids:
+        return None
+    rvecs, tvecs, solved = estimate_marker_poses(corners, *calibration, MARKER_SIZE)
+    reference = int(np.flatnonzero(ids == 0)[0])
+    rel_mm = relative_positions(rvecs, tvecs, reference) * 10
+    fit = fit_marker_grid(rel_mm[solved, :2], corners.mean(axis=1)[solved])
+    return None if fit is None else (fit["scale_x"], fit["scale_y"], fit["rms_px"])
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - started)
+    return result, float(np.median(times)) * 1000
+
+
+def compare(reference, candidate):
+    """Deviation of the corners of candidate from the ones of reference, on the markers both found."""
+    ref_corners, ref_ids, _ = reference
+    corners, ids, _ = candidate
+    index = {int(marker_id): i for i, marker_id in enumerate(ref_ids)}
+    common = [(index[int(marker_id)], i) for i, marker_id in enumerate(ids) if int(marker_id) in index]
+    if not common:
+        return None
+    ref_rows, rows = map(list, zip(*common))
+    deviation = np.linalg.norm(corners[rows] - ref_corners[ref_rows], axis=2)
+    return {
+        "mean_px": round(float(deviation.mean()), 3),
+        "p95_px": round(float(np.percentile(deviation, 95)), 3),
+        "max_px": round(float(deviation.max()), 3),
+        "missed": sorted(set(ref_ids.tolist()) - set(ids.tolist())),
+        "extra": sorted(set(ids.tolist()) - set(ref_ids.tolist())),
+    }
+
+
+def run(paths, reductions, repeat, calibration):
+    detector = create_detector()
+    results = []
+    for path in paths:
+        reference, single_ms = timed(lambda: single_pass(path, detector), repeat)
+        single_grid = grid_scale(reference[0], reference[1], calibration)
+        rows = [{"map": os.path.basename(path), "mode": "single", "reduction": 1, "ms": round(single_ms, 1),
+                 "decoded_mb": round(reference[2] / 1e6, 1), "markers": len(reference[1]),
+                 "grid": single_grid, "deviation": None}]
+        for reduction in reductions:
+            candidate, ms = timed(lambda: coarse_to_fine(path, detector, reduction), repeat)
+            # Reduced gray image, plus the full gray one when there were markers to refine
+            decoded = read_gray(path, reduction).nbytes + (candidate[2] or 0)
+            rows.append({"map": os.path.basename(path), "mode": "pyramid", "reduction": reduction,
+                         "ms": round(ms, 1), "decoded_mb": round(decoded / 1e6, 1),
+                         "markers": len(candidate[1]), "grid": grid_scale(candidate[0], candidate[1], calibration),
+                         "deviation": compare(reference, candidate)})
+        for row in rows:
+            row["speedup"] = round(single_ms / row["ms"], 2) if row["ms"] else None
+            if row["grid"] is not None and single_grid is not None:
+                row["scale_error"] = round(max(abs(row["grid"][0] / single_grid[0] - 1),
+                                               abs(row["grid"][1] / single_grid[1] - 1)), 4)
+        results.extend(rows)
+    return results
+
+
+def print_table(results):
+    print(f"{'map':<10} {'mode':<8} {'red':>3} {'ms':>7} {'x':>5} {'MB':>6} {'markers':>7} "
+          f"{'mean px':>8} {'p95 px':>7} {'scale err':>9} {'rms px':>7}")
+    for row in results:
+        deviation = row["deviation"] or {}
+        grid = row["grid"]
+        print(f"{row['map']:<10} {row['mode']:<8} {row['reduction']:>3} {row['ms']:>7} {row['speedup']:>5} "
+              f"{row['decoded_mb']:>6} {row['markers']:>7} {deviation.get('mean_px', '-'):>8} "
+              f"{deviation.get('p95_px', '-'):>7} {row.get('scale_error', '-'):>9} "
+              f"{round(grid[2], 2) if grid else '-':>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("maps", nargs="*", help="Map images (default: testbed_maps/*.jpg)")
+    parser.add_argument("--reductions", type=int, nargs="+", default=[2, 4], choices=[2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (the median is reported)")
+    parser.add_argument("--calibration", default="cam_parameters.npz",
+                        help="Camera calibration for the scale comparison (skipped if missing)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    paths = args.maps or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       "testbed_maps", "*.jpg")))
+    calibration = None
+    if os.path.exists(args.calibration):
+        with np.load(args.calibration) as X:
+            calibration = (X["camera_matrix"], X["dist_coeffs"])
+
+    results = run(paths, args.reductions, args.repeat, calibration)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Delta-compressed, coalesced drone state broadcasting over Socket.IO."""
+import threading
+import time
+
+from flask_socketio import join_room, leave_room, rooms
+
+FLEET_ROOM = "fleet"
+
+
+def drone_room(drone_id):
+    return f"drone:{drone_id}"
+
+
+def register_room_handlers(socketio):
+    """Room membership handlers, shared by the API server and the fan-out workers.
+
+    Clients start in the fleet room; 'subscribe' with {"drones": [1, 2]} moves
+    them to those drones' rooms and 'unsubscribe' moves them back.
+    """
+
+    @socketio.on('connect')
+    def on_connect():
+        join_room(FLEET_ROOM)
+
+    @socketio.on('subscribe')
+    def on_subscribe(data):
+        drone_ids = (data or {}).get("drones") or []
+        leave_room(FLEET_ROOM)
+        for drone_id in drone_ids:
+            join_room(drone_room(drone_id))
+
+    @socketio.on('unsubscribe')
+    def on_unsubscribe(data=None):
+        for room in rooms():
+            if room.startswith("drone:"):
+                leave_room(room)
+        join_room(FLEET_ROOM)
+
+
+class DroneBroadcaster:
+    """Sends only the fields that changed, at most one frame per room per tick.
+
+    publish() accepts a full drone state dict; fields equal to what clients
+    already have are dropped, and several publishes within one tick merge into
+    a single delta. Each tick emits the list of deltas to the fleet room and
+    each drone's delta to its own room.
+    """
+
+    def __init__(self, emit, event='drone_updates', interval=0.1):
+        self.emit = emit
+        self.event = event
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._sent = {}
+        self._pending = {}
+        self._thread = None
+        self.frames = 0
+        self.skipped = 0
+
+    def publish(self, state):
+        if state is None:
+            return
+        drone_id = state["id"]
+        with self._lock:
+            sent = self._sent.get(drone_id, {})
+            pending = self._pending.get(drone_id, {})
+            for field, value in state.items():
+                if field == "id":
+                    continue
+                if field in sent and sent[field] == value:
+                    # Back to what clients already have: nothing to send
+                    pending.pop(field, None)
+                else:
+                    pending[field] = value
+            if pending:
+                self._pending[drone_id] = pending
+            else:
+                self._pending.pop(drone_id, None)
+                self.skipped += 1
+        self._ensure_started()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for drone_id, delta in pending.items():
+                self._sent.setdefault(drone_id, {}).update(delta)
+        if not pending:
+            return 0
+
+        deltas = [dict(delta, id=drone_id) for drone_id, delta in pending.items()]
+        self.emit(self.event, deltas, to=FLEET_ROOM)
+        for delta in deltas:
+            self.emit(self.event, [delta], to=drone_room(delta["id"]))
+        self.frames += 1
+        return len(deltas)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="drone-broadcaster", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error enviando actualizaciones de drones: {e}")
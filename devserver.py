@@ -0,0 +1,13 @@
+"""Development entry point: python devserver.py
+
+Runs the same development server as python server.py. server.py sets the
+whole app up when it is imported (Flask, Socket.IO and its message queue,
+the history database, the drone pools), and worker processes such as the
+camera localizer's re-import the __main__ module; started from here,
+__main__ is this small module instead. See wsgi.py for production.
+"""
+
+if __name__ == '__main__':
+    import server
+
+    server.run_development_server()
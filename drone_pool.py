@@ -0,0 +1,508 @@
+"""Persistent per-drone TCP connections for the drone command API."""
+import itertools
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+from drone_protocol import (EVENT, HELLO, REPLY, REQUEST, ProtocolError, decode_event, decode_reply,
+                            encode_command, hello_frame, pack_frame, read_frame)
+
+DEFAULT_PORT = 12306
+MESSAGE_DELIMITER = b"\n"
+# Text framings: newline-delimited replies, or one recv per reply for firmware that does not delimit them
+FRAMINGS = {"newline": MESSAGE_DELIMITER, "raw": None}
+RECV_CHUNK = 4096
+
+
+class DroneConnection:
+    """A long-lived socket to one drone.
+
+    With a delimiter, requests and replies are delimited messages and a reply
+    is complete at the delimiter (or when the drone closes the socket). Without
+    one (firmware that does not frame its replies), requests are sent as they
+    are and the reply is whatever the first recv returns.
+    """
+
+    def __init__(self, address, timeout, delimiter=MESSAGE_DELIMITER):
+        self.address = address
+        self.delimiter = delimiter
+        self.sock = socket.create_connection(address, timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.buffer = b""
+        self.closed = False
+        self.last_used = time.monotonic()
+
+    def request(self, payload, timeout):
+        self.sock.settimeout(timeout)
+        if self.delimiter is None:
+            self.sock.sendall(payload)
+            frame = self.sock.recv(RECV_CHUNK)
+            if not frame:
+                self.closed = True
+                raise ConnectionError(f"Connection closed by {self.address[0]}")
+        else:
+            self.sock.sendall(payload + self.delimiter)
+            frame = self._read_frame()
+        self.last_used = time.monotonic()
+        return frame
+
+    def _read_frame(self):
+        while True:
+            end = self.buffer.find(self.delimiter)
+            if end >= 0:
+                frame = self.buffer[:end]
+                self.buffer = self.buffer[end + len(self.delimiter):]
+                return frame
+
+            chunk = self.sock.recv(RECV_CHUNK)
+            if not chunk:
+                # Older firmware answers once and closes the socket: the reply
+                # is whatever arrived before EOF and the connection is spent.
+                self.closed = True
+                if self.buffer:
+                    frame, self.buffer = self.buffer, b""
+                    return frame
+                raise ConnectionError(f"Connection closed by {self.address[0]}")
+            self.buffer += chunk
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class HelloTimeout(TimeoutError):
+    """The drone accepted the connection but did not answer the binary HELLO in time."""
+
+
+class BinaryConnection:
+    """A socket to one drone speaking the binary protocol (drone_protocol).
+
+    Requests are pipelined: any number of threads send on the same socket and
+    a reader thread hands each reply to its caller by request id. A request
+    that times out only gives up its slot, the connection stays usable.
+    Events pushed by the drone go to on_event(ip, metric, reply text).
+    """
+
+    def __init__(self, address, timeout, on_event=None):
+        self.address = address
+        self.on_event = on_event
+        self.sock = socket.create_connection(address, timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.buffer = bytearray()
+        self.closed = False
+        self.events = 0
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        try:
+            self.sock.sendall(hello_frame())
+            kind, _, version, _ = self._read_frame()
+            if kind != HELLO:
+                raise ProtocolError(f"Expected HELLO from {address[0]}")
+        except TimeoutError as e:
+            self.close()
+            raise HelloTimeout(f"No HELLO from {address[0]}") from e
+        except BaseException:
+            self.close()
+            raise
+        self.version = version
+        self.sock.settimeout(None)
+        threading.Thread(target=self._receive, name=f"drone-{address[0]}", daemon=True).start()
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def request(self, opcode, payload, timeout):
+        future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError(f"Connection to {self.address[0]} is closed")
+            request_id = next(self._ids) & 0xFFFFFFFF or next(self._ids)
+            self._pending[request_id] = future
+        try:
+            with self._write_lock:
+                self.sock.sendall(pack_frame(REQUEST, request_id, opcode, payload))
+            return decode_reply(opcode, future.result(timeout))
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def _read_frame(self):
+        while True:
+            frame = read_frame(self.buffer)
+            if frame is not None:
+                kind, request_id, opcode, payload, size = frame
+                del self.buffer[:size]
+                return kind, request_id, opcode, payload
+            chunk = self.sock.recv(RECV_CHUNK)
+            if not chunk:
+                raise ProtocolError(f"Connection closed by {self.address[0]}")
+            self.buffer += chunk
+
+    def _receive(self):
+        try:
+            while True:
+                kind, request_id, opcode, payload = self._read_frame()
+                if kind == REPLY:
+                    with self._lock:
+                        future = self._pending.pop(request_id, None)
+                    if future is not None:
+                        future.set_result(payload)
+                elif kind == EVENT:
+                    self.events += 1
+                    if self.on_event is not None:
+                        try:
+                            self.on_event(self.address[0], *decode_event(opcode, payload))
+                        except Exception as e:
+                            print(f"Error procesando un evento del dron {self.address[0]}: {e}")
+        except Exception as e:
+            error = e if isinstance(e, OSError) else ConnectionError(str(e))
+        self.close()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class HostState:
+    """Idle connections, backoff and statistics for one drone address."""
+
+    def __init__(self):
+        self.idle = []
+        self.open = 0
+        self.failures = 0
+        self.next_connect_at = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.retries = 0
+        self.last_latency = None
+        self.avg_latency = None
+        self.max_latency = 0.0
+        self.cond = threading.Condition()
+        # Binary protocol: one pipelined connection instead of the idle list
+        self.protocol = "text"
+        self.framing = "raw"
+        self.shared = None
+        self.connect_lock = threading.Lock()
+
+
+class DronePool:
+    """Keeps reusable connections per drone, caching DNS and backing off on failures.
+
+    Drones speak the text protocol unless set_protocol() selects
+    "binary" (pipelined, with pushed events sent to on_event) or "auto"
+    (binary, falling back to text for good if the drone answers the binary
+    HELLO with something else or not at all). Text replies are read with a
+    single recv unless set_framing() marks the drone's firmware as
+    newline-delimiting them; only then can a reply larger than one recv, or
+    several requests on a kept connection, be told apart reliably.
+    """
+
+    def __init__(self, max_per_host=2, dns_ttl=300, idle_timeout=60,
+                 backoff_base=0.1, backoff_max=5.0, on_event=None):
+        self.on_event = on_event
+        self.max_per_host = max_per_host
+        self.dns_ttl = dns_ttl
+        self.idle_timeout = idle_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._dns = {}
+
+    def resolve(self, host):
+        """Returns the IP for host, caching name lookups for dns_ttl seconds."""
+        if "." in host:
+            return host
+        now = time.monotonic()
+        cached = self._dns.get(host)
+        if cached and cached[1] > now:
+            return cached[0]
+        ip = socket.gethostbyname(host)
+        self._dns[host] = (ip, now + self.dns_ttl)
+        return ip
+
+    def set_protocol(self, host, protocol, port=DEFAULT_PORT):
+        """Selects "text", "binary" or "auto" for a drone."""
+        if protocol not in ("text", "binary", "auto"):
+            raise ValueError(f"Unknown drone protocol: {protocol}")
+        state = self._state((self.resolve(host), port))
+        with state.cond:
+            state.protocol = protocol
+
+    def set_framing(self, host, framing, port=DEFAULT_PORT):
+        """Selects "raw" (one recv per reply) or "newline" text framing for a drone."""
+        if framing not in FRAMINGS:
+            raise ValueError(f"Unknown drone framing: {framing}")
+        state = self._state((self.resolve(host), port))
+        with state.cond:
+            state.framing = framing
+
+    def request(self, host, message, port=DEFAULT_PORT, timeout=5, retries=0, priority=False):
+        """Sends message to host and returns the decoded reply, raising on failure.
+
+        Priority requests may open a connection beyond max_per_host and skip the
+        reconnect backoff, so they never wait behind slow commands to the same drone.
+        """
+        address = (self.resolve(host), port)
+        state = self._state(address)
+        if state.protocol != "text":
+            try:
+                return self._binary_request(state, address, message, timeout, retries, priority)
+            except ProtocolError as e:
+                with state.cond:
+                    if state.protocol == "binary":
+                        raise
+                    downgraded = state.protocol == "auto"
+                    state.protocol = "text"
+                if downgraded:
+                    print(f"Drone {address[0]} does not speak the binary protocol ({e}); using text")
+        attempt = 0
+        while True:
+            try:
+                conn, reused = self._checkout(state, address, timeout, priority)
+            except OSError:
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                with state.cond:
+                    state.retries += 1
+                continue
+
+            started = time.monotonic()
+            try:
+                reply = conn.request(message.encode('utf8'), timeout)
+            except OSError as e:
+                self._discard(state, conn)
+                if reused and not isinstance(e, TimeoutError):
+                    # The peer may have dropped an idle socket; retry on a fresh one.
+                    continue
+                with state.cond:
+                    state.errors += 1
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                with state.cond:
+                    state.retries += 1
+                time.sleep(self._backoff(attempt))
+                continue
+
+            self._record(state, time.monotonic() - started)
+            self._checkin(state, conn)
+            return reply.decode('utf8')
+
+    def stats(self):
+        """Per-drone connection and latency statistics."""
+        with self._lock:
+            hosts = list(self._hosts.items())
+        result = {}
+        for (ip, port), state in hosts:
+            with state.cond:
+                shared = state.shared
+                result[f"{ip}:{port}"] = {
+                    "protocol": state.protocol,
+                    "framing": state.framing,
+                    "in_flight": shared.in_flight if shared else 0,
+                    "events": shared.events if shared else 0,
+                    "open_connections": state.open,
+                    "idle_connections": len(state.idle),
+                    "requests": state.requests,
+                    "errors": state.errors,
+                    "connects": state.connects,
+                    "reconnects": state.reconnects,
+                    "retries": state.retries,
+                    "consecutive_failures": state.failures,
+                    "latency_ms": {
+                        "last": _ms(state.last_latency),
+                        "avg": _ms(state.avg_latency),
+                        "max": _ms(state.max_latency),
+                    },
+                }
+        return result
+
+    def close_all(self):
+        with self._lock:
+            hosts = list(self._hosts.values())
+        for state in hosts:
+            with state.cond:
+                idle, state.idle = state.idle, []
+                state.open -= len(idle)
+                state.cond.notify_all()
+            for conn in idle:
+                conn.close()
+            with state.cond:
+                shared, state.shared = state.shared, None
+                if shared is not None:
+                    state.open -= 1
+            if shared is not None:
+                shared.close()
+
+    def _binary_request(self, state, address, message, timeout, retries, priority):
+        opcode, payload = encode_command(message)
+        attempt = 0
+        while True:
+            try:
+                conn = self._shared(state, address, timeout, priority)
+                started = time.monotonic()
+                reply = conn.request(opcode, payload, timeout)
+            except ProtocolError:
+                raise
+            except OSError as e:
+                with state.cond:
+                    state.errors += 1
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                with state.cond:
+                    state.retries += 1
+                if not isinstance(e, TimeoutError):
+                    time.sleep(self._backoff(attempt))
+                continue
+            self._record(state, time.monotonic() - started)
+            return reply
+
+    def _shared(self, state, address, timeout, priority):
+        """The host's pipelined connection, (re)connecting with the usual backoff."""
+        conn = state.shared
+        if conn is not None and not conn.closed:
+            return conn
+        with state.connect_lock:
+            with state.cond:
+                if state.protocol == "text":
+                    # Another request found out the drone only speaks text meanwhile
+                    raise ProtocolError(f"Drone {address[0]} uses the text protocol")
+                conn = state.shared
+                if conn is not None and not conn.closed:
+                    return conn
+                if conn is not None:
+                    state.shared = None
+                    state.open -= 1
+                wait = 0.0 if priority else state.next_connect_at - time.monotonic()
+            if wait >= timeout:
+                raise TimeoutError(f"Backing off reconnects to {address[0]}")
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                conn = BinaryConnection(address, timeout, self.on_event)
+            except ProtocolError:
+                raise
+            except OSError as e:
+                with state.cond:
+                    # Text firmware may ignore the HELLO line instead of answering it
+                    if isinstance(e, HelloTimeout) and state.protocol == "auto":
+                        raise ProtocolError(str(e)) from e
+                    state.errors += 1
+                    state.failures += 1
+                    state.next_connect_at = time.monotonic() + self._backoff(state.failures)
+                raise
+            with state.cond:
+                if state.connects:
+                    state.reconnects += 1
+                state.connects += 1
+                state.failures = 0
+                state.next_connect_at = 0.0
+                state.open += 1
+                state.shared = conn
+            return conn
+
+    def _state(self, address):
+        with self._lock:
+            state = self._hosts.get(address)
+            if state is None:
+                state = HostState()
+                self._hosts[address] = state
+            return state
+
+    def _backoff(self, failures):
+        return min(self.backoff_base * (2 ** (failures - 1)), self.backoff_max)
+
+    def _checkout(self, state, address, timeout, priority=False):
+        deadline = time.monotonic() + timeout
+        with state.cond:
+            while True:
+                while state.idle:
+                    conn = state.idle.pop()
+                    if time.monotonic() - conn.last_used < self.idle_timeout:
+                        return conn, True
+                    state.open -= 1
+                    conn.close()
+                if priority or state.open < self.max_per_host:
+                    state.open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No free connection to {address[0]}")
+                state.cond.wait(remaining)
+
+            wait = 0.0 if priority else state.next_connect_at - time.monotonic()
+            if wait >= deadline - time.monotonic():
+                state.open -= 1
+                state.cond.notify()
+                raise TimeoutError(f"Backing off reconnects to {address[0]}")
+
+        try:
+            if wait > 0:
+                time.sleep(wait)
+            conn = DroneConnection(address, timeout, FRAMINGS[state.framing])
+        except BaseException:
+            with state.cond:
+                state.open -= 1
+                state.errors += 1
+                state.failures += 1
+                state.next_connect_at = time.monotonic() + self._backoff(state.failures)
+                state.cond.notify()
+            raise
+
+        with state.cond:
+            if state.connects:
+                state.reconnects += 1
+            state.connects += 1
+            state.failures = 0
+            state.next_connect_at = 0.0
+        return conn, False
+
+    def _checkin(self, state, conn):
+        with state.cond:
+            if conn.closed:
+                state.open -= 1
+            else:
+                state.idle.append(conn)
+            state.cond.notify()
+
+    def _discard(self, state, conn):
+        conn.close()
+        with state.cond:
+            state.open -= 1
+            state.cond.notify()
+
+    def _record(self, state, latency):
+        with state.cond:
+            state.requests += 1
+            state.last_latency = latency
+            state.max_latency = max(state.max_latency, latency)
+            if state.avg_latency is None:
+                state.avg_latency = latency
+            else:
+                state.avg_latency += 0.2 * (latency - state.avg_latency)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
@@ -0,0 +1,154 @@
+"""Versioned binary drone protocol: length-prefixed frames with request ids and pushed events.
+
+Every frame is a 14-byte header followed by the payload:
+
+    magic "DP" | version u8 | kind u8 | request id u32 | opcode u16 | payload length u32
+
+in network byte order. Requests and replies carry the same request id, so
+any number of requests can be in flight on one connection and replies may
+come back in any order. A reply payload starts with a status byte (0 = ok)
+followed by the opcode's result; on error the rest is a UTF-8 message.
+Events are pushed by the drone with request id 0.
+
+The client opens with HELLO (the payload is a single newline, so text-only
+firmware answers it like any malformed line instead of waiting for one) and
+the drone answers HELLO with the version it speaks.
+"""
+import struct
+
+MAGIC = b"DP"
+VERSION = 1
+HEADER = struct.Struct("!2sBBIHI")
+MAX_PAYLOAD = 1 << 20
+
+# Frame kinds
+HELLO = 0
+REQUEST = 1
+REPLY = 2
+EVENT = 3
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+VEC3 = struct.Struct("!3f")
+BATTERY = struct.Struct("!B")
+
+# Command opcodes, named like the text protocol commands
+OPCODES = {
+    "get_battery": 1,
+    "get_position": 2,
+    "get_status": 3,
+    "takeoff": 10,
+    "land": 11,
+    "go_to": 12,
+    "patrol": 13,
+    "stop": 14,
+    "streamon": 15,
+    "streamoff": 16,
+}
+COMMANDS = {opcode: name for name, opcode in OPCODES.items()}
+
+# Pushed event opcodes and the telemetry metric they update
+EVENTS = {1: "battery", 2: "position", 3: "status"}
+EVENT_OPCODES = {metric: opcode for opcode, metric in EVENTS.items()}
+
+
+class ProtocolError(ConnectionError):
+    """The peer does not speak this protocol (or this version of it)."""
+
+
+class InvalidCommand(ValueError):
+    """A command the protocol can't encode: unknown name or bad arguments. The caller's fault, not the drone's."""
+
+
+def pack_frame(kind, request_id, opcode, payload=b""):
+    return HEADER.pack(MAGIC, VERSION, kind, request_id, opcode, len(payload)) + payload
+
+
+def hello_frame():
+    return pack_frame(HELLO, 0, VERSION, b"\n")
+
+
+def read_frame(buffer):
+    """(kind, request id, opcode, payload, bytes consumed) of the first frame in buffer, or None if incomplete."""
+    if len(buffer) < HEADER.size:
+        if not MAGIC.startswith(bytes(buffer[:2])):
+            raise ProtocolError(f"Not a protocol frame: {bytes(buffer[:16])!r}")
+        return None
+    magic, version, kind, request_id, opcode, length = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ProtocolError(f"Not a protocol frame: {bytes(buffer[:16])!r}")
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Frame too large: {length} bytes")
+    end = HEADER.size + length
+    if len(buffer) < end:
+        return None
+    return kind, request_id, opcode, bytes(buffer[HEADER.size:end]), end
+
+
+def encode_command(message):
+    """(opcode, payload) of a text protocol command such as "go_to:100, 200, 1000"."""
+    name, _, argument = message.partition(":")
+    opcode = OPCODES.get(name.strip())
+    if opcode is None:
+        raise InvalidCommand(f"Unknown drone command: {name}")
+    if name == "go_to":
+        try:
+            location = [float(v) for v in argument.split(",")]
+        except ValueError:
+            location = None
+        if location is None or len(location) != 3:
+            raise InvalidCommand(f"go_to needs x, y, z: {argument!r}")
+        return opcode, VEC3.pack(*location)
+    return opcode, b""
+
+
+def encode_result(opcode, result):
+    """Reply payload for a successful command: result is what the text protocol would answer."""
+    if opcode == OPCODES["get_battery"]:
+        body = BATTERY.pack(max(0, min(255, int(float(result)))))
+    elif opcode == OPCODES["get_position"]:
+        body = VEC3.pack(*(float(v) for v in result.split(",")))
+    else:
+        body = result.encode("utf8")
+    return bytes((STATUS_OK,)) + body
+
+
+def encode_error(message):
+    return bytes((STATUS_ERROR,)) + message.encode("utf8")
+
+
+def decode_reply(opcode, payload):
+    """The reply as the text protocol would have sent it, so callers work with either protocol."""
+    if not payload:
+        raise ProtocolError("Empty reply")
+    status, body = payload[0], payload[1:]
+    if status != STATUS_OK:
+        return "error: " + body.decode("utf8", "replace")
+    if opcode == OPCODES["get_battery"]:
+        return str(BATTERY.unpack(body)[0])
+    if opcode == OPCODES["get_position"]:
+        return ",".join(f"{v:.1f}" for v in VEC3.unpack(body))
+    return body.decode("utf8") or "ok"
+
+
+def encode_event(metric, value):
+    """(opcode, payload) of a pushed telemetry event."""
+    opcode = EVENT_OPCODES[metric]
+    if metric == "battery":
+        return opcode, BATTERY.pack(max(0, min(255, int(value))))
+    if metric == "position":
+        return opcode, VEC3.pack(*value)
+    return opcode, str(value).encode("utf8")
+
+
+def decode_event(opcode, payload):
+    """(metric, reply text) of a pushed event, in the same form as a telemetry poll reply."""
+    metric = EVENTS.get(opcode)
+    if metric == "battery":
+        return metric, str(BATTERY.unpack(payload)[0])
+    if metric == "position":
+        return metric, ",".join(f"{v:.1f}" for v in VEC3.unpack(payload))
+    return metric, payload.decode("utf8", "replace")
@@ -0,0 +1,27 @@
+"""Socket.IO fan-out workers: gunicorn -c gunicorn.conf.py fanout:app (with GUNICORN_ROLE=fanout)
+
+Each worker only holds client connections and their rooms. The events are
+emitted by the control server (wsgi.py) and reach every worker through the
+message queue, so any number of workers can run, one per core. Clients
+should connect with the websocket transport only; long-polling needs sticky
+sessions at the proxy when there is more than one worker.
+"""
+import os
+
+from flask import Flask
+from flask_socketio import SocketIO
+
+from broadcast import register_room_handlers
+
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+if not SOCKETIO_MESSAGE_QUEUE:
+    raise RuntimeError("fanout workers need SOCKETIO_MESSAGE_QUEUE, e.g. redis://localhost:6379/0")
+
+app = Flask(__name__)
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE)
+register_room_handlers(socketio)
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    return {"status": "ok", "pid": os.getpid()}
@@ -0,0 +1,148 @@
+"""Thread-safe registry of the drones in the fleet."""
+import json
+import threading
+
+DRONE_FIELDS = ("id", "name", "location", "attitude", "battery", "streaming", "status", "ip", "health")
+DRONE_DEFAULTS = {
+    "location": (0, 0, 0),
+    "attitude": (0, 0, 0),
+    "battery": 90,
+    "streaming": False,
+    "status": "on_ground",
+    "health": "online",
+}
+
+
+class Drone:
+    """State of one drone. Only change it through FleetRegistry.update."""
+
+    __slots__ = DRONE_FIELDS
+
+    def __init__(self, id, name, ip, location=(0, 0, 0), attitude=(0, 0, 0), battery=90, streaming=False,
+                 status="on_ground", health="online"):
+        self.id = id
+        self.name = name
+        self.ip = ip
+        self.location = tuple(location)
+        self.attitude = tuple(attitude)
+        self.battery = battery
+        self.streaming = streaming
+        self.status = status
+        # online / degraded / offline, set by the health monitor
+        self.health = health
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in DRONE_FIELDS}
+
+
+class FleetRegistry:
+    """Drones indexed by id and by IP.
+
+    Writers hold a lock; readers get copy-on-write snapshots, so iterating the
+    fleet or serializing it never sees a half-applied update.
+    """
+
+    def __init__(self, drones=()):
+        self._lock = threading.RLock()
+        self._by_id = {}
+        self._by_ip = {}
+        self._version = 0
+        self._snapshot = None
+        self._json = None
+        self.settings = {}
+        for drone in drones:
+            self.add(drone)
+
+    @classmethod
+    def load(cls, path):
+        """Builds the registry from a JSON file with a "drones" list.
+
+        Keys that are not drone state (e.g. "protocol") are kept in settings[drone id].
+        """
+        with open(path) as f:
+            config = json.load(f)
+        drones = []
+        settings = {}
+        for entry in config["drones"]:
+            fields = dict(DRONE_DEFAULTS, **entry)
+            fields.setdefault("name", f"Drone {fields['id']}")
+            settings[fields["id"]] = {key: fields.pop(key) for key in list(fields) if key not in DRONE_FIELDS}
+            drones.append(Drone(**fields))
+        registry = cls(drones)
+        registry.settings = settings
+        return registry
+
+    @property
+    def version(self):
+        return self._version
+
+    def add(self, drone):
+        with self._lock:
+            if drone.id in self._by_id:
+                raise ValueError(f"Duplicate drone id {drone.id}")
+            by_id = dict(self._by_id)
+            by_ip = dict(self._by_ip)
+            by_id[drone.id] = drone
+            by_ip[drone.ip] = drone
+            self._by_id, self._by_ip = by_id, by_ip
+            self._changed()
+
+    def remove(self, drone_id):
+        with self._lock:
+            drone = self._by_id.get(drone_id)
+            if drone is None:
+                return None
+            by_id = dict(self._by_id)
+            by_ip = dict(self._by_ip)
+            del by_id[drone_id]
+            by_ip.pop(drone.ip, None)
+            self._by_id, self._by_ip = by_id, by_ip
+            self._changed()
+            return drone
+
+    def get(self, drone_id):
+        return self._by_id.get(drone_id)
+
+    def get_by_ip(self, ip):
+        return self._by_ip.get(ip)
+
+    def all(self):
+        return list(self._by_id.values())
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def update(self, drone_id, **fields):
+        """Sets fields on a drone and returns its new state as a dict, or None if unknown."""
+        with self._lock:
+            drone = self._by_id.get(drone_id)
+            if drone is None:
+                return None
+            if "ip" in fields and fields["ip"] != drone.ip:
+                by_ip = dict(self._by_ip)
+                by_ip.pop(drone.ip, None)
+                by_ip[fields["ip"]] = drone
+                self._by_ip = by_ip
+            for field, value in fields.items():
+                setattr(drone, field, value)
+            self._changed()
+            return drone.to_dict()
+
+    def snapshot(self):
+        """Consistent list of drone dicts, rebuilt only after a change."""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = [drone.to_dict() for drone in self._by_id.values()]
+            return self._snapshot
+
+    def to_json(self):
+        """The snapshot serialized once per fleet version."""
+        with self._lock:
+            if self._json is None:
+                self._json = json.dumps(self.snapshot())
+            return self._json
+
+    def _changed(self):
+        self._version += 1
+        self._snapshot = None
+        self._json = None
@@ -0,0 +1,25 @@
+"""Gunicorn settings for wsgi:app (control, the default) and fanout:app (GUNICORN_ROLE=fanout)."""
+import multiprocessing
+import os
+
+role = os.environ.get('GUNICORN_ROLE', 'control')
+
+# Threaded workers: Flask-SocketIO runs in threading mode with simple-websocket, and
+# the drone sockets, OpenCV and the process pools all expect native threads
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 64))
+
+if role == 'fanout':
+    bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5001')
+    workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+else:
+    bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+    # The fleet state lives in this process: never more than one control worker
+    workers = 1
+
+# Threads and process pools do not survive a fork: load the app in each worker
+preload_app = False
+# Video streams and websockets are long-lived requests
+timeout = 120
+graceful_timeout = 10
+keepalive = 5
@@ -0,0 +1,225 @@
+"""Drone liveness from command outcomes and heartbeats, with a circuit breaker per drone."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Breaker of one drone address.
+
+    closed: requests go through. After failure_threshold consecutive
+    failures it opens: requests fail at once, without touching the network.
+    Once open_timeout has passed it goes half-open and lets a single real
+    request through as a trial, while the background probe checks the drone
+    too. Either success closes it. A failed trial opens it again with twice
+    the timeout, up to max_open_timeout; a failed probe only waits that long
+    before the next probe and leaves the trial to a real request.
+    """
+
+    def __init__(self, open_timeout):
+        self.state = CLOSED
+        self.failures = 0
+        self.open_timeout = open_timeout
+        self.retry_at = 0.0
+        self.trial = False
+        self.last_seen = None
+        self.probed_at = None
+        self.last_error = None
+        self.latency = None
+        self.rejected = 0
+        self.opened = 0
+        self.health = "online"
+
+
+class HealthMonitor:
+    """Tracks per-drone health and decides which requests may reach a drone.
+
+    Callers ask allow(host) before a request and report the outcome with
+    record_success(host, latency) or record_failure(host, error); replies
+    pushed by the drone count through heartbeat(host). A drone is "online",
+    "degraded" (recent failures or replies slower than degraded_latency
+    seconds) or "offline" (breaker open or half-open). on_change(host,
+    previous, health, error) is called on every transition.
+
+    A background thread probes open drones when their timeout expires, and
+    closed ones that have not been heard from in heartbeat_timeout seconds
+    (at most once per heartbeat_timeout, so a silent drone is not probed on
+    every tick), with probe(host) -> bool on a small thread pool.
+    """
+
+    def __init__(self, probe, get_hosts, on_change, failure_threshold=3, open_timeout=2.0, max_open_timeout=60.0,
+                 heartbeat_timeout=30.0, degraded_latency=1.0, tick=0.5, workers=4):
+        self.probe = probe
+        self.get_hosts = get_hosts
+        self.on_change = on_change
+        self.failure_threshold = failure_threshold
+        self.open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.degraded_latency = degraded_latency
+        self.tick = tick
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="health-probe")
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._probing = set()
+        self._stop = threading.Event()
+        self._thread = None
+        self.probes = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def allow(self, host):
+        """True if a request may be sent to host now; False means fail fast."""
+        with self._lock:
+            breaker = self._breaker(host)
+            if breaker.state == CLOSED:
+                return True
+            if breaker.state == OPEN and time.monotonic() >= breaker.retry_at:
+                breaker.state = HALF_OPEN
+                breaker.trial = False
+            if breaker.state == HALF_OPEN and not breaker.trial:
+                breaker.trial = True
+                return True
+            breaker.rejected += 1
+            return False
+
+    def record_success(self, host, latency=None):
+        with self._lock:
+            breaker = self._breaker(host)
+            breaker.state = CLOSED
+            breaker.failures = 0
+            breaker.trial = False
+            breaker.open_timeout = self.open_timeout
+            breaker.last_seen = time.time()
+            if latency is not None:
+                breaker.latency = latency if breaker.latency is None else 0.8 * breaker.latency + 0.2 * latency
+            change = self._transition(host, breaker)
+        self._notify(change)
+
+    def heartbeat(self, host):
+        self.record_success(host)
+
+    def record_failure(self, host, error=None, probe=False):
+        with self._lock:
+            breaker = self._breaker(host)
+            breaker.failures += 1
+            breaker.last_error = error
+            if breaker.state == HALF_OPEN:
+                # Back off longer before the next trial, or only before the next probe
+                breaker.open_timeout = min(breaker.open_timeout * 2, self.max_open_timeout)
+                if probe:
+                    breaker.retry_at = time.monotonic() + breaker.open_timeout
+                else:
+                    breaker.trial = False
+                    self._open(breaker)
+            elif breaker.state == CLOSED and breaker.failures >= self.failure_threshold:
+                breaker.trial = False
+                self._open(breaker)
+            change = self._transition(host, breaker)
+        self._notify(change)
+
+    def health(self, host):
+        breaker = self._breakers.get(host)
+        return breaker.health if breaker is not None else "online"
+
+    def stats(self):
+        with self._lock:
+            return {
+                host: {
+                    "health": breaker.health,
+                    "breaker": breaker.state,
+                    "consecutive_failures": breaker.failures,
+                    "retry_in_s": round(max(0.0, breaker.retry_at - time.monotonic()), 1)
+                    if breaker.state == OPEN else None,
+                    "seconds_since_seen": round(time.time() - breaker.last_seen, 1) if breaker.last_seen else None,
+                    "latency_ms": round(breaker.latency * 1000, 1) if breaker.latency is not None else None,
+                    "rejected": breaker.rejected,
+                    "opened": breaker.opened,
+                    "last_error": breaker.last_error,
+                }
+                for host, breaker in self._breakers.items()
+            }
+
+    def _breaker(self, host):
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(self.open_timeout)
+        return breaker
+
+    def _open(self, breaker):
+        breaker.state = OPEN
+        breaker.retry_at = time.monotonic() + breaker.open_timeout
+        breaker.opened += 1
+
+    def _transition(self, host, breaker):
+        if breaker.state != CLOSED:
+            health = "offline"
+        elif breaker.failures or (breaker.latency is not None and breaker.latency > self.degraded_latency):
+            health = "degraded"
+        else:
+            health = "online"
+        if health == breaker.health:
+            return None
+        previous, breaker.health = breaker.health, health
+        return host, previous, health, breaker.last_error if health != "online" else None
+
+    def _notify(self, change):
+        if change is None:
+            return
+        try:
+            self.on_change(*change)
+        except Exception as e:
+            print(f"Error notificando el estado de salud de {change[0]}: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            due = []
+            with self._lock:
+                for host in self.get_hosts():
+                    breaker = self._breaker(host)
+                    if host in self._probing:
+                        continue
+                    if breaker.state in (OPEN, HALF_OPEN) and now >= breaker.retry_at:
+                        if breaker.state == OPEN:
+                            # The trial slot stays free for the next real request
+                            breaker.state = HALF_OPEN
+                            breaker.trial = False
+                        due.append(host)
+                    elif (breaker.state == CLOSED and breaker.last_seen is not None
+                          and time.time() - breaker.last_seen > self.heartbeat_timeout
+                          and (breaker.probed_at is None or now - breaker.probed_at >= self.heartbeat_timeout)):
+                        breaker.probed_at = now
+                        due.append(host)
+                self._probing.update(due)
+            for host in due:
+                self._executor.submit(self._probe, host)
+            self._stop.wait(self.tick)
+
+    def _probe(self, host):
+        started = time.perf_counter()
+        try:
+            ok = self.probe(host)
+            error = None if ok else "probe failed"
+        except Exception as e:
+            ok, error = False, str(e)
+        finally:
+            with self._lock:
+                self._probing.discard(host)
+                self.probes += 1
+        if ok:
+            self.record_success(host, time.perf_counter() - started)
+        else:
+            self.record_failure(host, error, probe=True)
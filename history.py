@@ -0,0 +1,177 @@
+"""Persistent telemetry and command history in SQLite, written in batches off the request path."""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    drone_id INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    t REAL NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_by_time ON samples (drone_id, metric, t);
+CREATE TABLE IF NOT EXISTS events (
+    drone_id INTEGER NOT NULL,
+    t REAL NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status INTEGER,
+    duration REAL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS events_by_time ON events (drone_id, t);
+"""
+
+
+class HistoryStore:
+    """Time series of numeric samples plus an event log (commands, status changes).
+
+    record_sample() and record_event() only put the row on a bounded queue; a
+    writer thread inserts whatever has accumulated in one transaction, at
+    least every flush_interval seconds. When the queue is full rows are
+    dropped and counted instead of blocking the caller. The database runs in
+    WAL mode, so range queries read while the writer appends.
+    """
+
+    def __init__(self, path, batch_size=1000, flush_interval=1.0, max_queue=100000, retention_days=30):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention_days * 86400 if retention_days else None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.last_error = None
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def record_sample(self, drone_id, metric, value, t=None):
+        self._put(("sample", (drone_id, metric, t or time.time(), float(value))))
+
+    def record_event(self, drone_id, kind, name, status=None, duration=None, detail=None, t=None):
+        if detail is not None and not isinstance(detail, str):
+            detail = json.dumps(detail, separators=(',', ':'), default=str)
+        self._put(("event", (drone_id, t or time.time(), kind, name, status, duration, detail)))
+
+    def samples(self, drone_id, metric, start, end, max_points=500):
+        """Samples in [start, end] averaged into at most max_points buckets.
+
+        Returns rows [t, mean, min, max, count], t being the first sample of the bucket.
+        """
+        bucket = max((end - start) / max(max_points, 1), 1e-6)
+        rows = self._read(
+            "SELECT MIN(t), AVG(value), MIN(value), MAX(value), COUNT(*) FROM samples "
+            "WHERE drone_id = ? AND metric = ? AND t >= ? AND t <= ? "
+            "GROUP BY CAST((t - ?) / ? AS INTEGER) ORDER BY 1",
+            (drone_id, metric, start, end, start, bucket))
+        return [[t, mean, low, high, count] for t, mean, low, high, count in rows]
+
+    def metrics(self, drone_id):
+        return [row[0] for row in self._read("SELECT DISTINCT metric FROM samples WHERE drone_id = ?", (drone_id,))]
+
+    def events(self, drone_id, start, end, kind=None, limit=1000):
+        sql = "SELECT t, kind, name, status, duration, detail FROM events WHERE drone_id = ? AND t >= ? AND t <= ?"
+        params = [drone_id, start, end]
+        if kind:
+            sql += " AND kind = ?"
+            params.append(kind)
+        sql += " ORDER BY t DESC LIMIT ?"
+        params.append(limit)
+        return [{"t": t, "kind": kind, "name": name, "status": status, "duration": duration,
+                 "detail": json.loads(detail) if detail and detail[0] in "[{" else detail}
+                for t, kind, name, status, duration, detail in self._read(sql, params)]
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "size_bytes": sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p)),
+            "last_error": self.last_error,
+        }
+
+    def flush(self):
+        """Writes everything queued so far; returns the number of rows written."""
+        samples, events = [], []
+        while len(samples) + len(events) < self.batch_size:
+            try:
+                kind, row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            (samples if kind == "sample" else events).append(row)
+        if not samples and not events:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?)", samples)
+                    conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", events)
+            finally:
+                conn.close()
+        self.written += len(samples) + len(events)
+        self.batches += 1
+        return len(samples) + len(events)
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        last_prune = 0.0
+        while True:
+            try:
+                # A full batch is written at once; otherwise wait for more rows
+                if self.flush() < self.batch_size:
+                    time.sleep(self.flush_interval)
+                if self.retention and time.time() - last_prune > 3600:
+                    last_prune = time.time()
+                    self._prune(last_prune - self.retention)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error escribiendo el historial: {e}")
+                time.sleep(self.flush_interval)
+
+    def _prune(self, before):
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM samples WHERE t < ?", (before,))
+                    conn.execute("DELETE FROM events WHERE t < ?", (before,))
+            finally:
+                conn.close()
+
+    def _read(self, sql, params):
+        # One read connection per thread, reused across queries
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn.execute(sql, params).fetchall()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
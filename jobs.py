@@ -0,0 +1,133 @@
+"""Background execution of drone commands, tracked by job id."""
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """One drone command and its progress."""
+
+    def __init__(self, drone_id, command, args, priority):
+        self.id = uuid.uuid4().hex
+        self.drone_id = drone_id
+        self.command = command
+        self.args = args
+        self.priority = priority
+        self.state = "queued"
+        self.status_code = None
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "drone_id": self.drone_id,
+            "command": self.command,
+            "args": self.args,
+            "priority": self.priority,
+            "state": self.state,
+            "status_code": self.status_code,
+            "result": self.result,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobManager:
+    """Runs commands on a bounded pool, with a separate lane for priority commands.
+
+    Regular jobs for the same drone run one at a time in submission order, so
+    a go_to queued after a takeoff sees the drone in the air; jobs for
+    different drones run in parallel. Priority jobs skip the drone's queue.
+
+    run(drone_id, command, args) must return (result body, HTTP status). Every
+    state change is passed to on_update(job). Finished jobs beyond max_jobs are
+    forgotten oldest first.
+    """
+
+    def __init__(self, run, on_update=None, workers=8, priority_workers=2, max_jobs=1000):
+        self.run = run
+        self.on_update = on_update
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jobs")
+        self._priority_executor = ThreadPoolExecutor(max_workers=priority_workers,
+                                                     thread_name_prefix="jobs-priority")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        # Regular jobs waiting per drone; a drone has an entry while one of its jobs runs
+        self._queues = {}
+
+    def submit(self, drone_id, command, args=None, priority=False):
+        job = Job(drone_id, command, args, priority)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        self._notify(job)
+        if priority:
+            self._priority_executor.submit(self._execute, job)
+            return job
+        with self._lock:
+            queue = self._queues.get(drone_id)
+            if queue is not None:
+                queue.append(job)
+                return job
+            self._queues[drone_id] = deque()
+        self._executor.submit(self._run_queued, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, drone_id=None, state=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs
+                if (drone_id is None or job.drone_id == drone_id)
+                and (state is None or job.state == state)]
+
+    def _execute(self, job):
+        job.state = "running"
+        job.started = time.time()
+        self._notify(job)
+        try:
+            job.result, job.status_code = self.run(job.drone_id, job.command, job.args)
+        except Exception as e:
+            job.result, job.status_code = {"error": str(e)}, 500
+        job.state = "succeeded" if job.status_code < 400 else "failed"
+        job.finished = time.time()
+        job.done.set()
+        self._notify(job)
+
+    def _run_queued(self, job):
+        """Runs a drone's regular job, then hands its next queued job to the pool."""
+        try:
+            self._execute(job)
+        finally:
+            with self._lock:
+                queue = self._queues[job.drone_id]
+                following = queue.popleft() if queue else None
+                if following is None:
+                    del self._queues[job.drone_id]
+            if following is not None:
+                self._executor.submit(self._run_queued, following)
+
+    def _evict(self):
+        excess = len(self._jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done.is_set()][:excess]:
+            del self._jobs[job_id]
+
+    def _notify(self, job):
+        if self.on_update is not None:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                print(f"Error notificando el trabajo {job.id}: {e}")
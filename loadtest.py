@@ -0,0 +1,230 @@
+"""Load test of the Flask/Socket.IO API against a simulated drone fleet, runnable offline.
+
+Starts a SimulatedFleet on loopback, points the server at it through
+FLEET_CONFIG and drives it in-process: operator threads replay a seeded
+scenario of HTTP requests, the telemetry scheduler polls the fleet and
+Socket.IO test clients receive the broadcasts. The same seed and options
+produce the same scenario, which can also be saved and replayed:
+
+    python loadtest.py --drones 20 --duration 30 --save-scenario scenario.json
+    python loadtest.py --scenario scenario.json --json results.json --max-p99 250
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
+
+from sim_drone import SimulatedFleet
+
+# Operator actions and their relative frequency; reads dominate as in the dashboard
+OPERATOR_MIX = (
+    ("fleet", 40),
+    ("status", 25),
+    ("takeoff", 8),
+    ("go_to", 12),
+    ("patrol", 3),
+    ("land", 8),
+    ("jobs", 4),
+)
+
+
+def build_scenario(seed, duration, drones, operators, rate):
+    """Timed requests of every operator: {"t", "operator", "name", "method", "path", "json"}."""
+    rng = random.Random(seed)
+    names = [name for name, _ in OPERATOR_MIX]
+    weights = [weight for _, weight in OPERATOR_MIX]
+    requests = []
+    for operator in range(operators):
+        t = rng.uniform(0, 1.0 / rate)
+        while t < duration:
+            name = rng.choices(names, weights)[0]
+            drone_id = rng.randint(1, drones)
+            request = {"t": round(t, 4), "operator": operator, "name": name, "method": "POST", "json": None}
+            if name == "fleet":
+                request.update(method="GET", path="/drones")
+            elif name == "status":
+                request.update(method="GET", path=f"/drones/{drone_id}/status")
+            elif name == "jobs":
+                request.update(method="GET", path="/jobs")
+            elif name == "go_to":
+                request.update(path=f"/drones/{drone_id}/go_to?wait=1",
+                               json={"location": [rng.randint(0, 3000), rng.randint(0, 3000), 1000]})
+            else:
+                request.update(path=f"/drones/{drone_id}/{name}?wait=1")
+            requests.append(request)
+            # Poisson arrivals at the operator's rate
+            t += rng.expovariate(rate)
+    requests.sort(key=lambda r: (r["t"], r["operator"]))
+    return {"seed": seed, "duration": duration, "drones": drones, "requests": requests}
+
+
+def run_operator(app, requests, started, samples, lock):
+    client = app.test_client()
+    for request in requests:
+        delay = started + request["t"] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        begin = time.perf_counter()
+        response = client.open(request["path"], method=request["method"], json=request["json"])
+        elapsed = time.perf_counter() - begin
+        response.close()
+        with lock:
+            samples[request["name"]].append((elapsed, response.status_code))
+
+
+def run_viewer(socketio, app, stop, received):
+    client = socketio.test_client(app)
+    while not stop.is_set():
+        for message in client.get_received():
+            payload = json.dumps(message["args"], separators=(',', ':'), default=str)
+            received[message["name"]][0] += 1
+            received[message["name"]][1] += len(payload)
+        stop.wait(0.2)
+    client.disconnect()
+
+
+def summarize(latencies, duration):
+    values = np.asarray(latencies) * 1000
+    return {
+        "count": len(values),
+        "throughput": round(len(values) / duration, 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2) if len(values) else None,
+        "p99_ms": round(float(np.percentile(values, 99)), 2) if len(values) else None,
+        "max_ms": round(float(values.max()), 2) if len(values) else None,
+    }
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the drone server against a simulated fleet.")
+    parser.add_argument("--drones", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated drone reply delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--protocol", choices=("text", "binary"), default="text", help="drone wire protocol")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--operators", type=int, default=4, help="concurrent operators")
+    parser.add_argument("--rate", type=float, default=5.0, help="requests per second per operator")
+    parser.add_argument("--telemetry-interval", type=float, default=1.0,
+                        help="seconds between polls of battery, position and status; 0 disables telemetry")
+    parser.add_argument("--viewers", type=int, default=5, help="Socket.IO dashboard clients")
+    parser.add_argument("--scenario", help="replay the requests saved in this file")
+    parser.add_argument("--save-scenario", help="save the generated requests to this file")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("--max-p99", type=float, help="exit with status 1 if an operation's p99 exceeds this (ms)")
+    args = parser.parse_args()
+
+    if args.scenario:
+        with open(args.scenario) as f:
+            scenario = json.load(f)
+        args.drones, args.seed, args.duration = scenario["drones"], scenario["seed"], scenario["duration"]
+    else:
+        scenario = build_scenario(args.seed, args.duration, args.drones, args.operators, args.rate)
+    if args.save_scenario:
+        with open(args.save_scenario, "w") as f:
+            json.dump(scenario, f)
+
+    sim = SimulatedFleet(args.drones, args.latency, args.jitter, args.loss, seed=args.seed,
+                         protocol=args.protocol).start()
+    config = os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "fleet.json")
+    sim.write_config(config)
+    os.environ["FLEET_CONFIG"] = config
+    os.environ["HISTORY_DB"] = os.path.join(os.path.dirname(config), "history.db")
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = rss_mb()
+    import server
+
+    if args.telemetry_interval > 0:
+        for metric in ("battery", "position", "status"):
+            server.telemetry.set_interval(metric, args.telemetry_interval)
+        server.telemetry.start()
+
+    stop = threading.Event()
+    received = defaultdict(lambda: [0, 0])
+    viewers = [threading.Thread(target=run_viewer, args=(server.socketio, server.app, stop, received), daemon=True)
+               for _ in range(args.viewers)]
+    for viewer in viewers:
+        viewer.start()
+
+    by_operator = defaultdict(list)
+    for request in scenario["requests"]:
+        by_operator[request["operator"]].append(request)
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    started = time.perf_counter()
+    operators = [threading.Thread(target=run_operator, args=(server.app, requests, started, samples, lock))
+                 for requests in by_operator.values()]
+    for operator in operators:
+        operator.start()
+    for operator in operators:
+        operator.join()
+    remaining = started + scenario["duration"] - time.perf_counter()
+    if remaining > 0:
+        time.sleep(remaining)
+    elapsed = time.perf_counter() - started
+    time.sleep(0.5)
+    stop.set()
+    for viewer in viewers:
+        viewer.join()
+    server.telemetry.stop()
+
+    pool = server.drone_pool.stats().values()
+    operations = {name: dict(summarize([latency for latency, _ in values], elapsed),
+                             errors=sum(1 for _, status in values if status >= 500))
+                  for name, values in sorted(samples.items())}
+    results = {
+        "scenario": {"seed": args.seed, "drones": args.drones, "duration": round(elapsed, 2),
+                     "requests": len(scenario["requests"]), "latency": args.latency, "jitter": args.jitter,
+                     "loss": args.loss, "protocol": args.protocol, "telemetry_interval": args.telemetry_interval, "viewers": args.viewers},
+        "http": dict(summarize([latency for values in samples.values() for latency, _ in values], elapsed),
+                     errors=sum(op["errors"] for op in operations.values())),
+        "operations": operations,
+        "drone_commands": {"requests": sum(host["requests"] for host in pool),
+                           "errors": sum(host["errors"] for host in pool),
+                           "throughput": round(sum(host["requests"] for host in pool) / elapsed, 2),
+                           "simulator": sim.stats()},
+        "socketio": {event: {"events": count, "bytes": size, "events_per_s": round(count / elapsed, 2)}
+                     for event, (count, size) in sorted(received.items())},
+        "memory": {"rss_mb": round(rss_mb(), 1), "rss_growth_mb": round(rss_mb() - rss_before, 1),
+                   "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)},
+    }
+    if args.tracemalloc:
+        results["memory"]["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+    sim.stop()
+
+    print(f"\n{'operation':<12}{'count':>8}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, op in list(operations.items()) + [("all", results["http"])]:
+        print(f"{name:<12}{op['count']:>8}{op['throughput']:>9}{op['p50_ms']:>10}{op['p99_ms']:>10}{op['errors']:>8}")
+    print(f"drone commands: {results['drone_commands']}")
+    print(f"socket.io: {results['socketio']}")
+    print(f"memory: {results['memory']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_p99 is not None:
+        slow = [name for name, op in operations.items() if op["p99_ms"] is not None and op["p99_ms"] > args.max_p99]
+        if slow:
+            print(f"p99 above {args.max_p99} ms: {', '.join(slow)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
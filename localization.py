@@ -0,0 +1,175 @@
+"""Drone pose estimation in the map frame from live camera frames with the floor Aruco markers."""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from vision import rotation_to_euler, stack_corners
+from vision_context import create_detector
+
+# Per-process Aruco detectors by dictionary, created on first use
+_detectors = {}
+
+
+def _init_worker():
+    cv.setNumThreads(1)
+
+
+def _detect(gray, roi, dictionary):
+    detector = _detectors.get(dictionary)
+    if detector is None:
+        detector = _detectors[dictionary] = create_detector(dictionary)
+    if roi is not None:
+        x0, y0, x1, y1 = roi
+        corners, ids, _ = detector.detectMarkers(gray[y0:y1, x0:x1])
+        if ids is not None and len(ids):
+            return stack_corners(corners) + (x0, y0), np.asarray(ids).ravel()
+    corners, ids, _ = detector.detectMarkers(gray)
+    if ids is None or not len(ids):
+        return None, None
+    return stack_corners(corners), np.asarray(ids).ravel()
+
+
+def _localize(setup, gray, downscale, frame_scale, roi):
+    """Runs in a pool process: detects known markers and solves the camera pose in the map frame.
+
+    setup is (camera matrix, distortion, dictionary, marker corners) of the
+    testbed the frame belongs to, so one pool serves every testbed.
+    """
+    camera_matrix, dist_coeffs, dictionary, markers = setup
+    corners, ids = _detect(gray, roi, dictionary)
+    if ids is None:
+        return None
+    known = [i for i, marker_id in enumerate(ids) if int(marker_id) in markers]
+    if not known:
+        return None
+
+    object_points = np.concatenate([markers[int(ids[i])] for i in known]).astype(np.float64)
+    image_points = (corners[known].reshape(-1, 2) / downscale).astype(np.float64)
+    camera_matrix = camera_matrix.copy()
+    camera_matrix[:2] *= frame_scale
+    ok, rvec, tvec = cv.solvePnP(object_points, image_points, camera_matrix, dist_coeffs,
+                                 flags=cv.SOLVEPNP_SQPNP if len(known) > 1 else cv.SOLVEPNP_IPPE)
+    if not ok:
+        return None
+
+    R, _ = cv.Rodrigues(rvec)
+    position = (-R.T @ tvec).ravel()
+    hits = corners[known].reshape(-1, 2)
+    return {
+        "position": tuple(float(v) for v in position),
+        "attitude": rotation_to_euler(R.T),
+        "markers": len(known),
+        "bbox": (float(hits[:, 0].min()), float(hits[:, 1].min()),
+                 float(hits[:, 0].max()), float(hits[:, 1].max())),
+    }
+
+
+def _worker_context():
+    """Forkserver context with this module preloaded.
+
+    The fork server imports OpenCV and numpy once and workers start as forks of
+    it, without the threads or sockets of the server process. Workers still
+    re-import __main__, so devserver.py and wsgi.py keep server.py out of it
+    (python server.py works too, at the cost of that extra import).
+    """
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def localizer_pool(workers=2):
+    """Process pool for MarkerLocalizers; several localizers can share one."""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=_worker_context(), initializer=_init_worker)
+
+
+class MarkerLocalizer:
+    """Localizes drones from their camera frames on a process pool.
+
+    Frames are converted to grayscale and downscaled to max_width before they
+    are sent to a worker, and the search is limited to a region around the
+    markers seen in the previous frame. While a frame of a drone is being
+    processed, newer frames of that drone are skipped, so each drone is
+    localized as fast as the pool allows without queueing stale frames.
+    on_pose(drone_id, position, attitude) receives each estimate.
+
+    pool is a localizer_pool() shared with other localizers, which close()
+    leaves running; without one the localizer starts and owns its own.
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, marker_corners, on_pose, workers=2, max_width=640,
+                 roi_margin=0.3, dictionary=cv.aruco.DICT_6X6_250, calibration_width=None, pool=None):
+        self.on_pose = on_pose
+        self.max_width = max_width
+        self.roi_margin = roi_margin
+        # Frames of a different resolution than the calibration images rescale the intrinsics
+        self.calibration_width = calibration_width or 2 * float(camera_matrix[0, 2])
+        self._setup = (camera_matrix, dist_coeffs, dictionary, marker_corners)
+        self._owns_pool = pool is None
+        self._pool = localizer_pool(workers) if pool is None else pool
+        self._closed = False
+        self._lock = threading.Lock()
+        self._busy = set()
+        self._roi = {}
+        self.processed = 0
+        self.skipped = 0
+        self.lost = 0
+
+    def submit(self, drone_id, frame):
+        with self._lock:
+            if drone_id in self._busy:
+                self.skipped += 1
+                return None
+            self._busy.add(drone_id)
+        try:
+            gray = frame if frame.ndim == 2 else cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+            height, width = gray.shape
+            downscale = min(1.0, self.max_width / width)
+            if downscale < 1.0:
+                gray = cv.resize(gray, (round(width * downscale), round(height * downscale)),
+                                 interpolation=cv.INTER_AREA)
+            future = self._pool.submit(_localize, self._setup, gray, downscale, width / self.calibration_width,
+                                       self._roi.get(drone_id))
+        except Exception:
+            with self._lock:
+                self._busy.discard(drone_id)
+            raise
+        future.add_done_callback(lambda f: self._done(drone_id, gray.shape, f))
+        return future
+
+    def stats(self):
+        return {"processed": self.processed, "skipped": self.skipped, "lost": self.lost,
+                "tracking": sorted(self._roi)}
+
+    def close(self):
+        """Stops reporting poses; frames still in a shared pool finish there and are ignored."""
+        self._closed = True
+        if self._owns_pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _done(self, drone_id, shape, future):
+        with self._lock:
+            self._busy.discard(drone_id)
+        if self._closed:
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Error localizando el dron {drone_id}: {e}")
+            return
+        self.processed += 1
+        if result is None:
+            self.lost += 1
+            self._roi.pop(drone_id, None)
+            return
+
+        # Next frame: search only around the markers seen in this one
+        x0, y0, x1, y1 = result["bbox"]
+        margin_x = (x1 - x0) * self.roi_margin + 16
+        margin_y = (y1 - y0) * self.roi_margin + 16
+        height, width = shape
+        self._roi[drone_id] = (int(max(0, x0 - margin_x)), int(max(0, y0 - margin_y)),
+                               int(min(width, x1 + margin_x)), int(min(height, y1 + margin_y)))
+        self.on_pose(drone_id, result["position"], result["attitude"])
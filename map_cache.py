@@ -0,0 +1,92 @@
+"""Caches results derived from files until those files change."""
+import hashlib
+import os
+import threading
+
+HASH_CHUNK = 1 << 20
+
+
+class FileFingerprints:
+    """Fingerprints files by mtime, size and content hash, hashing only after a stat change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes = {}
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return (path, None, None, None)
+
+        stat_key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached and cached[0] == stat_key:
+            digest = cached[1]
+        else:
+            digest = _sha256(path)
+            with self._lock:
+                self._hashes[path] = (stat_key, digest)
+        return (path, st.st_mtime_ns, st.st_size, digest)
+
+
+class FingerprintCache:
+    """Holds the result of compute() keyed on the fingerprints of the files it reads.
+
+    paths is a callable so the cache follows the module constants if they are
+    reassigned. A changed, added or removed file invalidates the cached value.
+    A None result (a failed computation) is not kept, so the next get() tries again.
+    """
+
+    def __init__(self, compute, paths, fingerprints=None):
+        self.compute = compute
+        self.paths = paths
+        self.fingerprints = fingerprints or FileFingerprints()
+        self._lock = threading.Lock()
+        self._entry = (None, None)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self):
+        return tuple(self.fingerprints.get(path) for path in self.paths())
+
+    def get(self):
+        key = self.key()
+        cached_key, value = self._entry
+        if key == cached_key:
+            self.hits += 1
+            return value
+        with self._lock:
+            # Another thread may have computed it while we were waiting
+            cached_key, value = self._entry
+            if key == cached_key:
+                self.hits += 1
+                return value
+            return self._store(key)
+
+    def refresh(self):
+        """Recomputes the value regardless of the fingerprints."""
+        with self._lock:
+            return self._store(self.key())
+
+    def warm(self):
+        """Computes the value in the background so the first request is fast."""
+        thread = threading.Thread(target=self.get, name="map-cache-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def _store(self, key):
+        self.misses += 1
+        value = self.compute()
+        if value is not None:
+            self._entry = (key, value)
+        return value
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
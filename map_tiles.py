@@ -0,0 +1,149 @@
+"""Downscaled variants and a slippy-map tile pyramid of a map image, cached on disk per map version."""
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import cv2 as cv
+
+from map_cache import FileFingerprints
+
+
+class MapVariants:
+    """Generates resized copies and 256px tiles of an image once per content version.
+
+    Files live under cache_dir/<version>/, where version is a prefix of the
+    image's SHA-256, so a changed map gets a fresh directory and stale
+    variants are never served. The tile layout of the last max_pyramids
+    versions (one per testbed map in use) is kept in memory.
+    """
+
+    def __init__(self, cache_dir, fingerprints=None, tile_size=256, width_step=128, quality=85, max_pyramids=2):
+        self.cache_dir = cache_dir
+        self.fingerprints = fingerprints or FileFingerprints()
+        self.tile_size = tile_size
+        self.width_step = width_step
+        self.quality = quality
+        self._lock = threading.Lock()
+        self.max_pyramids = max_pyramids
+        self._pyramids = OrderedDict()
+        # (version, (width, height)) of each image, so sizes are only decoded once per version
+        self._sizes = {}
+
+    def version(self, path):
+        """(version id, mtime) of the image, or None if it does not exist."""
+        _, mtime_ns, _, digest = self.fingerprints.get(path)
+        if digest is None:
+            return None
+        return digest[:16], mtime_ns / 1e9
+
+    def resized(self, path, width):
+        """Path of a JPEG copy whose width is rounded up to width_step, or the original if not smaller."""
+        version, _ = self.version(path)
+        width = self.width_step * math.ceil(max(width, 1) / self.width_step)
+        size = self._size(path, version)
+        if size is not None and width >= size[0]:
+            return path
+        target = os.path.join(self.cache_dir, version, f"w{width}.jpg")
+        if os.path.exists(target):
+            return target
+        with self._lock:
+            if os.path.exists(target):
+                return target
+            image = cv.imread(path)
+            if image is None:
+                raise ValueError(f"Cannot read map image: {path}")
+            height_px, width_px = image.shape[:2]
+            self._sizes[path] = (version, (width_px, height_px))
+            if width >= width_px:
+                return path
+            height = max(1, round(height_px * width / width_px))
+            self._write(target, cv.resize(image, (width, height), interpolation=cv.INTER_AREA))
+            return target
+
+    def tile_info(self, path):
+        version, _ = self.version(path)
+        pyramid = self._pyramid(path, version)
+        return {
+            "version": version,
+            "tile_size": self.tile_size,
+            "min_zoom": 0,
+            "max_zoom": pyramid["max_zoom"],
+            "width": pyramid["width"],
+            "height": pyramid["height"],
+        }
+
+    def tile(self, path, z, x, y):
+        """Path of tile (z, x, y), or None if it is outside the pyramid."""
+        version, _ = self.version(path)
+        pyramid = self._pyramid(path, version)
+        if not 0 <= z <= pyramid["max_zoom"]:
+            return None
+        cols, rows = pyramid["grid"][z]
+        if not (0 <= x < cols and 0 <= y < rows):
+            return None
+        return os.path.join(self.cache_dir, version, "tiles", str(z), str(x), f"{y}.jpg")
+
+    def _size(self, path, version):
+        """(width, height) of the image if known for this version, from a resize or the pyramid."""
+        cached = self._sizes.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        pyramid = self._pyramids.get(version)
+        return (pyramid["width"], pyramid["height"]) if pyramid is not None else None
+
+    def _pyramid(self, path, version):
+        pyramid = self._pyramids.get(version)
+        if pyramid is not None:
+            # Hits do not wait for the lock, which is held while another version builds
+            try:
+                self._pyramids.move_to_end(version)
+            except KeyError:
+                pass
+            return pyramid
+        with self._lock:
+            pyramid = self._pyramids.get(version)
+            if pyramid is not None:
+                return pyramid
+            pyramid = self._build_pyramid(path, version)
+            self._pyramids[version] = pyramid
+            while len(self._pyramids) > self.max_pyramids:
+                self._pyramids.popitem(last=False)
+        return pyramid
+
+    def _build_pyramid(self, path, version):
+        image = cv.imread(path)
+        if image is None:
+            raise ValueError(f"Cannot read map image: {path}")
+        height, width = image.shape[:2]
+        size = self.tile_size
+        max_zoom = max(0, math.ceil(math.log2(max(width, height) / size)))
+        marker = os.path.join(self.cache_dir, version, "tiles", "complete")
+
+        grid = {}
+        level = image
+        for z in range(max_zoom, -1, -1):
+            level_h, level_w = level.shape[:2]
+            cols, rows = math.ceil(level_w / size), math.ceil(level_h / size)
+            grid[z] = (cols, rows)
+            if not os.path.exists(marker):
+                # Pad the right and bottom edges so every tile is tile_size square
+                padded = cv.copyMakeBorder(level, 0, rows * size - level_h, 0, cols * size - level_w,
+                                           cv.BORDER_CONSTANT, value=(255, 255, 255))
+                for x in range(cols):
+                    for y in range(rows):
+                        tile = padded[y * size:(y + 1) * size, x * size:(x + 1) * size]
+                        self._write(os.path.join(self.cache_dir, version, "tiles", str(z), str(x), f"{y}.jpg"), tile)
+            if z > 0:
+                level = cv.resize(level, (max(1, level_w // 2), max(1, level_h // 2)), interpolation=cv.INTER_AREA)
+
+        if not os.path.exists(marker):
+            open(marker, 'w').close()
+        return {"max_zoom": max_zoom, "width": width, "height": height, "grid": grid}
+
+    def _write(self, target, image):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{threading.get_ident()}.tmp.jpg"
+        if not cv.imwrite(tmp, image, [cv.IMWRITE_JPEG_QUALITY, self.quality]):
+            raise ValueError(f"Cannot write {target}")
+        os.replace(tmp, target)
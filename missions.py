@@ -0,0 +1,433 @@
+"""Patrol missions: coverage routes over the occupancy grid, split between drones, streamed as waypoints."""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from planner import plan_path, simplify
+
+
+def partition_cells(cells, seeds, weights=None, iterations=30):
+    """Splits cells (N, 2) between len(seeds) drones; returns the label of every cell.
+
+    Lloyd (k-means) iterations starting from the drones' cells, on a power
+    diagram whose offsets are adjusted so each drone gets a share of the area
+    proportional to its weight (its usable battery).
+    """
+    cells = np.asarray(cells, dtype=np.float64)
+    centroids = np.asarray(seeds, dtype=np.float64).copy()
+    k = len(centroids)
+    if k == 1 or len(cells) == 0:
+        return np.zeros(len(cells), dtype=np.int64)
+    weights = np.ones(k) if weights is None else np.maximum(np.asarray(weights, dtype=np.float64), 1e-6)
+    targets = len(cells) * weights / weights.sum()
+    offsets = np.zeros(k)
+    spread = float(np.ptp(cells, axis=0).max() ** 2) or 1.0
+    for _ in range(iterations):
+        d2 = ((cells[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2) - offsets
+        labels = d2.argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        for axis in range(2):
+            sums = np.bincount(labels, weights=cells[:, axis], minlength=k)
+            centroids[:, axis] = np.where(counts > 0, sums / np.maximum(counts, 1), centroids[:, axis])
+        # Grow the offset of drones below their share, shrink the ones above
+        offsets += 0.5 * spread * (targets - counts) / len(cells)
+    d2 = ((cells[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2) - offsets
+    return d2.argmin(axis=1)
+
+
+def sweep_segments(mask, spacing):
+    """Boustrophedon segments (row, first col, last col) covering mask, one sweep row every spacing rows."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return []
+    segments = []
+    for row in range(int(rows[0]) + spacing // 2, int(rows[-1]) + 1, spacing):
+        band = mask[max(0, row - spacing // 2):row + spacing - spacing // 2].any(axis=0)
+        edges = np.diff(np.concatenate(([0], band.astype(np.int8), [0])))
+        starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+        segments.extend((row, int(c0), int(c1)) for c0, c1 in zip(starts, ends))
+    if not segments:
+        row = int(rows[len(rows) // 2])
+        cols = np.flatnonzero(mask[row])
+        segments = [(row, int(cols[0]), int(cols[-1]))]
+    return segments
+
+
+class Route:
+    """Waypoints of one drone and, for each one, the band of cells it finishes covering."""
+
+    def __init__(self, cells, covers, length_cells, area_cells, truncated):
+        self.cells = cells              # [(row, col)] in flight order
+        self.covers = covers            # per waypoint: (r0, r1, c0, c1) or None for transit points
+        self.length_cells = length_cells
+        self.area_cells = area_cells
+        self.truncated = truncated
+
+
+def coverage_route(grid, mask, start, spacing, max_length_cells=None):
+    """Snake route over the cells of mask starting near start, cut where the battery budget runs out."""
+    segments = sweep_segments(mask, spacing)
+    if not segments:
+        return Route([], [], 0.0, 0, False)
+    # Start from the end of the area closest to the drone
+    if abs(segments[-1][0] - start[0]) < abs(segments[0][0] - start[0]):
+        segments = segments[::-1]
+    flip = abs(segments[0][2] - start[1]) < abs(segments[0][1] - start[1])
+
+    cells, covers = [], []
+    half = spacing // 2
+    position = start
+    for index, (row, c0, c1) in enumerate(segments):
+        begin, end = ((row, c1), (row, c0)) if (index % 2 == 1) != flip else ((row, c0), (row, c1))
+        begin = grid.nearest_free(begin) or begin
+        end = grid.nearest_free(end) or end
+        for cell in _transit(grid, position, begin):
+            cells.append(cell)
+            covers.append(None)
+        cells.append(begin)
+        covers.append(None)
+        cells.append(end)
+        covers.append((max(0, row - half), row + spacing - half, c0, c1))
+        position = end
+
+    points = np.array([start] + cells, dtype=np.float64)
+    legs = np.hypot(*np.diff(points, axis=0).T)
+    travelled = np.cumsum(legs)
+    truncated = False
+    if max_length_cells is not None:
+        # Keep enough battery to fly straight back to the start from the last waypoint
+        back = np.hypot(*(points[1:] - points[0]).T)
+        keep = int(np.searchsorted(travelled + back > max_length_cells, True))
+        truncated = keep < len(cells)
+        cells, covers, travelled = cells[:keep], covers[:keep], travelled[:keep]
+    area = int(sum(mask[r0:r1, c0:c1 + 1].sum() for r0, r1, c0, c1 in filter(None, covers)))
+    return Route(cells, covers, float(travelled[-1]) if len(travelled) else 0.0, area, truncated)
+
+
+def _transit(grid, src, dst):
+    """Intermediate cells to fly from src to dst without crossing obstacles (empty if the line is free)."""
+    steps = int(max(abs(dst[0] - src[0]), abs(dst[1] - src[1]))) + 1
+    rows = np.linspace(src[0], dst[0], steps).round().astype(int)
+    cols = np.linspace(src[1], dst[1], steps).round().astype(int)
+    if grid.free[rows, cols].all():
+        return []
+    start = grid.nearest_free(tuple(src))
+    if start is None or not grid.free[dst]:
+        return []
+    path = plan_path(grid, start, tuple(dst))
+    return [cell for _, cell in simplify(path)[1:-1]] if path else []
+
+
+class RoutePlanner:
+    """Plans the routes of a mission, caching results per grid (map version) and request."""
+
+    def __init__(self, cache_size=64):
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._grid = None
+        self._cells = None
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def plan(self, grid, starts, budgets, spacing, area=None):
+        """Routes for drones starting at starts {drone_id: cell} with budgets {drone_id: cells of flight}.
+
+        area is a boolean mask of the cells still to cover (all free cells by default).
+        """
+        drone_ids = sorted(starts)
+        key = (tuple((d, starts[d], round(budgets[d], -1)) for d in drone_ids), spacing,
+               None if area is None else hash(np.packbits(area).tobytes()))
+        with self._lock:
+            if self._grid is not grid:
+                self._grid, self._cache = grid, OrderedDict()
+                self._cells = np.argwhere(grid.free)
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            free_cells = self._cells
+        self.misses += 1
+
+        cells = free_cells if area is None else free_cells[area[free_cells[:, 0], free_cells[:, 1]]]
+        labels = partition_cells(cells, [starts[d] for d in drone_ids], [budgets[d] for d in drone_ids])
+        routes = {}
+        for index, drone_id in enumerate(drone_ids):
+            mask = np.zeros(grid.free.shape, dtype=bool)
+            mine = cells[labels == index]
+            mask[mine[:, 0], mine[:, 1]] = True
+            routes[drone_id] = coverage_route(grid, mask, starts[drone_id], spacing, budgets[drone_id])
+        with self._lock:
+            if self._grid is grid:
+                self._cache[key] = routes
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return routes
+
+
+class DroneMission:
+    """Progress of one drone along its route."""
+
+    def __init__(self, drone_id, route, waypoints_mm):
+        self.drone_id = drone_id
+        self.route = route
+        self.waypoints_mm = waypoints_mm
+        self.index = 0
+        self.state = "pending"
+        self.sent_at = None
+        self.failures = 0
+        self.pending = None
+        # Send from a previous plan that is still running: waited for, its result is ignored
+        self.superseded = None
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "drone_id": self.drone_id,
+            "state": self.state,
+            "error": self.error,
+            "waypoint": self.index,
+            "waypoints": len(self.waypoints_mm),
+            "length_cells": round(self.route.length_cells, 1),
+            "area_cells": self.route.area_cells,
+            "truncated": self.route.truncated,
+            "next": self.waypoints_mm[self.index] if self.index < len(self.waypoints_mm) else None,
+        }
+
+
+class Mission:
+    def __init__(self, grid, area, spacing, testbed=None):
+        self.id = uuid.uuid4().hex
+        self.testbed = testbed
+        self.grid = grid
+        self.area = area
+        self.spacing = spacing
+        self.covered = np.zeros(grid.free.shape, dtype=bool)
+        self.drones = {}
+        self.state = "active"
+        self.created = time.time()
+        self.finished = None
+        self.replans = 0
+        self.planning_ms = None
+
+    def coverage(self):
+        total = int(self.area.sum())
+        return round(float((self.covered & self.area).sum()) / total, 4) if total else 1.0
+
+    def to_dict(self, waypoints=False):
+        drones = {}
+        for drone_id, drone_mission in self.drones.items():
+            drones[drone_id] = drone_mission.to_dict()
+            if waypoints:
+                drones[drone_id]["waypoints_mm"] = drone_mission.waypoints_mm
+        return {
+            "mission_id": self.id,
+            "testbed": self.testbed,
+            "state": self.state,
+            "spacing_cells": self.spacing,
+            "coverage": self.coverage(),
+            "replans": self.replans,
+            "planning_ms": self.planning_ms,
+            "created": self.created,
+            "finished": self.finished,
+            "drones": drones,
+        }
+
+
+class MissionEngine:
+    """Runs missions: sends each drone its next waypoint once it reaches the current one.
+
+    plan(mission, drone_ids, area) returns {drone_id: (Route, waypoints_mm)};
+    send_waypoint(drone, waypoint_mm) flies a drone to a waypoint and returns
+    True on success. A drone that goes into emergency, leaves the fleet, keeps
+    failing or is no longer fit_to_fly(drone) is dropped and the area it had
+    left is re-planned among the others. pose_age(drone) gives the seconds since
+    the drone's last position update (None if it never had one); a flying drone
+    without updates for pose_timeout seconds can't be followed and is dropped
+    too. on_update(mission dict) is called on every change.
+    """
+
+    def __init__(self, fleet, plan, send_waypoint, on_update, tolerance_mm=150, tick=0.2,
+                 waypoint_timeout=60, max_failures=3, workers=8, max_missions=100, fit_to_fly=None,
+                 pose_age=None, pose_timeout=5):
+        self.fleet = fleet
+        self.fit_to_fly = fit_to_fly
+        self.pose_age = pose_age
+        self.pose_timeout = pose_timeout
+        self.plan = plan
+        self.send_waypoint = send_waypoint
+        self.on_update = on_update
+        self.tolerance_mm = tolerance_mm
+        self.tick = tick
+        self.waypoint_timeout = waypoint_timeout
+        self.max_failures = max_failures
+        self.max_missions = max_missions
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mission")
+        self._lock = threading.RLock()
+        self._missions = OrderedDict()
+        self._thread = None
+
+    def start(self, grid, drone_ids, spacing, area=None, testbed=None):
+        mission = Mission(grid, grid.free.copy() if area is None else area & grid.free, spacing, testbed)
+        self._assign(mission, drone_ids)
+        with self._lock:
+            self._missions[mission.id] = mission
+            while len(self._missions) > self.max_missions:
+                oldest = next(iter(self._missions.values()))
+                if oldest.state == "active":
+                    break
+                self._missions.popitem(last=False)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mission-engine", daemon=True)
+                self._thread.start()
+        self._notify(mission)
+        return mission
+
+    def get(self, mission_id):
+        return self._missions.get(mission_id)
+
+    def list(self):
+        return list(self._missions.values())
+
+    def abort(self, mission_id):
+        with self._lock:
+            mission = self._missions.get(mission_id)
+            if mission is None or mission.state != "active":
+                return mission
+            mission.state = "aborted"
+            mission.finished = time.time()
+            for drone_mission in mission.drones.values():
+                if drone_mission.state in ("pending", "active"):
+                    drone_mission.state = "aborted"
+        self._notify(mission)
+        return mission
+
+    def drop(self, mission_id, drone_id, error=None):
+        """Takes a drone out of a mission and re-plans what it had left among the others."""
+        with self._lock:
+            mission = self._missions.get(mission_id)
+            if mission is None or drone_id not in mission.drones or mission.state != "active":
+                return mission
+            dropped = mission.drones[drone_id]
+            dropped.state = "dropped"
+            dropped.error = error or dropped.error
+            if dropped.pending is not None:
+                dropped.pending.cancel()
+            remaining = [d for d, m in mission.drones.items() if m.state in ("pending", "active", "completed")]
+            if remaining:
+                self._assign(mission, remaining, mission.area & ~mission.covered)
+                mission.replans += 1
+            else:
+                mission.state = "failed"
+                mission.finished = time.time()
+        self._notify(mission)
+        return mission
+
+    def _assign(self, mission, drone_ids, area=None):
+        started = time.perf_counter()
+        plans = self.plan(mission, drone_ids, area)
+        mission.planning_ms = round((time.perf_counter() - started) * 1000, 2)
+        for drone_id, (route, waypoints_mm) in plans.items():
+            drone_mission = DroneMission(drone_id, route, waypoints_mm)
+            previous = mission.drones.get(drone_id)
+            if previous is not None:
+                # A waypoint of the old plan still being sent delays the new route but doesn't count
+                in_flight = previous.pending if previous.pending is not None else previous.superseded
+                if in_flight is not None and not in_flight.cancel():
+                    drone_mission.superseded = in_flight
+            mission.drones[drone_id] = drone_mission
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            with self._lock:
+                missions = [m for m in self._missions.values() if m.state == "active"]
+            for mission in missions:
+                try:
+                    self._step(mission)
+                except Exception as e:
+                    print(f"Error en la misión {mission.id}: {e}")
+
+    def _step(self, mission):
+        changed = False
+        to_drop = []
+        with self._lock:
+            for drone_id, drone_mission in mission.drones.items():
+                if drone_mission.state not in ("pending", "active"):
+                    continue
+                drone = self.fleet.get(drone_id)
+                if (drone is None or drone.status == "emergency" or drone_mission.failures >= self.max_failures
+                        or (self.fit_to_fly is not None and not self.fit_to_fly(drone))):
+                    to_drop.append((drone_id, None))
+                    continue
+                if drone_mission.superseded is not None:
+                    if not drone_mission.superseded.done():
+                        continue
+                    drone_mission.superseded = None
+                if drone_mission.pending is not None:
+                    if not drone_mission.pending.done():
+                        continue
+                    ok = drone_mission.pending.exception() is None and drone_mission.pending.result()
+                    drone_mission.pending = None
+                    if not ok:
+                        drone_mission.failures += 1
+                        drone_mission.sent_at = None
+                        continue
+                    # The drone accepted the waypoint: its timeout and the pose check start now
+                    drone_mission.sent_at = time.monotonic()
+                if drone_mission.sent_at is not None and self.pose_age is not None:
+                    age = self.pose_age(drone)
+                    if ((age is None or age > self.pose_timeout)
+                            and time.monotonic() - drone_mission.sent_at > self.pose_timeout):
+                        to_drop.append((drone_id, "No position updates: enable pose tracking or the camera"))
+                        continue
+                if drone_mission.index >= len(drone_mission.waypoints_mm):
+                    drone_mission.state = "completed"
+                    changed = True
+                    continue
+                target = drone_mission.waypoints_mm[drone_mission.index]
+                if drone_mission.sent_at is not None and _reached(drone.location, target, self.tolerance_mm):
+                    # Waypoint reached: the band it closes is covered, go for the next one
+                    cover = drone_mission.route.covers[drone_mission.index]
+                    if cover is not None:
+                        r0, r1, c0, c1 = cover
+                        mission.covered[r0:r1, c0:c1 + 1] |= mission.grid.free[r0:r1, c0:c1 + 1]
+                    drone_mission.index += 1
+                    drone_mission.sent_at = None
+                    drone_mission.failures = 0
+                    changed = True
+                    if drone_mission.index >= len(drone_mission.waypoints_mm):
+                        drone_mission.state = "completed"
+                        continue
+                    target = drone_mission.waypoints_mm[drone_mission.index]
+                expired = (drone_mission.sent_at is not None
+                           and time.monotonic() - drone_mission.sent_at > self.waypoint_timeout)
+                if drone_mission.sent_at is None or expired:
+                    if expired:
+                        drone_mission.failures += 1
+                    drone_mission.state = "active"
+                    drone_mission.sent_at = time.monotonic()
+                    drone_mission.pending = self._executor.submit(self.send_waypoint, drone, target)
+            if not to_drop and all(m.state not in ("pending", "active") for m in mission.drones.values()):
+                mission.state = "completed"
+                mission.finished = time.time()
+                changed = True
+        for drone_id, error in to_drop:
+            self.drop(mission.id, drone_id, error)
+        if changed:
+            self._notify(mission)
+
+    def _notify(self, mission):
+        try:
+            self.on_update(mission.to_dict())
+        except Exception as e:
+            print(f"Error notificando la misión {mission.id}: {e}")
+
+
+def _reached(location, target, tolerance):
+    return ((location[0] - target[0]) ** 2 + (location[1] - target[1]) ** 2) <= tolerance ** 2
@@ -0,0 +1,189 @@
+"""Collision-aware path planning for the fleet on an occupancy grid built from the grid map."""
+import heapq
+import math
+from collections import deque
+
+import cv2 as cv
+import numpy as np
+
+# 8-connected moves plus waiting in place
+MOVES = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+WAIT = (0, 0)
+
+
+class OccupancyGrid:
+    """Free/blocked cells of the map with their clearance to the nearest obstacle.
+
+    Cells are cell_px pixels wide. A cell is blocked when its mean intensity is
+    below obstacle_threshold (dark = obstacle) or when it is closer than
+    robot_radius cells to an obstacle.
+    """
+
+    def __init__(self, free, clearance, cell_px, image_size):
+        self.free = free
+        self.clearance = clearance
+        self.cell_px = cell_px
+        self.image_size = image_size
+        self.rows, self.cols = free.shape
+        self._distances = {}
+
+    @classmethod
+    def from_image(cls, gray, cell_px, obstacle_threshold=80, robot_radius=1.0):
+        height, width = gray.shape[:2]
+        cols, rows = max(1, math.ceil(width / cell_px)), max(1, math.ceil(height / cell_px))
+        small = cv.resize(gray, (cols, rows), interpolation=cv.INTER_AREA)
+        obstacles = small < obstacle_threshold
+        # Distance (in cells) from every cell to the closest obstacle
+        clearance = cv.distanceTransform((~obstacles).astype(np.uint8), cv.DIST_L2, 5)
+        if not obstacles.any():
+            clearance[:] = np.inf
+        free = clearance > robot_radius
+        return cls(free, clearance, cell_px, (width, height))
+
+    def cell_of(self, pixel):
+        col = int(min(max(pixel[0] // self.cell_px, 0), self.cols - 1))
+        row = int(min(max(pixel[1] // self.cell_px, 0), self.rows - 1))
+        return row, col
+
+    def pixel_of(self, cell):
+        return ((cell[1] + 0.5) * self.cell_px, (cell[0] + 0.5) * self.cell_px)
+
+    def nearest_free(self, cell):
+        """The closest free cell to cell (itself if free), by breadth-first search."""
+        if self.free[cell]:
+            return cell
+        seen = {cell}
+        queue = deque([cell])
+        while queue:
+            r, c = queue.popleft()
+            for dr, dc in MOVES:
+                nxt = (r + dr, c + dc)
+                if 0 <= nxt[0] < self.rows and 0 <= nxt[1] < self.cols and nxt not in seen:
+                    if self.free[nxt]:
+                        return nxt
+                    seen.add(nxt)
+                    queue.append(nxt)
+        return None
+
+    def distances_to(self, goal):
+        """Steps from every free cell to goal (-1 if unreachable), cached per goal."""
+        dist = self._distances.get(goal)
+        if dist is not None:
+            return dist
+        dist = np.full(self.free.shape, -1, dtype=np.int32)
+        dist[goal] = 0
+        queue = deque([goal])
+        free = self.free
+        rows, cols = self.rows, self.cols
+        while queue:
+            r, c = queue.popleft()
+            d = dist[r, c] + 1
+            for dr, dc in MOVES:
+                nr, nc = r + dr, c + dc
+                if 0 <= nr < rows and 0 <= nc < cols and free[nr, nc] and dist[nr, nc] < 0:
+                    dist[nr, nc] = d
+                    queue.append((nr, nc))
+        if len(self._distances) > 256:
+            self._distances.clear()
+        self._distances[goal] = dist
+        return dist
+
+
+class Reservations:
+    """Space-time reservations of the paths already planned."""
+
+    def __init__(self):
+        self.vertices = set()
+        self.edges = set()
+        self.parked = {}
+        self.last_use = {}
+
+    def add_path(self, path):
+        for t, cell in enumerate(path):
+            self.vertices.add((cell, t))
+            self.last_use[cell] = max(self.last_use.get(cell, -1), t)
+            if t > 0:
+                self.edges.add((path[t - 1], cell, t - 1))
+        # The drone stays at its goal once it arrives
+        self.parked[path[-1]] = len(path) - 1
+
+    def blocked(self, cell, t):
+        if (cell, t) in self.vertices:
+            return True
+        parked_at = self.parked.get(cell)
+        return parked_at is not None and t >= parked_at
+
+    def swap(self, src, dst, t):
+        return (dst, src, t) in self.edges
+
+
+def plan_path(grid, start, goal, reservations=None, max_steps=None):
+    """Space-time A* from start to goal avoiding reservations; returns one cell per time step."""
+    reservations = reservations or Reservations()
+    dist = grid.distances_to(goal)
+    if dist[start] < 0:
+        return None
+    if max_steps is None:
+        max_steps = int(dist[start]) * 2 + grid.rows + grid.cols
+
+    open_set = [(int(dist[start]), 0, start)]
+    parents = {(start, 0): None}
+    while open_set:
+        _, t, cell = heapq.heappop(open_set)
+        if cell == goal and t >= reservations.last_use.get(goal, -1):
+            path = []
+            state = (cell, t)
+            while state is not None:
+                path.append(state[0])
+                state = parents[state]
+            return path[::-1]
+        if t >= max_steps:
+            continue
+        for dr, dc in MOVES + (WAIT,):
+            nxt = (cell[0] + dr, cell[1] + dc)
+            if not (0 <= nxt[0] < grid.rows and 0 <= nxt[1] < grid.cols):
+                continue
+            h = dist[nxt]
+            if h < 0 or (nxt, t + 1) in parents:
+                continue
+            if reservations.blocked(nxt, t + 1) or reservations.swap(cell, nxt, t):
+                continue
+            parents[(nxt, t + 1)] = (cell, t)
+            heapq.heappush(open_set, (t + 1 + int(h), t + 1, nxt))
+    return None
+
+
+def plan_fleet(grid, requests):
+    """Prioritized planning: drones are planned in order, each avoiding the ones before it.
+
+    requests is a list of (drone_id, start_cell, goal_cell). Returns a dict
+    drone_id -> path (list of cells, one per time step) or None.
+    """
+    reservations = Reservations()
+    paths = {}
+    for drone_id, start, goal in requests:
+        path = plan_path(grid, start, goal, reservations)
+        paths[drone_id] = path
+        if path is not None:
+            reservations.add_path(path)
+    return paths
+
+
+def simplify(path):
+    """Waypoints of a path as (step, cell): the start, the goal and every cell where the motion changes.
+
+    Waits count as a motion, so a hold keeps a waypoint where it starts and
+    one where it ends. Between two waypoints the drone moves in a straight
+    line, one cell per step, so flying to each waypoint by its step follows
+    the planned path in time and keeps clear of the other drones' reservations.
+    """
+    if len(path) <= 2:
+        return list(enumerate(path))
+    waypoints = [(0, path[0])]
+    for t in range(1, len(path) - 1):
+        before = (path[t][0] - path[t - 1][0], path[t][1] - path[t - 1][1])
+        after = (path[t + 1][0] - path[t][0], path[t + 1][1] - path[t][1])
+        if before != after:
+            waypoints.append((t, path[t]))
+    waypoints.append((len(path) - 1, path[-1]))
+    return waypoints
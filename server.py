@@ -1,16 +1,43 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g, has_request_context
 from flask_cors import CORS
 from flask_socketio import SocketIO
-from PIL import Image
 
+import fcntl
+import itertools
+import json
 import socket
 import time
-import errno
 import threading
+import uuid
 import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import cv2 as cv
 import numpy as np
 
+from battery import BatteryModel
+from broadcast import DroneBroadcaster, register_room_handlers
+from drone_pool import DronePool
+from drone_protocol import InvalidCommand, encode_command
+from fleet import FleetRegistry
+from health import HealthMonitor
+from history import HistoryStore
+from jobs import JobManager
+from map_cache import FileFingerprints, FingerprintCache
+from localization import MarkerLocalizer, localizer_pool
+from map_tiles import MapVariants
+from metrics import MetricsRegistry
+from missions import MissionEngine, RoutePlanner
+from planner import OccupancyGrid, plan_fleet, simplify
+from telemetry import TelemetryScheduler
+from testbeds import DEFAULT_TESTBED, Testbed, TestbedContext, TestbedRegistry
+from tracking import PoseListener, TRACK_COLUMNS
+from video import VideoRelay, mjpeg_frames
+from vision import (MapTransform, detect_markers_pyramid, estimate_marker_poses, fit_marker_grid,
+                    marker_world_corners, read_gray, relative_positions, stack_corners)
+from vision_context import VisionContext
+
 app = Flask(__name__)
 
 # Allow CORS
@@ -23,46 +50,60 @@ CORS(app, resources={
     }
 })
 
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-drones = [
-    # {
-    #     "id": 0,
-    #     "name": "Drone 0",
-    #     "location": (0, 0, 0),
-    #     "battery": 90,
-    #     "streaming": False,
-    #     "status": "on_ground",
-    #     "ip": "172.16.0.240"
-    # },
-    {
-        "id": 1,
-        "name": "Drone 1",
-        "location": (0, 0, 0),
-        "battery": 90,
-        "streaming": False,
-        "status": "on_ground",
-        "ip": "172.16.0.241"
-    },
-    {
-        "id": 2,
-        "name": "Drone 2",
-        "location": (0, 0, 0),
-        "battery": 90,
-        "streaming": False,
-        "status": "on_ground",
-        "ip": "172.16.0.105"
-    },
-    {
-        "id": 3,
-        "name": "Drone 3",
-        "location": (0, 0, 0),
-        "battery": 90,
-        "streaming": False,
-        "status": "on_ground",
-        "ip": "172.16.0.106"
-    }
-]
+# With several server processes (see wsgi.py and fanout.py) emits go through a message
+# queue such as redis://localhost:6379/0 so every process reaches its own clients
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE)
+
+# Always-on instrumentation, exposed at /metrics
+metrics = MetricsRegistry()
+command_latency = metrics.histogram('drone_command_seconds', 'Round trip of commands sent to the drones', ('command',))
+command_errors = metrics.counter('drone_command_errors_total', 'Drone commands that failed', ('command', 'error'))
+telemetry_sweep_seconds = metrics.histogram('telemetry_sweep_seconds', 'Time until every poll of a telemetry sweep finished')
+telemetry_polls = metrics.counter('telemetry_polls_total', 'Telemetry polls submitted')
+socketio_emits = metrics.counter('socketio_emits_total', 'Socket.IO events emitted', ('event',))
+socketio_emit_bytes = metrics.counter('socketio_emit_bytes_total',
+                                      'JSON payload bytes emitted over Socket.IO, estimated from sampled emits', ('event',))
+map_geometry_seconds = metrics.histogram('map_geometry_seconds', 'Time spent computing the map scale and transforms')
+http_request_seconds = metrics.histogram('http_request_seconds', 'HTTP request handling time', ('endpoint', 'method', 'status'))
+
+# Only one emit in EMIT_BYTES_SAMPLE per event is serialized a second time to count its bytes
+EMIT_BYTES_SAMPLE = 16
+emit_sequence = defaultdict(itertools.count)
+
+def emit_event(event, data, **kwargs):
+    """socketio.emit that counts events and estimates payload bytes from a sample of them."""
+    socketio_emits.inc(event=event)
+    if next(emit_sequence[event]) % EMIT_BYTES_SAMPLE == 0:
+        size = len(json.dumps(data, separators=(',', ':'), default=str))
+        socketio_emit_bytes.inc(size * EMIT_BYTES_SAMPLE, event=event)
+    socketio.emit(event, data, **kwargs)
+
+@contextmanager
+def traced(name):
+    """Records a span in the current request's trace when tracing is on for it."""
+    trace = g.get('trace') if has_request_context() else None
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.append((name, time.perf_counter() - started))
+
+# Drone state changes reach the clients as coalesced deltas ('drone_updates')
+broadcaster = DroneBroadcaster(emit_event, interval=0.1)
+
+register_room_handlers(socketio)
+
+# Fleet configuration (drones, names and IPs)
+FLEET_CONFIG_PATH = os.environ.get('FLEET_CONFIG', 'fleet.json')
+fleet = FleetRegistry.load(FLEET_CONFIG_PATH)
+
+# Telemetry and command history, kept across restarts
+HISTORY_DB_PATH = os.environ.get('HISTORY_DB', 'history.db')
+HISTORY_RETENTION_DAYS = 30
+HISTORY_MAX_POINTS = 2000
+history = HistoryStore(HISTORY_DB_PATH, retention_days=HISTORY_RETENTION_DAYS)
 
 # Map configuration
 #MAP_PATH = 'testbed_maps/map.jpg' 
@@ -70,194 +111,392 @@ GRID_MAP_PATH = '/home/admin/drone-controller/grid_map.jpg'
 REFERENCE_MAP_PATH = '/home/admin/drone-controller/reference_map.jpg'
 CAMERA_CALIBRATION_PATH = 'cam_parameters.npz'
 MARKER_DISTANCE_MM = 300 
+# Resized maps and tiles are generated once per map version into this directory
+MAP_CACHE_DIR = '.map_cache'
+MAP_MAX_AGE = 60
+# Other testbeds hosted next to the default one (the files above); at most TESTBEDS_MAX_LOADED of
+# them keep their geometry, grid and localizer in memory
+TESTBEDS_CONFIG = os.environ.get('TESTBEDS_CONFIG', 'testbeds.json')
+TESTBEDS_MAX_LOADED = 2
+# Markers of the reference map are detected on the JPEG decoded at 1/MAP_DETECTION_REDUCTION and
+# refined at full resolution; 1 detects in a single pass on the full image
+MAP_DETECTION_REDUCTION = 2
 
-def api_send(host, message, port=12306, timeout=5, retries=0):
-    """Sends a message to a specific host using sockets."""
-    ip = ''
-    s = None
-    try:
-        if "." not in host:
-            ip = socket.gethostbyname(host)
-        else:
-            ip = host
+# Telemetry polling: interval in seconds (None disables the metric) and per-drone deadline
+TELEMETRY_METRICS = {
+    "battery": {"command": "get_battery", "interval": 30, "deadline": 5},
+    "position": {"command": "get_position", "interval": None, "deadline": 2},
+    "status": {"command": "get_status", "interval": None, "deadline": 2},
+}
+TELEMETRY_WORKERS = 16
 
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.settimeout(timeout)
+# Path planning grid: cell size, intensity below which a pixel is an obstacle, clearance in cells
+PLAN_CELL_MM = 100
+PLAN_OBSTACLE_THRESHOLD = 80
+PLAN_ROBOT_RADIUS_CELLS = 1.0
 
-        s.connect((ip, port))
-        s.send(message.encode('utf8'))
-        response = s.recv(1024)
+# Patrol missions: sweep rows MISSION_SPACING_MM apart at MISSION_ALTITUDE_MM, with routes cut to
+# what the battery allows above MISSION_BATTERY_RESERVE (percent, at MISSION_BATTERY_PER_M % per meter)
+MISSION_SPACING_MM = 300
+MISSION_ALTITUDE_MM = 1000
+MISSION_BATTERY_RESERVE = 20
+MISSION_BATTERY_PER_M = 0.25
+MISSION_TOLERANCE_MM = 150
+# A flying mission drone whose position isn't updated for this long can't be followed and is dropped
+MISSION_POSE_TIMEOUT_S = 5
+# Drones predicted to fly less than this are left out of new missions (their area goes to the others)
+MISSION_MIN_FLIGHT_S = 60
+PATROL_MIN_FLIGHT_S = 120
 
-        return response.decode('utf8')
-    
-    except socket.error as se:
-        if retries > 0:
-            time.sleep(0.1)
-            return api_send(host, message, port, retries - 1)
+# Battery model: the discharge rate is fitted on the last BATTERY_WINDOW readings and turned into
+# flight time; until a drone has its own rate, flying drains MISSION_BATTERY_PER_M % per meter
+BATTERY_WINDOW = 32
+DRONE_SPEED_MM_S = 500
 
-        err = se.args[0]
+# Position tracking: drones push poses over UDP, the UI gets them at TRACK_PUBLISH_HZ
+TRACK_UDP_PORT = 12307
+TRACK_CAPACITY = 4096
+TRACK_PUBLISH_HZ = 5
+
+# Video relay: each drone sends its stream to VIDEO_BASE_PORT + drone id on this server
+VIDEO_URL_TEMPLATE = 'udp://0.0.0.0:{port}?overrun_nonfatal=1&fifo_size=5000000'
+VIDEO_BASE_PORT = 11110
+VIDEO_ENCODE_WORKERS = 4
+VIDEO_MAX_WIDTH = 960
+
+# Camera localization: drone frames are matched against the map markers in a process pool shared
+# by every testbed, so evicting a testbed context doesn't restart worker processes
+LOCALIZATION_ENABLED = True
+LOCALIZATION_WORKERS = 2
+LOCALIZATION_MAX_WIDTH = 640
+
+# Trace every request (Server-Timing header and log line); single requests can ask with "X-Trace: 1"
+METRICS_TRACE = False
+
+# Maximum number of drones whose /fleet/commands results are collected at the same time
+# (the commands themselves run as jobs, on the JOB_WORKERS)
+FLEET_COMMAND_WORKERS = 16
+
+# Command jobs: regular workers (one per drone at a time, as many as a fleet batch fans out to)
+# and a separate lane reserved for emergency commands
+JOB_WORKERS = 16
+JOB_PRIORITY_WORKERS = 2
+
+# Drones with "protocol": "binary" (or "auto", falling back to text) in the fleet config use the
+# pipelined binary protocol; their pushed telemetry is applied like a poll reply
+DRONE_PROTOCOL = os.environ.get('DRONE_PROTOCOL', 'text')
+# Text replies are read with a single recv ("raw"), as the firmware does not end them with a newline;
+# drones with "framing": "newline" (e.g. the simulator) get newline-delimited requests and replies
+DRONE_FRAMING = os.environ.get('DRONE_FRAMING', 'raw')
+drone_pool = DronePool(on_event=lambda ip, metric, value: apply_drone_event(ip, metric, value))
+for configured_drone in fleet.all():
+    drone_settings = fleet.settings.get(configured_drone.id, {})
+    drone_pool.set_protocol(configured_drone.ip, drone_settings.get("protocol", DRONE_PROTOCOL))
+    drone_pool.set_framing(configured_drone.ip, drone_settings.get("framing", DRONE_FRAMING))
+fleet_executor = ThreadPoolExecutor(max_workers=FLEET_COMMAND_WORKERS, thread_name_prefix="fleet")
+
+# Health: after HEALTH_FAILURE_THRESHOLD consecutive failures a drone's circuit opens and requests to it
+# fail at once; after HEALTH_OPEN_TIMEOUT seconds (doubling up to HEALTH_MAX_OPEN_TIMEOUT while it stays
+# down) the next request goes through as a trial and the drone is probed with HEALTH_PROBE_COMMAND.
+# Drones silent for HEALTH_HEARTBEAT_TIMEOUT are probed too, once per HEALTH_HEARTBEAT_TIMEOUT.
+HEALTH_FAILURE_THRESHOLD = 3
+HEALTH_OPEN_TIMEOUT = 2
+HEALTH_MAX_OPEN_TIMEOUT = 60
+HEALTH_HEARTBEAT_TIMEOUT = 30
+HEALTH_PROBE_TIMEOUT = 1
+# A command every firmware answers (it does not answer get_status)
+HEALTH_PROBE_COMMAND = "get_battery"
+HEALTH_DEGRADED_LATENCY = 1.0
+
+def probe_drone(host):
+    return drone_pool.request(host, HEALTH_PROBE_COMMAND, timeout=HEALTH_PROBE_TIMEOUT) is not None
+
+def apply_health(host, previous, health, error):
+    """Publishes a health transition (online/degraded/offline) of a drone to the clients."""
+    drone = fleet.get_by_ip(host)
+    if drone is None:
+        return
+    print(f"Dron {drone.id} ({host}): {previous} -> {health}" + (f" ({error})" if error else ""))
+    history.record_event(drone.id, "health", health, detail={"from": previous, "error": error})
+    state = fleet.update(drone.id, health=health)
+    if state is not None:
+        broadcaster.publish(state)
+
+drone_health = HealthMonitor(probe_drone, lambda: [drone.ip for drone in fleet.all()], apply_health,
+                             failure_threshold=HEALTH_FAILURE_THRESHOLD, open_timeout=HEALTH_OPEN_TIMEOUT,
+                             max_open_timeout=HEALTH_MAX_OPEN_TIMEOUT, heartbeat_timeout=HEALTH_HEARTBEAT_TIMEOUT,
+                             degraded_latency=HEALTH_DEGRADED_LATENCY)
+
+def api_send(host, message, port=12306, timeout=5, retries=0, priority=False):
+    """Sends a message to a specific host over its pooled persistent connection.
+
+    Returns None if the drone did not answer, or at once if its circuit is open
+    (priority commands are always attempted). A message the protocol can't encode
+    raises InvalidCommand before anything is sent, whichever protocol the drone
+    speaks, without counting against the drone's health.
+    """
+    command = message.split(":", 1)[0]
+    try:
+        encode_command(message)
+    except InvalidCommand:
+        command_errors.inc(command=command, error="InvalidCommand")
+        raise
+    if not drone_health.allow(host) and not priority:
+        command_errors.inc(command=command, error="CircuitOpen")
+        return None
+    started = time.perf_counter()
+    try:
+        with traced(f"drone_{command}"), command_latency.time(command=command):
+            response = drone_pool.request(host, message, port=port, timeout=timeout, retries=retries,
+                                          priority=priority)
+        # Only quick queries say something about the link; takeoff or go_to take as long as the flight
+        drone_health.record_success(host, time.perf_counter() - started if command.startswith("get_") else None)
+        return response
+    except socket.error as se:
+        command_errors.inc(command=command, error=type(se).__name__)
+        drone_health.record_failure(host, str(se))
         print(f"SOCKET ERROR for drone {host}: {se}")
-        if err == errno.EAGAIN or err == errno.EWOULDBLOCK:
-            print('No data available')
     except Exception as e:
-        if retries > 0:
-            time.sleep(0.1)
-            return api_send(host, message, port, retries - 1)
+        command_errors.inc(command=command, error=type(e).__name__)
+        drone_health.record_failure(host, str(e))
         print(f"Error: {e}")
-    finally:
-        if s:
-            s.close()
     return None
 
-def get_drone_by_id(drone_id):
-    return next((drone for drone in drones if drone["id"] == drone_id), None)
+battery_model = BatteryModel(window=BATTERY_WINDOW, reserve=MISSION_BATTERY_RESERVE,
+                             flight_rate=MISSION_BATTERY_PER_M * DRONE_SPEED_MM_S / 1000,
+                             default_interval=TELEMETRY_METRICS["battery"]["interval"] or 30)
 
-def update_battery():
-    while True:
-        for drone in drones:
-            try:
-                battery_response = api_send(drone["ip"], "get_battery")
-                if battery_response:
-                    #If battery_response contains "Error" it means that the drone is not reachable
-                    if "Error" in battery_response:
-                        print(f"Error actualizando batería del dron {drone['id']}: {battery_response}")
-                        continue
-                    else:
-                        drone["battery"] = int(battery_response)
-                    
-                    socketio.emit('drone_update', drone)
-                    print(f"Actualizada batería del dron {drone['id']} a {drone['battery']}%")
-            except Exception as e:
-                print(f"Error actualizando batería del dron {drone['id']}: {e}")
-        
-        time.sleep(30)
+def apply_telemetry(drone, metric, response):
+    """Stores a telemetry reply on the drone and notifies the clients."""
+    if metric == "battery":
+        state = fleet.update(drone.id, battery=int(response))
+        history.record_sample(drone.id, "battery", state["battery"])
+        battery_model.record(drone.id, state["battery"], drone.status == "in_air")
+    elif metric == "position":
+        location = tuple(float(v) for v in response.split(","))
+        state = fleet.update(drone.id, location=location)
+        polled_positions[drone.id] = time.time()
+        for axis, value in zip("xyz", location):
+            history.record_sample(drone.id, axis, value)
+    elif metric == "status":
+        status = response.strip()
+        if status != drone.status:
+            history.record_event(drone.id, "status", status, detail={"from": drone.status, "source": "telemetry"})
+        state = fleet.update(drone.id, status=status)
+    else:
+        return
+    broadcaster.publish(state)
+
+# Last time each drone answered a position poll, for pose_age
+polled_positions = {}
+
+def apply_drone_event(ip, metric, value):
+    """Telemetry pushed by a drone on the binary protocol."""
+    drone_health.heartbeat(ip)
+    drone = fleet.get_by_ip(ip)
+    if drone is not None:
+        apply_telemetry(drone, metric, value)
+
+def record_sweep(duration, polls):
+    telemetry_sweep_seconds.observe(duration)
+    telemetry_polls.inc(polls)
+
+def telemetry_interval(drone, metric, interval):
+    """Battery polling follows the battery model: faster when low or draining, slower when idle."""
+    if metric == "battery" and interval is not None:
+        return battery_model.poll_interval(drone.id)
+    return interval
+
+telemetry = TelemetryScheduler(api_send, fleet.all, TELEMETRY_METRICS, apply_telemetry,
+                               workers=TELEMETRY_WORKERS, on_sweep=record_sweep, interval_for=telemetry_interval)
+
+def apply_pose(drone, row):
+    """Stores the latest tracked pose (t, x, y, z, roll, pitch, yaw) on the drone."""
+    state = fleet.update(drone.id, location=tuple(round(v, 1) for v in row[1:4]),
+                         attitude=tuple(round(v, 2) for v in row[4:7]))
+    broadcaster.publish(state)
+    for name, value in zip(TRACK_COLUMNS[1:], row[1:]):
+        history.record_sample(drone.id, name, value, t=row[0])
+
+pose_listener = PoseListener(fleet, apply_pose, port=TRACK_UDP_PORT, capacity=TRACK_CAPACITY,
+                             publish_hz=TRACK_PUBLISH_HZ)
+
+def store_camera_pose(drone_id, position, attitude):
+    """Camera-based poses go through the same track buffers as the UDP telemetry."""
+    pose_listener.buffer(drone_id).append(time.time(), position + attitude)
 
-# Start battery update thread
-def start_battery_update_thread():
-    battery_thread = threading.Thread(target=update_battery)
-    battery_thread.daemon = True  # Daemon permite que el hilo se detenga cuando se cierre la aplicación
-    battery_thread.start()
+def pose_age(drone):
+    """Seconds since the drone's location was last updated by any pose source, None if never."""
+    latest = pose_listener.buffer(drone.id).latest()
+    updated = max(latest[0] if latest is not None else 0, polled_positions.get(drone.id, 0))
+    return time.time() - updated if updated else None
+
+localization_pool = localizer_pool(LOCALIZATION_WORKERS)
+
+def get_localizer(testbed_id=DEFAULT_TESTBED):
+    """Localizer for the current map version of a testbed, rebuilt when its reference map changes."""
+    context = testbeds.context(testbed_id)
+    geometry = context.geometry.get() if context else None
+    if geometry is None:
+        return None
+    with context.lock:
+        if context.localizer_geometry is not geometry:
+            if context.localizer is not None:
+                context.localizer.close()
+            camera_matrix, dist_coeffs = geometry["calibration"]
+            context.localizer = MarkerLocalizer(
+                camera_matrix, dist_coeffs, geometry["markers"], store_camera_pose,
+                max_width=LOCALIZATION_MAX_WIDTH, pool=localization_pool)
+            context.localizer_geometry = geometry
+        return context.localizer
+
+def localize_frame(drone_id, frame):
+    if not LOCALIZATION_ENABLED:
+        return
+    try:
+        localizer = get_localizer(testbeds.testbed_of(drone_id))
+        if localizer is not None:
+            localizer.submit(drone_id, frame)
+    except Exception as e:
+        print(f"Error localizando el dron {drone_id}: {e}")
+
+video_relay = VideoRelay(lambda drone_id: VIDEO_URL_TEMPLATE.format(port=VIDEO_BASE_PORT + drone_id),
+                         workers=VIDEO_ENCODE_WORKERS, max_width=VIDEO_MAX_WIDTH, on_frame=localize_frame)
+
+# Start telemetry polling thread
+def start_telemetry_thread():
+    telemetry.start()
+
+# Background work (map warm-up, UDP pose listener, telemetry) must run in exactly one
+# process: the drones, the UDP port and the fleet state belong to a single server
+BACKGROUND_LOCK_PATH = os.environ.get('BACKGROUND_LOCK', '/tmp/drone-controller.lock')
+TELEMETRY_AUTOSTART = os.environ.get('TELEMETRY_AUTOSTART') == '1'
+background_state = {"lock_file": None}
+background_lock = threading.Lock()
+
+def start_background_services():
+    """Starts the background services once per machine; returns False if another process runs them."""
+    with background_lock:
+        if background_state["lock_file"] is not None:
+            return True
+        lock_file = open(BACKGROUND_LOCK_PATH, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            print(f"Background services already running in another process ({BACKGROUND_LOCK_PATH})")
+            return False
+        # Held open for the life of the process; the OS releases it when the process exits
+        background_state["lock_file"] = lock_file
+    testbeds.context(testbeds.default).geometry.warm()
+    pose_listener.start()
+    drone_health.start()
+    if TELEMETRY_AUTOSTART:
+        start_telemetry_thread()
+    return True
+
+# Calibration, Aruco detectors and undistortion maps are created once per process
+# and reloaded when the files change
+file_fingerprints = FileFingerprints()
+vision_context = VisionContext(fingerprints=file_fingerprints)
 
 def load_calibration(calibration_path):
-    """Carga los parámetros de calibración de la cámara"""
+    """Carga los parámetros de calibración de la cámara (una vez por versión del fichero)"""
     try:
-        with np.load(calibration_path) as X:
-            camera_matrix, dist_coeffs = [X[i] for i in ('camera_matrix', 'dist_coeffs')]
-            return camera_matrix, dist_coeffs
+        calibration = vision_context.calibration(calibration_path)
+        return calibration.camera_matrix, calibration.dist_coeffs
     except Exception as e:
         print(f"Error cargando archivo de calibración: {e}")
         return None, None
 
-def get_map_scale():
-    """Calcula la escala del mapa basándose en los marcadores Aruco y los parámetros de la cámara"""
+def compute_map_geometry(testbed):
+    """Calcula la escala del mapa y la transformación píxel/mundo de un testbed a partir de los marcadores Aruco"""
     try:
         # Cargar parámetros de la cámara
-        calibration_file = 'tello_camera_calibration/cam_parameters.npz'
-        camera_matrix, dist_coeffs = load_calibration(CAMERA_CALIBRATION_PATH)
+        camera_matrix, dist_coeffs = load_calibration(testbed.calibration)
         
         if camera_matrix is None or dist_coeffs is None:
             raise ValueError("No se pudieron cargar los parámetros de calibración")
 
-        # Cargar la imagen
-        frame = cv.imread(REFERENCE_MAP_PATH)
-        if frame is None:
-            raise ValueError(f"No se pudo cargar la imagen del mapa: {REFERENCE_MAP_PATH}")
-        
-        # Detectar marcadores Aruco usando la nueva API
-        gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-        aruco_dict = cv.aruco.getPredefinedDictionary(cv.aruco.DICT_6X6_250)
-        aruco_params = cv.aruco.DetectorParameters()
-        detector = cv.aruco.ArucoDetector(aruco_dict, aruco_params)
-        corners, ids, _ = detector.detectMarkers(gray)
-        
-        if ids is None or 0 not in ids:
-            raise ValueError("No se encontró el marcador de referencia (ID 0)")
+        # Detectar marcadores Aruco: primero en la imagen reducida, refinando las esquinas
+        # a resolución completa; si así no aparece el marcador 0, en la imagen completa
+        detector = vision_context.detector(cv.aruco.DICT_6X6_250)
+        detection = None
+        detection_mode = {"mode": "single", "reduction": 1}
+        if MAP_DETECTION_REDUCTION > 1:
+            detection = detect_markers_pyramid(testbed.reference_map, detector, MAP_DETECTION_REDUCTION)
+            if detection is not None and 0 in detection[1]:
+                detection_mode = {"mode": "pyramid", "reduction": MAP_DETECTION_REDUCTION}
+            else:
+                print(f"Marcador 0 no encontrado a 1/{MAP_DETECTION_REDUCTION}, detectando en la imagen completa")
+                detection = None
+        if detection is None:
+            gray = read_gray(testbed.reference_map)
+            corners, ids, _ = detector.detectMarkers(gray)
+            if ids is None or 0 not in ids:
+                raise ValueError("No se encontró el marcador de referencia (ID 0)")
+            detection = stack_corners(corners), np.asarray(ids).ravel(), (gray.shape[1], gray.shape[0])
+        corners, ids, (width_px, height_px) = detection
         
-        # Estimar poses para cada marcador
+        # Estimar las poses de todos los marcadores en una pasada
         marker_size = 9  # Tamaño del marcador en cm
-        rvecs = []
-        tvecs = []
-        
-        # Definir los puntos 3D del marcador
-        object_points = np.array([
-            [-marker_size/2, marker_size/2, 0],
-            [marker_size/2, marker_size/2, 0],
-            [marker_size/2, -marker_size/2, 0],
-            [-marker_size/2, -marker_size/2, 0]
-        ], dtype=np.float32)
-
-        for corner in corners:
-            success, rvec, tvec = cv.solvePnP(
-                objectPoints=object_points,
-                imagePoints=corner[0],
-                cameraMatrix=camera_matrix,
-                distCoeffs=dist_coeffs
-            )
-            if success:
-                rvecs.append(rvec)
-                tvecs.append(tvec)
-
-       # Encontrar el marcador 0 (referencia)
+        rvecs, tvecs, solved = estimate_marker_poses(corners, camera_matrix, dist_coeffs, marker_size)
+
+        # Encontrar el marcador 0 (referencia)
         marker_0_idx = np.where(ids == 0)[0][0]
-        pos_0 = tvecs[marker_0_idx].flatten()
-        rvec_0 = rvecs[marker_0_idx]
-        marker_0_corners = corners[marker_0_idx][0]
-        marker_0_center = np.mean(marker_0_corners, axis=0)
-        
-        # Convertir vector de rotación a matriz
-        R_0, _ = cv.Rodrigues(rvec_0)
-        R_0_inv = R_0.T
-        
-        # Inicializar variables para los marcadores más alejados
-        max_x_distance_mm = 0
-        max_y_distance_mm = 0
-        max_x_distance_px = 0
-        max_y_distance_px = 0
-        x_marker_id = None
-        y_marker_id = None
-        
-        # Buscar los marcadores más alejados en X e Y
-        for i, marker_id in enumerate(ids):
-            if marker_id == 0:
-                continue
-            
-            # Calcular posición relativa en milímetros
-            pos_cam = tvecs[i].flatten()
-            rel_pos = pos_cam - pos_0
-            transformed_pos = np.dot(R_0_inv, rel_pos)
-            transformed_pos_mm = transformed_pos * 10  # convertir a mm
-            
-            # Calcular posición relativa en píxeles
-            marker_center = np.mean(corners[i][0], axis=0)
-            dx_px = abs(marker_center[0] - marker_0_center[0])
-            dy_px = abs(marker_center[1] - marker_0_center[1])
-            dx_mm = abs(transformed_pos_mm[0])
-            dy_mm = abs(transformed_pos_mm[1])
-            
-            if dx_mm > max_x_distance_mm:
-                max_x_distance_mm = dx_mm
-                max_x_distance_px = dx_px
-                x_marker_id = marker_id[0]
-                
-            if dy_mm > max_y_distance_mm:
-                max_y_distance_mm = dy_mm
-                max_y_distance_px = dy_px
-                y_marker_id = marker_id[0]
-        
-        # Obtener dimensiones de la imagen
-        height_px, width_px = frame.shape[:2]
-        
-        # Calcular escalas (píxeles por milímetro) usando las distancias reales
-        scale_x = max_x_distance_px / max_x_distance_mm if max_x_distance_mm > 0 else 1
-        scale_y = max_y_distance_px / max_y_distance_mm if max_y_distance_mm > 0 else 1
+        if not solved[marker_0_idx]:
+            raise ValueError("No se pudo estimar la pose del marcador de referencia (ID 0)")
+        centers = corners.mean(axis=1)
+        marker_0_center = centers[marker_0_idx]
+
+        # Posiciones relativas de todos los marcadores en mm y en píxeles
+        rel_mm = relative_positions(rvecs, tvecs, marker_0_idx) * 10  # convertir a mm
+        dist_mm = np.abs(rel_mm[:, :2])
+        dist_px = np.abs(centers - marker_0_center)
+        dist_mm[~solved | (ids == 0)] = 0
+
+        # Marcadores más alejados en X e Y
+        x_idx = int(np.argmax(dist_mm[:, 0]))
+        y_idx = int(np.argmax(dist_mm[:, 1]))
+        max_x_distance_mm, max_x_distance_px = dist_mm[x_idx, 0], dist_px[x_idx, 0]
+        max_y_distance_mm, max_y_distance_px = dist_mm[y_idx, 1], dist_px[y_idx, 1]
+        x_marker_id = ids[x_idx] if max_x_distance_mm > 0 else None
+        y_marker_id = ids[y_idx] if max_y_distance_mm > 0 else None
+
+        # Ajuste de la rejilla completa: la escala sale de todos los marcadores
+        grid_fit = fit_marker_grid(rel_mm[solved, :2], centers[solved])
+
+        # Calcular escalas (píxeles por milímetro) con el ajuste de la rejilla, o con
+        # los dos marcadores extremos si no hay marcadores suficientes
+        if grid_fit is not None:
+            scale_x = grid_fit["scale_x"]
+            scale_y = grid_fit["scale_y"]
+        else:
+            scale_x = max_x_distance_px / max_x_distance_mm if max_x_distance_mm > 0 else 1
+            scale_y = max_y_distance_px / max_y_distance_mm if max_y_distance_mm > 0 else 1
 
         print(f"Distancia máxima en X: {max_x_distance_mm:.2f}mm ({max_x_distance_px:.2f}px) con marcador {x_marker_id}")
         print(f"Distancia máxima en Y: {max_y_distance_mm:.2f}mm ({max_y_distance_px:.2f}px) con marcador {y_marker_id}")
         print(f"Escala X: {scale_x:.2f} px/mm")
         print(f"Escala Y: {scale_y:.2f} px/mm")
+        if grid_fit is not None:
+            print(f"Ajuste de rejilla con {grid_fit['markers']} marcadores, error RMS {grid_fit['rms_px']:.2f}px")
         
-        return {
+        # Transformación imagen <-> mundo (mm) con todos los marcadores resueltos; la homografía
+        # necesita al menos 4, con menos solo se devuelve la escala
+        transform = None
+        if np.count_nonzero(solved) >= 4:
+            try:
+                transform = MapTransform(camera_matrix, dist_coeffs, (width_px, height_px),
+                                         rel_mm[solved, :2], centers[solved],
+                                         undistort_maps=vision_context.undistort_maps(testbed.calibration,
+                                                                                      (width_px, height_px)))
+            except (ValueError, cv.error) as e:
+                print(f"Sin transformación píxel/mundo: {e}")
+        else:
+            print(f"Sin transformación píxel/mundo: solo {np.count_nonzero(solved)} marcadores resueltos")
+
+        info = {
             "dimensions": {
                 "width_px": width_px,
                 "height_px": height_px,
@@ -282,8 +521,20 @@ def get_map_scale():
                 "max_y": float(max_y_distance_mm),   # mm
                 "max_x_px": float(max_x_distance_px),  # px
                 "max_y_px": float(max_y_distance_px)   # px
-            }
+            },
+            "grid_fit": {
+                "markers": grid_fit["markers"],
+                "rms_px": grid_fit["rms_px"],
+                "homography": grid_fit["homography"].tolist()  # mm (marcador 0) -> px
+            } if grid_fit is not None else None,
+            "detection": dict(detection_mode, markers=len(ids))
         }
+        # Esquinas de cada marcador en mm, para localizar los drones con su cámara
+        world_corners = marker_world_corners(rvecs, tvecs, marker_0_idx, marker_size)
+        markers = {int(marker_id): world_corners[i] for i, marker_id in enumerate(ids) if solved[i]}
+
+        return {"info": info, "transform": transform, "markers": markers,
+                "calibration": (camera_matrix, dist_coeffs)}
         
     except Exception as e:
         print(f"Error calculando la escala del mapa: {e}")
@@ -291,161 +542,754 @@ def get_map_scale():
         traceback.print_exc()
         return None
 
+def get_map_scale(testbed_id=DEFAULT_TESTBED):
+    """Calcula la escala del mapa basándose en los marcadores Aruco y los parámetros de la cámara"""
+    geometry = compute_map_geometry(testbeds.get(testbed_id))
+    return geometry["info"] if geometry else None
+
+# Map geometry is recomputed only when the reference map or the calibration file change
+def timed_map_geometry(testbed):
+    with map_geometry_seconds.time():
+        return compute_map_geometry(testbed)
+
+map_variants = MapVariants(MAP_CACHE_DIR, fingerprints=file_fingerprints, max_pyramids=TESTBEDS_MAX_LOADED)
+
+def get_map_transform(testbed_id=DEFAULT_TESTBED):
+    context = testbeds.context(testbed_id)
+    geometry = context.geometry.get() if context else None
+    return geometry["transform"] if geometry else None
+
+def build_occupancy_grid(testbed, geometry_cache):
+    """Builds the planning grid from the grid map, with cells of PLAN_CELL_MM at the map scale."""
+    gray = cv.imread(testbed.grid_map, cv.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError(f"No se pudo cargar la imagen del mapa: {testbed.grid_map}")
+    geometry = geometry_cache.get()
+    if geometry is None:
+        raise ValueError("No se pudo calcular la escala del mapa")
+    scale = geometry["info"]["scale"]
+    cell_px = max(1.0, PLAN_CELL_MM * (scale["x"] + scale["y"]) / 2)
+    return OccupancyGrid.from_image(gray, cell_px, obstacle_threshold=PLAN_OBSTACLE_THRESHOLD,
+                                    robot_radius=PLAN_ROBOT_RADIUS_CELLS)
+
+def build_testbed_context(testbed):
+    """Geometry and grid caches of a testbed; nothing is read until they are first used."""
+    geometry = FingerprintCache(lambda: timed_map_geometry(testbed),
+                                lambda: (testbed.reference_map, testbed.calibration),
+                                fingerprints=file_fingerprints)
+    grid = FingerprintCache(lambda: build_occupancy_grid(testbed, geometry), testbed.paths,
+                            fingerprints=file_fingerprints)
+    return TestbedContext(testbed, geometry, grid)
+
+default_testbed = Testbed(DEFAULT_TESTBED, "Default", GRID_MAP_PATH, REFERENCE_MAP_PATH, CAMERA_CALIBRATION_PATH)
+if os.path.exists(TESTBEDS_CONFIG):
+    testbeds = TestbedRegistry.load(TESTBEDS_CONFIG, default_testbed, build_testbed_context,
+                                    max_loaded=TESTBEDS_MAX_LOADED)
+else:
+    testbeds = TestbedRegistry([default_testbed], build_testbed_context, max_loaded=TESTBEDS_MAX_LOADED)
+# Drones with "testbed": "<id>" in the fleet config fly there; the rest in the default testbed
+for configured_drone in fleet.all():
+    configured_testbed = fleet.settings.get(configured_drone.id, {}).get("testbed")
+    if configured_testbed is not None:
+        testbeds.assign(configured_drone.id, configured_testbed)
+
+def testbed_not_found(testbed_id):
+    return jsonify({"error": f"Testbed {testbed_id} not found"}), 404
+
 # Get all drones
 @app.route('/drones', methods=['GET'])
 def get_drones():
-    return jsonify(drones)  # Devuelve la información de todos los drones
+    return app.response_class(fleet.to_json(), mimetype='application/json')  # Devuelve la información de todos los drones
 
 # Get drone status
 @app.route('/drones/<int:drone_id>/status', methods=['GET'])
 def get_drone_status(drone_id):
-    if drone_id in drones:
-        return jsonify(drones[drone_id])
+    drone = fleet.get(drone_id)
+    if drone:
+        return jsonify(drone.to_dict())
     else:
         return jsonify({"error": "Drone not found"}), 404
 
-# Takeoff
-@app.route('/drones/<int:drone_id>/takeoff', methods=['POST'])
-def takeoff_drone(drone_id):
-    drone = get_drone_by_id(drone_id)
-    if drone:
-        if drone["status"] == "on_ground":
-            response = api_send(drone["ip"], "takeoff", port=12306, timeout=20)
+# Drone commands: each one returns (response body, HTTP status) so the single-drone
+# routes and the fleet batch endpoint share the same behaviour
+def command_takeoff(drone, args):
+    if drone.status == "on_ground":
+        response = api_send(drone.ip, "takeoff", port=12306, timeout=20)
+        if response:
+            state = fleet.update(drone.id, status="in_air")
+            broadcaster.publish(state)
+            return {"message": f"Drone {drone.id} is taking off. Response: {response}"}, 200
+        else:
+            return {"error": "Failed to communicate with drone."}, 500
+    else:
+        return {"message": f"Drone {drone.id} is already in the air."}, 400
+
+def command_land(drone, args):
+    if drone.status == "in_air":
+        response = api_send(drone.ip, "land", port=12306, timeout=20)
+        if response:
+            state = fleet.update(drone.id, status="on_ground")
+            broadcaster.publish(state)
+            return {"message": f"Drone {drone.id} is landing. Response: {response}"}, 200
+        else:
+            return {"error": "Failed to communicate with drone."}, 500
+    else:
+        return {"message": f"Drone {drone.id} is already on the ground."}, 400
+
+def target_location(args):
+    """The [x, y, z] target of a go_to as floats, or None if it isn't three numbers."""
+    try:
+        location = [float(v) for v in args["location"]]
+    except (TypeError, ValueError):
+        return None
+    return location if len(location) == 3 else None
+
+def required_flight_s(drone, command, args):
+    """Seconds of flight a command needs, or None for commands that do not fly anywhere."""
+    if command == "patrol":
+        return PATROL_MIN_FLIGHT_S
+    if command == "go_to" and args and "location" in args:
+        distance = float(np.linalg.norm(np.subtract(target_location(args), drone.location[:3])))
+        return distance / DRONE_SPEED_MM_S
+    return None
+
+def battery_check(drone, command, args):
+    """Error response if the battery model predicts the drone cannot finish the command, else None.
+
+    Only reads the in-memory model, so routes can call it before queuing the command. A go_to
+    whose location isn't [x, y, z] is rejected here too.
+    """
+    if command == "go_to" and args and "location" in args and target_location(args) is None:
+        return {"error": "Location must be [x, y, z]"}, 400
+    seconds = required_flight_s(drone, command, args)
+    if seconds is None or (args or {}).get("force") or battery_model.can_fly(drone.id, seconds, drone.battery):
+        return None
+    return {"error": f"Drone {drone.id} is predicted to reach the battery reserve before finishing.",
+            "required_s": round(seconds, 1), "battery": battery_model.predict(drone.id)}, 409
+
+def command_go_to(drone, args):
+    if drone.status == "in_air":
+        if args and "location" in args:
+            location = args["location"]
+            rejected = battery_check(drone, "go_to", args)
+            if rejected:
+                return rejected
+            response = api_send(drone.ip, f"go_to:{location[0]}, {location[1]}, {location[2]}", port=12306, timeout=20)
             if response:
-                drone["status"] = "in_air"
-                socketio.emit('drone_update', drone)
-                return jsonify({"message": f"Drone {drone_id} is taking off. Response: {response}"})
+                return {"message": f"Drone {drone.id} is going to {location}."}, 200
             else:
-                return jsonify({"error": "Failed to communicate with drone."}), 500
+                return {"error": "Failed to send command to drone."}, 500
         else:
-            return jsonify({"message": f"Drone {drone_id} is already in the air."}), 400
+            return {"error": "Location data missing"}, 400
+    else:
+        return {"error": f"Drone {drone.id} is not in the air."}, 400
+
+def command_patrol(drone, args):
+    rejected = battery_check(drone, "patrol", args)
+    if rejected:
+        return rejected
+    response = api_send(drone.ip, "patrol", port=12306, timeout=10)
+    if response:
+        state = fleet.update(drone.id, status="in_air")
+        broadcaster.publish(state)
+        return {"message": "Patrol started successfully"}, 200
     else:
+        return {"error": "Failed to communicate with drone."}, 500
+
+def command_emergency(drone, args):
+    fleet.update(drone.id, status="emergency")
+    response = api_send(drone.ip, "stop", port=12306, timeout=10, priority=True)
+    if response:
+        state = fleet.update(drone.id, status="on_ground")
+        broadcaster.publish(state)
+        return {"message": f"Drone {drone.id} stopped. Response: {response}"}, 200
+    else:
+        return {"error": "Failed to communicate with drone."}, 500
+
+DRONE_COMMANDS = {
+    "takeoff": command_takeoff,
+    "land": command_land,
+    "go_to": command_go_to,
+    "patrol": command_patrol,
+    "emergency": command_emergency,
+}
+
+def run_drone_command(drone_id, command, args=None):
+    """Runs a named command on a drone and returns (response body, HTTP status)."""
+    handler = DRONE_COMMANDS.get(command)
+    if handler is None:
+        return {"error": f"Unknown command: {command}"}, 400
+    drone = fleet.get(drone_id)
+    if drone is None:
+        return {"error": "Drone not found"}, 404
+    previous_status = drone.status
+    started = time.monotonic()
+    try:
+        body, status_code = handler(drone, args)
+    except InvalidCommand as e:
+        body, status_code = {"error": str(e)}, 400
+    history.record_event(drone.id, "command", command, status=status_code, duration=time.monotonic() - started,
+                         detail={"args": args, "response": body})
+    if drone.status != previous_status:
+        history.record_event(drone.id, "status", drone.status, detail={"from": previous_status, "source": command})
+    return body, status_code
+
+jobs = JobManager(run_drone_command, lambda job: emit_event('job_update', job.to_dict()),
+                  workers=JOB_WORKERS, priority_workers=JOB_PRIORITY_WORKERS)
+
+def submit_drone_command(drone_id, command, args=None, priority=False):
+    """Queues a command as a job and answers with its id; ?wait=1 waits for the result."""
+    if fleet.get(drone_id) is None:
         return jsonify({"error": "Drone not found"}), 404
+    job = jobs.submit(drone_id, command, args, priority=priority)
+    if request.args.get("wait") in ("1", "true"):
+        job.done.wait()
+        return jsonify(job.result), job.status_code
+    return jsonify({
+        "message": f"Command {command} queued for drone {drone_id}.",
+        "job_id": job.id,
+        "job": job.to_dict(),
+    }), 202
+
+# Takeoff
+@app.route('/drones/<int:drone_id>/takeoff', methods=['POST'])
+def takeoff_drone(drone_id):
+    return submit_drone_command(drone_id, "takeoff")
 
 # Land
 @app.route('/drones/<int:drone_id>/land', methods=['POST'])
 def land_drone(drone_id):
-    drone = get_drone_by_id(drone_id)
-    if drone:
-        if drone["status"] == "in_air":
-            response = api_send(drone["ip"], "land", port=12306, timeout=20)
-            if response:
-                drone["status"] = "on_ground"
-                socketio.emit('drone_update', drone)
-                return jsonify({"message": f"Drone {drone_id} is landing. Response: {response}"})
-            else:
-                return jsonify({"error": "Failed to communicate with drone."}), 500
-        else:
-            return jsonify({"message": f"Drone {drone_id} is already on the ground."}), 400
-    else:
-        return jsonify({"error": "Drone not found"}), 404
+    return submit_drone_command(drone_id, "land")
 
 @app.route('/drones/<int:drone_id>/go_to', methods=['POST'])
 def goto_location(drone_id):
-    drone = get_drone_by_id(drone_id)
-    if drone:
-        data = request.json
-        if drone["status"] == "in_air":
-            if "location" in data:
-                response = api_send(drone["ip"], f"go_to:{data['location'][0]}, {data['location'][1]}, {data['location'][2]}", port=12306, timeout=20)
-                if response:
-                    return jsonify({"message": f"Drone {drone_id} is going to {data['location']}."})
-                else:
-                    return jsonify({"error": "Failed to send command to drone."}), 500
-            else:
-                return jsonify({"error": "Location data missing"}), 400
-        else:
-            return jsonify({"error": f"Drone {drone_id} is not in the air."}), 400
-    else:
-        return jsonify({"error": "Drone not found"}), 404
+    data = request.json or {}
+    # The target can also be given as a pixel of the map: {"pixel": [u, v], "z": z}
+    if "pixel" in data and "location" not in data:
+        transform = get_map_transform(testbeds.testbed_of(drone_id))
+        if transform is None:
+            return jsonify({"error": "Map transform not available"}), 503
+        x, y = transform.pixel_to_world([data["pixel"]])[0]
+        data = dict(data, location=[round(float(x), 1), round(float(y), 1), data.get("z", 0)])
+    return submit_flight(drone_id, "go_to", data)
 
 # Patrol
 @app.route('/drones/<int:drone_id>/patrol', methods=['POST'])
 def patrol(drone_id):
-    drone = get_drone_by_id(drone_id)
-    if drone:
-        response = api_send(drone["ip"], "patrol", port=12306, timeout=10)
-        if response:
-            drone["status"] = "on_air"
-            return jsonify({"message": "Patrol started successfully"}), 200
-        else:
-            return jsonify({"error": "Failed to communicate with drone."}), 500    
-    else:
-        return jsonify({"error": "Drone not found"}), 404
+    return submit_flight(drone_id, "patrol", request.get_json(silent=True) or None)
 
-# Emergency
+def submit_flight(drone_id, command, args):
+    """Queues a flight command, rejecting it right away if the battery prediction says it cannot finish."""
+    if args is not None and not isinstance(args, dict):
+        return jsonify({"error": "The request body must be a JSON object"}), 400
+    drone = fleet.get(drone_id)
+    rejected = battery_check(drone, command, args) if drone is not None else None
+    if rejected:
+        body, status = rejected
+        return jsonify(body), status
+    return submit_drone_command(drone_id, command, args)
+
+# Emergency: runs on the priority lane so it never waits behind queued commands
 @app.route('/drones/<int:drone_id>/emergency', methods=['POST'])
 def emergency_drone(drone_id):
-    drone = get_drone_by_id(drone_id)
-    if drone:
-        drone["status"] = "emergency"
-        response = api_send(drone["ip"], "stop", port=12306, timeout=10)
-        if response:
-            drone["status"] = "on_ground"
-            socketio.emit('drone_update', drone)
-            return jsonify({"message": f"Drone {drone_id} stopped. Response: {response}"})
-        else:
-            return jsonify({"error": "Failed to communicate with drone."}), 500
-        return jsonify({"message": f"Emergency triggered for drone {drone_id}."})
+    return submit_drone_command(drone_id, "emergency", priority=True)
+
+# Command jobs
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    drone_id = request.args.get("drone_id", type=int)
+    state = request.args.get("state")
+    return jsonify([job.to_dict() for job in jobs.list(drone_id=drone_id, state=state)])
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job:
+        return jsonify(job.to_dict())
     else:
-        return jsonify({"error": "Drone not found"}), 404
+        return jsonify({"error": "Job not found"}), 404
+
+def run_fleet_batch(batch_id, started, items):
+    """Queues one drone's share of a batch as jobs and streams each result as it arrives.
+
+    The jobs join the drone's queue, so they never overlap other commands to the same drone.
+    """
+    queued = [(index, item, jobs.submit(item.get("drone_id"), item.get("command"), item.get("args"),
+                                        priority=item.get("command") == "emergency"))
+              for index, item in items]
+    results = []
+    for index, item, job in queued:
+        job.done.wait()
+        result = {
+            "batch_id": batch_id,
+            "index": index,
+            "drone_id": item.get("drone_id"),
+            "command": item.get("command"),
+            "job_id": job.id,
+            "status_code": job.status_code,
+            "response": job.result,
+            "started_ms": round((job.started - started) * 1000, 1),
+            "elapsed_ms": round((job.finished - job.started) * 1000, 1),
+        }
+        emit_event('fleet_command_result', result)
+        results.append(result)
+    return results
+
+# Send several commands to the fleet in parallel: {"commands": [{"drone_id", "command", "args"}]}
+@app.route('/fleet/commands', methods=['POST'])
+def fleet_commands():
+    data = request.json or {}
+    commands = data.get("commands")
+    if not isinstance(commands, list) or not commands:
+        return jsonify({"error": "Commands list missing"}), 400
+    if not all(isinstance(item, dict) for item in commands):
+        return jsonify({"error": "Each command must be an object"}), 400
+
+    # Commands for the same drone keep their order; different drones run concurrently
+    per_drone = {}
+    for index, item in enumerate(commands):
+        per_drone.setdefault(item.get("drone_id"), []).append((index, item))
+
+    batch_id = uuid.uuid4().hex
+    started = time.time()
+    futures = [fleet_executor.submit(run_fleet_batch, batch_id, started, items)
+               for items in per_drone.values()]
+
+    results = [None] * len(commands)
+    for future in futures:
+        for result in future.result():
+            results[result["index"]] = result
+    return jsonify({
+        "batch_id": batch_id,
+        "elapsed_ms": round((time.time() - started) * 1000, 1),
+        "results": results,
+    })
 
 # Stop
 @app.route('/drones/<int:drone_id>/stop', methods=['POST'])
 def stop_drone(drone_id):
-    if drone_id in drones:
-        drones[drone_id]["streaming"] = False
-        drones[drone_id]["status"] = "on_ground"
+    state = fleet.update(drone_id, streaming=False, status="on_ground")
+    if state:
+        history.record_event(drone_id, "command", "stop", status=200)
+        broadcaster.publish(state)
         return jsonify({"message": f"Drone {drone_id} has stopped."})
     else:
         return jsonify({"error": "Drone not found"}), 404
 
-# Start streaming
+# Start streaming: the server ingests the drone's stream once and relays it to every viewer
 @app.route('/drones/<int:drone_id>/streamon', methods=['POST'])
 def start_stream(drone_id):
-    drone = get_drone_by_id(drone_id)
+    drone = fleet.get(drone_id)
     if drone:
-        #response = api_send(drone["ip"], "streamon", port=12306)
-        response = True
-        print(response)
+        response = api_send(drone.ip, "streamon", port=12306)
         if response:
-            drone["streaming"] = True
-            socketio.emit('drone_update', drone)
-            return jsonify({"message": f"Drone {drone_id} is streaming."})
+            video_relay.start(drone.id)
+            state = fleet.update(drone.id, streaming=True)
+            broadcaster.publish(state)
+            return jsonify({"message": f"Drone {drone_id} is streaming.", "video": f"/drones/{drone_id}/video.mjpg"})
+        else:
+            return jsonify({"error": "Failed to communicate with drone."}), 500
     else:
         return jsonify({"error": "Drone not found"}), 404
 
 # Stop streaming
 @app.route('/drones/<int:drone_id>/streamoff', methods=['POST'])
 def stop_stream(drone_id):
-    drone = get_drone_by_id(drone_id)
+    drone = fleet.get(drone_id)
     if drone:
-        #response = api_send(drone["ip"], "streamoff", port=12306)
-        response = True
+        response = api_send(drone.ip, "streamoff", port=12306)
+        video_relay.stop(drone.id)
+        state = fleet.update(drone.id, streaming=False)
+        broadcaster.publish(state)
         if response:
-            print(response)
-            drone["streaming"] = False
-            socketio.emit('drone_update', drone)
             return jsonify({"message": f"Drone {drone_id} has stopped streaming."})
+        else:
+            return jsonify({"error": "Failed to communicate with drone."}), 500
     else:
         return jsonify({"error": "Drone not found"}), 404
 
-# Serve map image
-@app.route('/map', methods=['GET'])
-def get_map():
-    if os.path.exists(GRID_MAP_PATH):
-        return send_file(GRID_MAP_PATH, mimetype='image/jpeg')
+# Live video as MJPEG; every viewer reads the same shared frames
+@app.route('/drones/<int:drone_id>/video.mjpg', methods=['GET'])
+def drone_video(drone_id):
+    stream = video_relay.get(drone_id)
+    if stream is None:
+        return jsonify({"error": "Drone is not streaming"}), 404
+    return app.response_class(mjpeg_frames(stream.ring), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+# Latest video frame as a single JPEG
+@app.route('/drones/<int:drone_id>/video/frame.jpg', methods=['GET'])
+def drone_video_frame(drone_id):
+    stream = video_relay.get(drone_id)
+    if stream is None:
+        return jsonify({"error": "Drone is not streaming"}), 404
+    _, frame = stream.ring.latest()
+    if frame is None:
+        return jsonify({"error": "No frame received yet"}), 503
+    return app.response_class(frame, mimetype='image/jpeg')
+
+# Shared calibration and undistortion maps
+@app.route('/vision/context', methods=['GET'])
+def get_vision_context():
+    return jsonify(vision_context.stats())
+
+# Camera localization statistics
+@app.route('/localization/stats', methods=['GET'])
+def get_localization_stats():
+    return jsonify({context.testbed.id: context.localizer.stats()
+                    for context in testbeds.loaded() if context.localizer is not None})
+
+# Video relay statistics
+@app.route('/video/stats', methods=['GET'])
+def get_video_stats():
+    return jsonify(video_relay.stats())
+
+# Conflict-free paths for several drones: {"drones": [{"drone_id", "goal": [x, y], "start": [x, y]}]}
+# in mm of the map frame; drones earlier in the list have priority. start defaults to the drone location.
+# All the drones must be in the same testbed ("testbed", by default the one of the first drone).
+# Each path lists its waypoints with the step at which to reach them (holds included), step_s seconds apart.
+@app.route('/fleet/plan', methods=['POST'])
+def plan_fleet_paths():
+    data = request.json or {}
+    entries = data.get("drones")
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"error": "Drones list missing"}), 400
+    testbed_id = data.get("testbed") or testbeds.testbed_of(entries[0].get("drone_id"))
+    context = testbeds.context(testbed_id)
+    if context is None:
+        return testbed_not_found(testbed_id)
+    try:
+        grid = context.grid.get()
+        transform = get_map_transform(testbed_id)
+    except Exception as e:
+        return jsonify({"error": f"Error building planning grid: {str(e)}"}), 500
+    if transform is None:
+        return jsonify({"error": "Map transform not available"}), 503
+
+    started = time.monotonic()
+    requests, results = [], {}
+    for entry in entries:
+        drone = fleet.get(entry.get("drone_id"))
+        if drone is None or "goal" not in entry:
+            results[entry.get("drone_id")] = {"error": "Drone not found" if drone is None else "Goal missing"}
+            continue
+        if testbeds.testbed_of(drone.id) != testbed_id:
+            results[drone.id] = {"error": f"Drone is not in testbed {testbed_id}"}
+            continue
+        start_mm = entry.get("start") or drone.location[:2]
+        start_px, goal_px = transform.world_to_pixel([start_mm[:2], entry["goal"][:2]])
+        start = grid.nearest_free(grid.cell_of(start_px))
+        goal = grid.nearest_free(grid.cell_of(goal_px))
+        if start is None or goal is None:
+            results[drone.id] = {"error": "No free cell near start or goal"}
+            continue
+        requests.append((drone.id, start, goal))
+
+    for drone_id, path in plan_fleet(grid, requests).items():
+        if path is None:
+            results[drone_id] = {"error": "No path found"}
+            continue
+        waypoints = simplify(path)
+        waypoints_px = np.array([grid.pixel_of(cell) for _, cell in waypoints])
+        results[drone_id] = {
+            "steps": len(path) - 1,
+            # Step at which the drone must reach each waypoint; equal cells at consecutive entries are holds
+            "waypoint_steps": [step for step, _ in waypoints],
+            "waypoints_px": waypoints_px.round(1).tolist(),
+            "waypoints_mm": transform.pixel_to_world(waypoints_px).round(1).tolist(),
+        }
+
+    return jsonify({
+        "planning_ms": round((time.monotonic() - started) * 1000, 2),
+        "testbed": testbed_id,
+        "cell_mm": PLAN_CELL_MM,
+        # Time of one step: long enough to fly a diagonal cell at cruise speed
+        "step_s": round(PLAN_CELL_MM * 2 ** 0.5 / DRONE_SPEED_MM_S, 3),
+        "grid": {"rows": grid.rows, "cols": grid.cols, "free_cells": int(grid.free.sum())},
+        "paths": results,
+    })
+
+def mission_budget_cells(drone):
+    """Grid cells a drone can fly before its predicted battery reaches the reserve."""
+    return battery_model.remaining_flight_s(drone.id, drone.battery) * DRONE_SPEED_MM_S / PLAN_CELL_MM
+
+def plan_mission_routes(mission, drone_ids, area):
+    """Routes of the drones over area (the whole free map by default), from their current positions."""
+    transform = get_map_transform(mission.testbed)
+    if transform is None:
+        raise ValueError("Map transform not available")
+    grid = mission.grid
+    drones = [fleet.get(drone_id) for drone_id in drone_ids]
+    start_px = transform.world_to_pixel([drone.location[:2] for drone in drones])
+    starts, budgets = {}, {}
+    for drone, pixel in zip(drones, start_px):
+        cell = grid.cell_of(pixel)
+        starts[drone.id] = grid.nearest_free(cell) or cell
+        budgets[drone.id] = mission_budget_cells(drone)
+    routes = route_planner.plan(grid, starts, budgets, mission.spacing, area)
+    plans = {}
+    for drone_id, route in routes.items():
+        waypoints = []
+        if route.cells:
+            pixels = (np.array(route.cells, dtype=np.float64)[:, ::-1] + 0.5) * grid.cell_px
+            waypoints = [[round(float(x), 1), round(float(y), 1), MISSION_ALTITUDE_MM]
+                         for x, y in transform.pixel_to_world(pixels)]
+        plans[drone_id] = (route, waypoints)
+    return plans
+
+def send_mission_waypoint(drone, waypoint):
+    """Takes off if needed and flies the drone to the waypoint; True on success.
+
+    Both go through the drone's job queue, after any command already queued for it.
+    """
+    if fleet.get(drone.id).status != "in_air":
+        job = jobs.submit(drone.id, "takeoff")
+        job.done.wait()
+        if job.status_code != 200 and fleet.get(drone.id).status != "in_air":
+            return False
+    job = jobs.submit(drone.id, "go_to", {"location": waypoint})
+    job.done.wait()
+    return job.status_code == 200
+
+route_planner = RoutePlanner()
+missions = MissionEngine(fleet, plan_mission_routes, send_mission_waypoint,
+                         lambda mission: emit_event('mission_update', mission),
+                         tolerance_mm=MISSION_TOLERANCE_MM,
+                         fit_to_fly=lambda drone: battery_model.can_fly(drone.id, 0.001, drone.battery),
+                         pose_age=pose_age, pose_timeout=MISSION_POSE_TIMEOUT_S)
+
+# Start a patrol mission: {"drones": [1, 2], "spacing_mm": 300}; the map is split between the
+# drones and each one gets a coverage route sized to its battery. The drones must share a testbed
+# ("testbed", by default the one of the first drone, or all of its drones if none are given).
+@app.route('/missions', methods=['POST'])
+def start_mission():
+    data = request.json or {}
+    testbed_id = data.get("testbed") or (testbeds.testbed_of(data["drones"][0]) if data.get("drones")
+                                         else testbeds.default)
+    context = testbeds.context(testbed_id)
+    if context is None:
+        return testbed_not_found(testbed_id)
+    drone_ids = data.get("drones") or testbeds.drones_of(testbed_id, [drone.id for drone in fleet.all()])
+    missing = [drone_id for drone_id in drone_ids if fleet.get(drone_id) is None]
+    if missing:
+        return jsonify({"error": f"Drones not found: {missing}"}), 404
+    elsewhere = [drone_id for drone_id in drone_ids if testbeds.testbed_of(drone_id) != testbed_id]
+    if elsewhere:
+        return jsonify({"error": f"Drones not in testbed {testbed_id}: {elsewhere}"}), 400
+    # Drones without enough predicted flight time are left out; the others share their area
+    excluded = {drone_id: battery_model.predict(drone_id) for drone_id in drone_ids
+                if not battery_model.can_fly(drone_id, MISSION_MIN_FLIGHT_S, fleet.get(drone_id).battery)}
+    drone_ids = [drone_id for drone_id in drone_ids if drone_id not in excluded]
+    if not drone_ids:
+        return jsonify({"error": "No drone has enough battery for a mission", "excluded": excluded}), 409
+    try:
+        spacing_mm = float(data.get("spacing_mm", MISSION_SPACING_MM))
+    except (TypeError, ValueError):
+        spacing_mm = None
+    if spacing_mm is None or not 0 < spacing_mm < float("inf"):
+        return jsonify({"error": "spacing_mm must be a positive number"}), 400
+    spacing = max(1, round(spacing_mm / PLAN_CELL_MM))
+    try:
+        grid = context.grid.get()
+        mission = missions.start(grid, drone_ids, spacing, testbed=testbed_id)
+    except Exception as e:
+        return jsonify({"error": f"Error planning mission: {str(e)}"}), 500
+    return jsonify(dict(mission.to_dict(waypoints=True), excluded=excluded)), 201
+
+@app.route('/missions', methods=['GET'])
+def list_missions():
+    return jsonify([mission.to_dict() for mission in missions.list()])
+
+@app.route('/missions/<mission_id>', methods=['GET'])
+def get_mission(mission_id):
+    mission = missions.get(mission_id)
+    if mission is None:
+        return jsonify({"error": "Mission not found"}), 404
+    return jsonify(mission.to_dict(waypoints=request.args.get("waypoints") in ("1", "true")))
+
+@app.route('/missions/<mission_id>/abort', methods=['POST'])
+def abort_mission(mission_id):
+    mission = missions.abort(mission_id)
+    if mission is None:
+        return jsonify({"error": "Mission not found"}), 404
+    return jsonify(mission.to_dict())
+
+# Take a drone out of a mission; the area it had left is split among the others
+@app.route('/missions/<mission_id>/drones/<int:drone_id>/drop', methods=['POST'])
+def drop_mission_drone(mission_id, drone_id):
+    try:
+        mission = missions.drop(mission_id, drone_id)
+    except Exception as e:
+        return jsonify({"error": f"Error re-planning mission: {str(e)}"}), 500
+    if mission is None:
+        return jsonify({"error": "Mission not found"}), 404
+    return jsonify(mission.to_dict(waypoints=True))
+
+# Battery prediction: discharge rate, remaining flight time and polling interval
+@app.route('/drones/<int:drone_id>/battery', methods=['GET'])
+def get_drone_battery(drone_id):
+    drone = fleet.get(drone_id)
+    if drone is None:
+        return jsonify({"error": "Drone not found"}), 404
+    prediction = battery_model.predict(drone_id) or {
+        "level": drone.battery,
+        "remaining_flight_s": round(battery_model.remaining_flight_s(drone_id, drone.battery), 1),
+    }
+    return jsonify(dict(prediction, drone_id=drone_id))
+
+# Connection pool statistics
+@app.route('/pool/stats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(drone_pool.stats())
+
+# Tracked positions: ?since=<unix time>&max_points=<n>
+@app.route('/drones/<int:drone_id>/track', methods=['GET'])
+def get_drone_track(drone_id):
+    if fleet.get(drone_id) is None:
+        return jsonify({"error": "Drone not found"}), 404
+    since = request.args.get("since", type=float)
+    max_points = request.args.get("max_points", type=int)
+    buf = pose_listener.buffers.get(drone_id)
+    points = buf.since(since, max_points) if buf else []
+    return jsonify({"drone_id": drone_id, "columns": TRACK_COLUMNS, "points": points})
+
+# Drone health and circuit breaker state, by drone id
+@app.route('/fleet/health', methods=['GET'])
+def get_fleet_health():
+    breakers = drone_health.stats()
+    return jsonify({drone.id: dict(breakers.get(drone.ip, {"health": drone.health}), ip=drone.ip)
+                    for drone in fleet.all()})
+
+# Telemetry scheduler state
+@app.route('/telemetry', methods=['GET'])
+def get_telemetry_status():
+    return jsonify(telemetry.stats())
+
+def history_range():
+    """(start, end) from ?start=&end= in Unix seconds; the last hour by default."""
+    end = request.args.get("end", type=float) or time.time()
+    start = request.args.get("start", type=float) or end - 3600
+    return start, end
+
+# Downsampled time series of a drone for flight review: ?metric=battery&start=&end=&points=
+@app.route('/history/drones/<int:drone_id>/samples', methods=['GET'])
+def get_history_samples(drone_id):
+    start, end = history_range()
+    metric = request.args.get("metric")
+    if not metric:
+        return jsonify({"drone_id": drone_id, "metrics": history.metrics(drone_id)})
+    points = min(request.args.get("points", 500, type=int), HISTORY_MAX_POINTS)
+    return jsonify({
+        "drone_id": drone_id,
+        "metric": metric,
+        "start": start,
+        "end": end,
+        "columns": ["t", "mean", "min", "max", "count"],
+        "points": history.samples(drone_id, metric, start, end, points),
+    })
+
+# Commands and status changes of a drone, newest first: ?kind=command&start=&end=&limit=
+@app.route('/history/drones/<int:drone_id>/events', methods=['GET'])
+def get_history_events(drone_id):
+    start, end = history_range()
+    limit = min(request.args.get("limit", 500, type=int), HISTORY_MAX_POINTS)
+    return jsonify({"drone_id": drone_id, "start": start, "end": end,
+                    "events": history.events(drone_id, start, end, request.args.get("kind"), limit)})
+
+@app.route('/history/stats', methods=['GET'])
+def get_history_stats():
+    return jsonify(history.stats())
+
+# Testbeds and the drones flying in each one
+@app.route('/testbeds', methods=['GET'])
+def list_testbeds():
+    drone_ids = [drone.id for drone in fleet.all()]
+    loaded = {context.testbed.id for context in testbeds.loaded()}
+    return jsonify([dict(testbed.to_dict(), drones=testbeds.drones_of(testbed.id, drone_ids),
+                         loaded=testbed.id in loaded, default=testbed.id == testbeds.default)
+                    for testbed in testbeds.all()])
+
+@app.route('/testbeds/<testbed_id>', methods=['GET'])
+def get_testbed(testbed_id):
+    testbed = testbeds.get(testbed_id)
+    if testbed is None:
+        return testbed_not_found(testbed_id)
+    return jsonify(dict(testbed.to_dict(), drones=testbeds.drones_of(testbed_id, [d.id for d in fleet.all()])))
+
+# Move drones to a testbed: {"drones": [1, 2]}
+@app.route('/testbeds/<testbed_id>/drones', methods=['POST'])
+def assign_testbed_drones(testbed_id):
+    if testbeds.get(testbed_id) is None:
+        return testbed_not_found(testbed_id)
+    drone_ids = (request.json or {}).get("drones") or []
+    missing = [drone_id for drone_id in drone_ids if fleet.get(drone_id) is None]
+    if missing:
+        return jsonify({"error": f"Drones not found: {missing}"}), 404
+    for drone_id in drone_ids:
+        testbeds.assign(drone_id, testbed_id)
+    return jsonify({"testbed": testbed_id, "drones": testbeds.drones_of(testbed_id, [d.id for d in fleet.all()])})
+
+@app.route('/testbeds/stats', methods=['GET'])
+def get_testbeds_stats():
+    return jsonify(testbeds.stats())
+
+# The /map routes serve the default testbed; /testbeds/<id>/map... the same for any testbed
+
+# Serve map image, optionally downscaled with ?width=; clients revalidate with ETag/Last-Modified
+@app.route('/map', defaults={'testbed_id': DEFAULT_TESTBED}, methods=['GET'])
+@app.route('/testbeds/<testbed_id>/map', methods=['GET'])
+def get_map(testbed_id):
+    testbed = testbeds.get(testbed_id)
+    if testbed is None:
+        return testbed_not_found(testbed_id)
+    if os.path.exists(testbed.grid_map):
+        version, mtime = map_variants.version(testbed.grid_map)
+        width = request.args.get("width", type=int)
+        path = map_variants.resized(testbed.grid_map, width) if width else testbed.grid_map
+        return send_file(path, mimetype='image/jpeg', etag=f"{version}-{os.path.basename(path)}",
+                         last_modified=mtime, max_age=MAP_MAX_AGE)
     else:
         return jsonify({"error": "Map file not found"}), 404
 
+# Tile pyramid description for slippy-map clients
+@app.route('/map/tiles', defaults={'testbed_id': DEFAULT_TESTBED}, methods=['GET'])
+@app.route('/testbeds/<testbed_id>/map/tiles', methods=['GET'])
+def get_map_tiles_info(testbed_id):
+    testbed = testbeds.get(testbed_id)
+    if testbed is None:
+        return testbed_not_found(testbed_id)
+    if not os.path.exists(testbed.grid_map):
+        return jsonify({"error": "Map file not found"}), 404
+    return jsonify(map_variants.tile_info(testbed.grid_map))
+
+@app.route('/map/tiles/<int:z>/<int:x>/<int:y>', defaults={'testbed_id': DEFAULT_TESTBED}, methods=['GET'])
+@app.route('/testbeds/<testbed_id>/map/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_map_tile(testbed_id, z, x, y):
+    testbed = testbeds.get(testbed_id)
+    if testbed is None:
+        return testbed_not_found(testbed_id)
+    if not os.path.exists(testbed.grid_map):
+        return jsonify({"error": "Map file not found"}), 404
+    version, mtime = map_variants.version(testbed.grid_map)
+    path = map_variants.tile(testbed.grid_map, z, x, y)
+    if path is None:
+        return jsonify({"error": "Tile not found"}), 404
+    return send_file(path, mimetype='image/jpeg', etag=f"{version}-{z}-{x}-{y}",
+                     last_modified=mtime, max_age=MAP_MAX_AGE)
+
 # Obtener información del mapa (dimensiones y escala)
-@app.route('/map/info', methods=['GET'])
-def get_map_info():
+@app.route('/map/info', defaults={'testbed_id': DEFAULT_TESTBED}, methods=['GET'])
+@app.route('/testbeds/<testbed_id>/map/info', methods=['GET'])
+def get_map_info(testbed_id):
     try:
-        if not os.path.exists(REFERENCE_MAP_PATH):
+        context = testbeds.context(testbed_id)
+        if context is None:
+            return testbed_not_found(testbed_id)
+        if not os.path.exists(context.testbed.reference_map):
             return jsonify({"error": "Map file not found"}), 404
             
-        scale_info = get_map_scale()
+        with traced("map_geometry"):
+            geometry = context.geometry.get()
+        scale_info = geometry["info"] if geometry else None
         if scale_info is None:
             return jsonify({"error": "Error calculating map scale"}), 500
             
@@ -454,6 +1298,131 @@ def get_map_info():
     except Exception as e:
         return jsonify({"error": f"Error processing map info: {str(e)}"}), 500
 
+# Forzar el recálculo de la información del mapa
+@app.route('/map/info/refresh', defaults={'testbed_id': DEFAULT_TESTBED}, methods=['POST'])
+@app.route('/testbeds/<testbed_id>/map/info/refresh', methods=['POST'])
+def refresh_map_info(testbed_id):
+    try:
+        context = testbeds.context(testbed_id)
+        if context is None:
+            return testbed_not_found(testbed_id)
+        if not os.path.exists(context.testbed.reference_map):
+            return jsonify({"error": "Map file not found"}), 404
+
+        geometry = context.geometry.refresh()
+        scale_info = geometry["info"] if geometry else None
+        if scale_info is None:
+            return jsonify({"error": "Error calculating map scale"}), 500
+
+        return jsonify(scale_info)
+
+    except Exception as e:
+        return jsonify({"error": f"Error processing map info: {str(e)}"}), 500
+
+# Homografías de la transformación píxel <-> mundo del mapa actual
+@app.route('/map/transform', defaults={'testbed_id': DEFAULT_TESTBED}, methods=['GET'])
+@app.route('/testbeds/<testbed_id>/map/transform', methods=['GET'])
+def get_map_transform_info(testbed_id):
+    if testbeds.get(testbed_id) is None:
+        return testbed_not_found(testbed_id)
+    transform = get_map_transform(testbed_id)
+    if transform is None:
+        return jsonify({"error": "Map transform not available"}), 503
+    return jsonify(transform.to_dict())
+
+# Conversión por lotes: {"points": [[u, v], ...]} en píxeles o [[x, y], ...] en mm
+@app.route('/map/transform/<direction>', defaults={'testbed_id': DEFAULT_TESTBED}, methods=['POST'])
+@app.route('/testbeds/<testbed_id>/map/transform/<direction>', methods=['POST'])
+def transform_points(testbed_id, direction):
+    if testbeds.get(testbed_id) is None:
+        return testbed_not_found(testbed_id)
+    if direction not in ("to_world", "to_pixel"):
+        return jsonify({"error": "Direction must be to_world or to_pixel"}), 404
+    data = request.json or {}
+    try:
+        points = np.asarray(data.get("points"), dtype=np.float64)
+    except (TypeError, ValueError):
+        points = None
+    if points is None or points.ndim != 2 or points.shape[1] != 2:
+        return jsonify({"error": "Points must be a list of [x, y] pairs"}), 400
+
+    transform = get_map_transform(testbed_id)
+    if transform is None:
+        return jsonify({"error": "Map transform not available"}), 503
+    if direction == "to_world":
+        result = transform.pixel_to_world(points)
+    else:
+        result = transform.world_to_pixel(points)
+    return jsonify({"points": result.tolist(), "units": "mm" if direction == "to_world" else "px"})
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Per-request tracing: on for every request with METRICS_TRACE, or for one with "X-Trace: 1"
+    g.trace = [] if METRICS_TRACE or request.headers.get('X-Trace') == '1' else None
+
+@app.after_request
+def record_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    http_request_seconds.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    trace = g.get('trace')
+    if trace is not None:
+        spans = [f"{name};dur={duration * 1000:.2f}" for name, duration in trace]
+        spans.append(f"total;dur={elapsed * 1000:.2f}")
+        response.headers['Server-Timing'] = ", ".join(spans)
+        print(f"TRACE {request.method} {request.path} {response.status_code}: {', '.join(spans)}")
+    return response
+
+@metrics.collector
+def collect_runtime_stats():
+    """Values that already live in other components, read only when /metrics is scraped."""
+    pool = drone_pool.stats()
+    telemetry_state = telemetry.stats()
+    return [
+        ("drone_pool_open_connections", "gauge", "Open connections per drone",
+         [({"drone": host}, stats["open_connections"]) for host, stats in pool.items()]),
+        ("drone_pool_reconnects_total", "counter", "Reconnections per drone",
+         [({"drone": host}, stats["reconnects"]) for host, stats in pool.items()]),
+        ("drone_pool_retries_total", "counter", "Retried requests per drone",
+         [({"drone": host}, stats["retries"]) for host, stats in pool.items()]),
+        ("drone_pool_errors_total", "counter", "Socket errors per drone",
+         [({"drone": host}, stats["errors"]) for host, stats in pool.items()]),
+        ("drone_health", "gauge", "Drones per health state",
+         [({"health": health}, sum(1 for drone in fleet.all() if drone.health == health))
+          for health in ("online", "degraded", "offline")]),
+        ("drone_circuit_rejected_total", "counter", "Requests failed fast by an open circuit",
+         [({"drone": host}, stats["rejected"]) for host, stats in drone_health.stats().items()]),
+        ("telemetry_drones_online", "gauge", "Drones answering telemetry",
+         [({}, sum(1 for d in telemetry_state["drones"].values() if d["online"]))]),
+        ("broadcast_frames_total", "counter", "drone_updates frames sent", [({}, broadcaster.frames)]),
+        ("broadcast_skipped_total", "counter", "Drone updates dropped as no-ops", [({}, broadcaster.skipped)]),
+        ("fleet_drones", "gauge", "Drones in the fleet", [({}, len(fleet))]),
+        ("testbeds_loaded", "gauge", "Testbeds with their context in memory", [({}, len(testbeds.loaded()))]),
+        ("testbed_loads_total", "counter", "Testbed contexts loaded", [({}, testbeds.loads)]),
+        ("history_rows_written_total", "counter", "History rows written", [({}, history.written)]),
+        ("history_rows_dropped_total", "counter", "History rows dropped on a full queue", [({}, history.dropped)]),
+    ]
+
+# Prometheus text exposition of the metrics
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def run_development_server():
+    """Werkzeug development server with Socket.IO; see wsgi.py for production.
+
+    With the reloader the services start in the child process that serves
+    requests, not in the watcher.
+    """
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
+
+# python server.py still works, but the localizer's worker processes then re-import this module
+# as their __main__ and set the app up once more; devserver.py and gunicorn avoid that
 if __name__ == '__main__':
-    #start_battery_update_thread()
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    run_development_server()
@@ -0,0 +1,320 @@
+"""Simulated drone fleet speaking the drone command protocol, for local runs and load tests.
+
+Every drone listens on its own loopback address (127.0.1.1, 127.0.1.2, ...) on
+the command port, so the server reaches it exactly like a real drone once the
+fleet config points at those addresses. With --protocol binary the drones
+also speak the binary protocol (and push telemetry events on it); with
+text they behave like older firmware:
+
+    python sim_drone.py --drones 20 --latency 0.05 --jitter 0.02 --config sim_fleet.json
+    FLEET_CONFIG=sim_fleet.json python devserver.py
+"""
+import argparse
+import json
+import math
+import random
+import socketserver
+import threading
+import time
+
+import drone_protocol as protocol
+from drone_pool import DEFAULT_PORT, MESSAGE_DELIMITER
+
+# Flight model
+SPEED_MM_S = 500.0
+TAKEOFF_ALTITUDE_MM = 1000.0
+DRAIN_IN_AIR = 0.05     # battery % per second while flying
+DRAIN_ON_GROUND = 0.002
+
+
+class SimulatedDrone:
+    """State of one simulated drone, advanced lazily whenever it is queried."""
+
+    def __init__(self, drone_id, latency=0.02, jitter=0.0, loss=0.0, battery=100.0, seed=0):
+        self.id = drone_id
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.battery = battery
+        self.status = "on_ground"
+        self.position = [0.0, 0.0, 0.0]
+        self.target = None
+        self.patrol = []
+        self.streaming = False
+        self.commands = 0
+        self.dropped = 0
+        # One generator per drone: the same seed gives the same delays and losses
+        self._rng = random.Random(f"{seed}:{drone_id}")
+        self._lock = threading.Lock()
+        self._updated = time.monotonic()
+
+    def delay(self):
+        """(seconds to wait before answering, whether the reply is lost)."""
+        with self._lock:
+            delay = max(0.0, self._rng.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+            lost = self.loss > 0 and self._rng.random() < self.loss
+        return delay, lost
+
+    def handle(self, message):
+        """Reply to one command, as the drone firmware would send it."""
+        command, _, argument = message.partition(":")
+        with self._lock:
+            self._advance()
+            self.commands += 1
+            if command == "get_battery":
+                return str(int(self.battery))
+            if command == "get_position":
+                return ",".join(f"{v:.1f}" for v in self.position)
+            if command == "get_status":
+                return self.status
+            if command == "takeoff":
+                if self.battery <= 0:
+                    return "error: battery empty"
+                self.status = "in_air"
+                self.target = (self.position[0], self.position[1], TAKEOFF_ALTITUDE_MM)
+                return "ok"
+            if command == "land":
+                self.status = "on_ground"
+                self.target = (self.position[0], self.position[1], 0.0)
+                self.patrol = []
+                return "ok"
+            if command == "go_to":
+                try:
+                    target = tuple(float(v) for v in argument.split(","))
+                except ValueError:
+                    return "error: bad location"
+                if len(target) != 3:
+                    return "error: bad location"
+                if self.status != "in_air":
+                    return "error: not flying"
+                self.target = target
+                self.patrol = []
+                return "ok"
+            if command == "patrol":
+                x, y, z = self.position[0], self.position[1], max(self.position[2], TAKEOFF_ALTITUDE_MM)
+                self.status = "in_air"
+                self.patrol = [(x + 1000, y, z), (x + 1000, y + 1000, z), (x, y + 1000, z), (x, y, z)]
+                self.target = self.patrol[0]
+                return "ok"
+            if command == "stop":
+                self.target = None
+                self.patrol = []
+                return "ok"
+            if command in ("streamon", "streamoff"):
+                self.streaming = command == "streamon"
+                return "ok"
+            return f"error: unknown command {command}"
+
+    def _advance(self):
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        flying = self.status == "in_air" or self.position[2] > 0
+        self.battery = max(0.0, self.battery - elapsed * (DRAIN_IN_AIR if flying else DRAIN_ON_GROUND))
+        step = SPEED_MM_S * elapsed
+        while self.target is not None and step > 0:
+            delta = [t - p for t, p in zip(self.target, self.position)]
+            distance = math.sqrt(sum(d * d for d in delta))
+            if distance <= step:
+                self.position = list(self.target)
+                step -= distance
+                if self.patrol:
+                    self.patrol.append(self.patrol.pop(0))
+                    self.target = self.patrol[0]
+                else:
+                    self.target = None
+            else:
+                self.position = [p + d * step / distance for p, d in zip(self.position, delta)]
+                step = 0
+
+
+class _CommandHandler(socketserver.BaseRequestHandler):
+    """Serves one connection in the text protocol, or in the binary one if it starts with a frame."""
+
+    def handle(self):
+        drone = self.server.drone
+        try:
+            buffer = self.request.recv(4096)
+        except OSError:
+            return
+        if self.server.binary and buffer.startswith(protocol.MAGIC):
+            self._handle_binary(drone, bytearray(buffer))
+        else:
+            self._handle_text(drone, buffer)
+
+    def _handle_text(self, drone, buffer):
+        """Newline-delimited requests, answered in order."""
+        while True:
+            while MESSAGE_DELIMITER in buffer:
+                line, buffer = buffer.split(MESSAGE_DELIMITER, 1)
+                delay, lost = drone.delay()
+                if delay:
+                    time.sleep(delay)
+                reply = drone.handle(line.decode("utf8", "replace").strip())
+                if lost:
+                    # A lost reply: the caller times out and drops the connection
+                    drone.dropped += 1
+                    continue
+                try:
+                    self.request.sendall(reply.encode("utf8") + MESSAGE_DELIMITER)
+                except OSError:
+                    return
+            try:
+                chunk = self.request.recv(4096)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buffer += chunk
+
+    def _handle_binary(self, drone, buffer):
+        """Framed requests, each answered on its own thread so replies can overtake each other."""
+        write_lock = threading.Lock()
+        closed = threading.Event()
+
+        def send(frame):
+            with write_lock:
+                self.request.sendall(frame)
+
+        def answer(request_id, opcode, payload):
+            delay, lost = drone.delay()
+            if delay:
+                time.sleep(delay)
+            name = protocol.COMMANDS.get(opcode)
+            if name == "go_to":
+                message = "go_to:" + ",".join(str(v) for v in protocol.VEC3.unpack(payload))
+            else:
+                message = name or f"opcode {opcode}"
+            reply = drone.handle(message)
+            if lost:
+                drone.dropped += 1
+                return
+            body = protocol.encode_error(reply[7:]) if reply.startswith("error: ") else protocol.encode_result(opcode, reply)
+            try:
+                send(protocol.pack_frame(protocol.REPLY, request_id, opcode, body))
+            except OSError:
+                closed.set()
+
+        def push_events():
+            while not closed.wait(self.server.event_interval):
+                for metric, command in (("battery", "get_battery"), ("position", "get_position"),
+                                        ("status", "get_status")):
+                    reply = drone.handle(command)
+                    value = tuple(float(v) for v in reply.split(",")) if metric == "position" else reply
+                    try:
+                        send(protocol.pack_frame(protocol.EVENT, 0, *protocol.encode_event(metric, value)))
+                    except OSError:
+                        closed.set()
+                        return
+
+        if self.server.event_interval:
+            threading.Thread(target=push_events, daemon=True).start()
+        try:
+            while True:
+                try:
+                    frame = protocol.read_frame(buffer)
+                except protocol.ProtocolError:
+                    return
+                if frame is not None:
+                    kind, request_id, opcode, payload, size = frame
+                    del buffer[:size]
+                    if kind == protocol.HELLO:
+                        send(protocol.pack_frame(protocol.HELLO, 0, protocol.VERSION))
+                    elif kind == protocol.REQUEST:
+                        threading.Thread(target=answer, args=(request_id, opcode, payload), daemon=True).start()
+                    continue
+                chunk = self.request.recv(4096)
+                if not chunk:
+                    return
+                buffer += chunk
+        except OSError:
+            return
+        finally:
+            closed.set()
+
+
+class _DroneServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class SimulatedFleet:
+    """size simulated drones, each served on its own loopback address."""
+
+    def __init__(self, size=3, latency=0.02, jitter=0.0, loss=0.0, seed=0, port=DEFAULT_PORT,
+                 first_address=(127, 0, 1, 1), protocol="text", event_interval=1.0):
+        self.port = port
+        self.protocol = protocol
+        self.event_interval = event_interval
+        self.drones = [SimulatedDrone(i + 1, latency, jitter, loss, seed=seed) for i in range(size)]
+        self.addresses = [_loopback(first_address, i) for i in range(size)]
+        self._servers = []
+
+    def start(self):
+        for drone, address in zip(self.drones, self.addresses):
+            server = _DroneServer((address, self.port), _CommandHandler)
+            server.drone = drone
+            server.binary = self.protocol == "binary"
+            server.event_interval = self.event_interval
+            threading.Thread(target=server.serve_forever, name=f"sim-drone-{drone.id}", daemon=True).start()
+            self._servers.append(server)
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def fleet_config(self):
+        """Fleet config in the fleet.json format, pointing at the simulated drones."""
+        return {"drones": [{"id": drone.id, "name": f"Sim {drone.id}", "ip": address, "protocol": self.protocol,
+                            "framing": "newline"}
+                           for drone, address in zip(self.drones, self.addresses)]}
+
+    def write_config(self, path):
+        with open(path, "w") as f:
+            json.dump(self.fleet_config(), f, indent=2)
+
+    def stats(self):
+        return {
+            "commands": sum(drone.commands for drone in self.drones),
+            "dropped": sum(drone.dropped for drone in self.drones),
+        }
+
+
+def _loopback(first, index):
+    """The index-th usable address from first inside 127.0.0.0/8 (.0 and .255 are skipped)."""
+    host = first[1] << 16 | first[2] << 8 | first[3]
+    while True:
+        if host & 0xFF not in (0, 255):
+            if index == 0:
+                return f"127.{host >> 16 & 0xFF}.{host >> 8 & 0xFF}.{host & 0xFF}"
+            index -= 1
+        host += 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a simulated drone fleet on loopback addresses.")
+    parser.add_argument("--drones", type=int, default=3, help="fleet size")
+    parser.add_argument("--latency", type=float, default=0.02, help="mean reply delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="standard deviation of the delay in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability that a reply is lost")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the delays and losses")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--protocol", choices=("text", "binary"), default="text",
+                        help="text: older firmware only; binary: also the binary protocol")
+    parser.add_argument("--event-interval", type=float, default=1.0,
+                        help="seconds between pushed telemetry events on binary connections; 0 disables them")
+    parser.add_argument("--config", default="sim_fleet.json", help="fleet config to write for FLEET_CONFIG")
+    args = parser.parse_args()
+
+    fleet = SimulatedFleet(args.drones, args.latency, args.jitter, args.loss, args.seed, args.port,
+                           protocol=args.protocol, event_interval=args.event_interval).start()
+    fleet.write_config(args.config)
+    print(f"{args.drones} simulated drones on {fleet.addresses[0]}..{fleet.addresses[-1]}:{args.port}, "
+          f"config written to {args.config}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fleet.stop()
@@ -0,0 +1,154 @@
+"""Concurrent fleet telemetry polling with per-metric intervals and offline backoff."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DroneHealth:
+    """Polling state of one drone, shared by all of its metrics."""
+
+    def __init__(self):
+        self.failures = 0
+        self.last_seen = None
+        self.last_error = None
+        self.retry_at = 0.0
+
+
+class TelemetryScheduler:
+    """Polls every drone concurrently on a bounded thread pool.
+
+    metrics maps a metric name to {"command", "interval", "deadline"}; metrics
+    whose interval is None are not polled. Each successful reply is handed to
+    on_result(drone, metric, reply), which may raise ValueError to reject it.
+    Drones that keep failing are polled less often, up to max_backoff seconds.
+    on_sweep(duration, polls) is called when every poll of a sweep has finished.
+    interval_for(drone, metric, interval) may return a per-drone interval to
+    use instead of the metric's after each successful poll.
+    """
+
+    def __init__(self, send, get_drones, metrics, on_result, workers=16, tick=0.5,
+                 backoff_base=5.0, max_backoff=300.0, on_sweep=None, interval_for=None):
+        self.interval_for = interval_for
+        self.send = send
+        self.on_sweep = on_sweep
+        self.get_drones = get_drones
+        self.metrics = metrics
+        self.on_result = on_result
+        self.tick = tick
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="telemetry")
+        self._lock = threading.Lock()
+        self._next_due = {}
+        self._inflight = set()
+        self._health = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_sweep = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="telemetry-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def set_interval(self, metric, interval):
+        """Changes how often a metric is polled; None disables it."""
+        self.metrics[metric]["interval"] = interval
+        with self._lock:
+            for key in [key for key in self._next_due if key[1] == metric]:
+                del self._next_due[key]
+
+    def stats(self):
+        with self._lock:
+            drones = {
+                drone_id: {
+                    "online": health.failures == 0 and health.last_seen is not None,
+                    "consecutive_failures": health.failures,
+                    "seconds_since_seen": round(time.time() - health.last_seen, 1) if health.last_seen else None,
+                    "last_error": health.last_error,
+                }
+                for drone_id, health in self._health.items()
+            }
+            inflight = len(self._inflight)
+        return {
+            "intervals": {name: metric["interval"] for name, metric in self.metrics.items()},
+            "in_flight": inflight,
+            "last_sweep": self.last_sweep,
+            "drones": drones,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sweep()
+            self._stop.wait(self.tick)
+
+    def sweep(self):
+        """Submits every due (drone, metric) poll and returns the futures."""
+        now = time.monotonic()
+        futures = []
+        with self._lock:
+            for drone in self.get_drones():
+                health = self._health.setdefault(drone.id, DroneHealth())
+                if health.retry_at > now:
+                    continue
+                for name, metric in self.metrics.items():
+                    if metric.get("interval") is None:
+                        continue
+                    key = (drone.id, name)
+                    if key in self._inflight or self._next_due.get(key, 0.0) > now:
+                        continue
+                    self._inflight.add(key)
+                    futures.append((key, drone, name, metric))
+
+        if not futures:
+            return []
+        sweep = {"started": time.time(), "polls": len(futures), "remaining": len(futures)}
+        self.last_sweep = sweep
+        return [self._executor.submit(self._poll, key, drone, name, metric, sweep)
+                for key, drone, name, metric in futures]
+
+    def _poll(self, key, drone, name, metric, sweep):
+        error = None
+        try:
+            reply = self.send(drone.ip, metric["command"], timeout=metric.get("deadline", 5))
+            if reply is None:
+                error = "unreachable"
+            elif "Error" in reply:
+                error = reply
+            else:
+                self.on_result(drone, name, reply)
+        except Exception as e:
+            error = str(e)
+
+        now = time.monotonic()
+        with self._lock:
+            self._inflight.discard(key)
+            health = self._health.setdefault(drone.id, DroneHealth())
+            if error is None:
+                health.failures = 0
+                health.last_seen = time.time()
+                health.retry_at = 0.0
+                interval = metric["interval"]
+                if self.interval_for is not None:
+                    interval = self.interval_for(drone, name, interval)
+                self._next_due[key] = now + interval
+            else:
+                health.failures += 1
+                health.last_error = error
+                delay = min(self.backoff_base * (2 ** (health.failures - 1)), self.max_backoff)
+                health.retry_at = now + delay
+                self._next_due[key] = now + max(metric["interval"], delay)
+                print(f"Error de telemetría ({name}) del dron {drone.id}: {error}")
+
+            sweep["remaining"] -= 1
+            finished = sweep["remaining"] == 0
+            if finished:
+                sweep["duration_s"] = round(time.time() - sweep["started"], 3)
+
+        if finished and self.on_sweep is not None:
+            self.on_sweep(time.time() - sweep["started"], sweep["polls"])
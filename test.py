@@ -50,17 +50,18 @@ export default function DroneFleetControlComponent() {
     fetchInitialDrones(); // Llamar a la función para obtener la información inicial de los drones
 
     // Configurar el socket para recibir actualizaciones en tiempo real
-    socket.on('drone_update', (updatedDrone) => {
-      console.log("Drone actualizado recibido:", updatedDrone);
+    // Cada mensaje trae solo los campos que han cambiado de cada dron
+    socket.on('drone_updates', (updatedDrones) => {
       setDrones((prevDrones) =>
-        prevDrones.map((drone) =>
-          drone.id === updatedDrone?.id?.toString() ? { ...drone, ...updatedDrone } : drone
-        )
+        prevDrones.map((drone) => {
+          const update = updatedDrones.find((updated) => String(updated?.id) === String(drone.id));
+          return update ? { ...drone, ...update } : drone;
+        })
       );
     });
 
     return () => {
-      socket.off('drone_update');
+      socket.off('drone_updates');
     };
   }, []);
 
@@ -0,0 +1,62 @@
+"""Battery discharge fit, flight time prediction and polling interval."""
+import pytest
+
+pytest.importorskip("numpy")
+
+from battery import BatteryModel  # noqa: E402
+
+
+def feed(model, drone_id, levels, flying, start=1000.0, step=10.0):
+    for i, level in enumerate(levels):
+        model.record(drone_id, level, flying, t=start + i * step)
+
+
+def test_unknown_drones_use_the_default_rate():
+    model = BatteryModel(reserve=20, flight_rate=0.5)
+    assert model.remaining_flight_s(1) is None
+    assert model.can_fly(1, 10_000)
+    assert model.remaining_flight_s(1, level=70) == pytest.approx(100)
+    assert not model.can_fly(1, 101, level=70)
+
+
+def test_flight_rate_is_learned_while_flying():
+    model = BatteryModel(reserve=20, flight_rate=0.5)
+    feed(model, 1, [90, 89, 88, 87, 86], flying=True)
+    assert model.flight_rate(1) == pytest.approx(0.1)
+    assert model.remaining_flight_s(1) == pytest.approx(660)
+    prediction = model.predict(1)
+    assert prediction["flying"] and prediction["samples"] == 5
+    assert prediction["rate_per_min"] == pytest.approx(-6.0)
+
+
+def test_ground_readings_do_not_set_the_flight_rate():
+    model = BatteryModel(flight_rate=0.5)
+    feed(model, 1, [90, 89.9, 89.8, 89.7], flying=False)
+    assert model.flight_rate(1) == 0.5
+
+
+def test_battery_swap_resets_the_fit():
+    model = BatteryModel(flight_rate=0.5)
+    feed(model, 1, [60, 59, 58], flying=False)
+    model.record(1, 100, False, t=1030)
+    assert model.predict(1)["samples"] == 1
+    assert model.predict(1)["rate_per_min"] is None
+
+
+def test_window_bounds_the_fit():
+    model = BatteryModel(window=4, flight_rate=0.5)
+    feed(model, 1, [90, 80, 70, 69, 68, 67], flying=True)
+    assert model.predict(1)["samples"] == 4
+    assert model._trends[1].rate == pytest.approx(-0.1)
+
+
+def test_poll_interval_follows_the_discharge():
+    model = BatteryModel(reserve=20, min_interval=5, max_interval=120, default_interval=30)
+    assert model.poll_interval(1) == 30
+    feed(model, 1, [90, 89, 88], flying=True)
+    # 0.1 %/s: two readings per percent
+    assert model.poll_interval(1) == pytest.approx(5)
+    feed(model, 2, [80, 80, 80], flying=False)
+    assert model.poll_interval(2) == 120
+    feed(model, 3, [28, 28, 28], flying=False)
+    assert model.poll_interval(3) == 10
@@ -0,0 +1,131 @@
+"""DronePool against simulated drones on loopback: text framings, binary protocol and auto fallback."""
+import socket
+import socketserver
+import threading
+
+import pytest
+
+from drone_pool import DronePool
+from sim_drone import SimulatedFleet
+
+HOST = "127.0.0.1"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def serve(handler):
+    server = socketserver.ThreadingTCPServer((HOST, free_port()), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def drone(request):
+    protocol = getattr(request, "param", "text")
+    fleet = SimulatedFleet(size=1, latency=0, port=free_port(), first_address=(127, 0, 0, 1),
+                           protocol=protocol, event_interval=60).start()
+    yield fleet
+    fleet.stop()
+
+
+def connects(pool, port):
+    return pool.stats()[f"{HOST}:{port}"]["connects"]
+
+
+def test_newline_framed_text_requests(drone):
+    pool = DronePool()
+    pool.set_framing(HOST, "newline", port=drone.port)
+    assert 0 < int(pool.request(HOST, "get_battery", port=drone.port)) <= 100
+    assert pool.request(HOST, "takeoff", port=drone.port) == "ok"
+    assert pool.request(HOST, "get_status", port=drone.port) == "in_air"
+    assert connects(pool, drone.port) == 1
+
+
+class _Unframed(socketserver.BaseRequestHandler):
+    """Firmware that answers each recv as one command, without delimiting requests or replies."""
+
+    def handle(self):
+        while True:
+            command = self.request.recv(4096)
+            if not command:
+                return
+            self.request.sendall(b"87" if command == b"get_battery" else b"ok")
+
+
+def test_raw_text_requests_read_one_recv_per_reply():
+    server = serve(_Unframed)
+    try:
+        port = server.server_address[1]
+        pool = DronePool()
+        assert pool.request(HOST, "get_battery", port=port) == "87"
+        assert pool.request(HOST, "land", port=port) == "ok"
+        assert connects(pool, port) == 1
+    finally:
+        stop(server)
+
+
+def test_unknown_framing_is_rejected(drone):
+    with pytest.raises(ValueError):
+        DronePool().set_framing(HOST, "crlf", port=drone.port)
+
+
+@pytest.mark.parametrize("drone", ["binary"], indirect=True)
+def test_binary_requests_are_pipelined_on_one_connection(drone):
+    pool = DronePool()
+    pool.set_protocol(HOST, "binary", port=drone.port)
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(pool.request(HOST, "get_battery", port=drone.port)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(replies) == 8 and all(0 < int(reply) <= 100 for reply in replies)
+    assert connects(pool, drone.port) == 1
+
+
+def test_auto_falls_back_to_text_when_the_hello_is_answered_as_text(drone):
+    pool = DronePool()
+    pool.set_protocol(HOST, "auto", port=drone.port)
+    pool.set_framing(HOST, "newline", port=drone.port)
+    assert pool.request(HOST, "get_status", port=drone.port) == "on_ground"
+    assert pool._state((HOST, drone.port)).protocol == "text"
+
+
+class _SilentOnUnknown(socketserver.BaseRequestHandler):
+    """Text firmware that answers get_battery and ignores any other line, the HELLO included."""
+
+    def handle(self):
+        buffer = b""
+        while True:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                if line == b"get_battery":
+                    self.request.sendall(b"55\n")
+
+
+def test_auto_falls_back_to_text_when_the_hello_times_out():
+    server = serve(_SilentOnUnknown)
+    try:
+        port = server.server_address[1]
+        pool = DronePool()
+        pool.set_protocol(HOST, "auto", port=port)
+        pool.set_framing(HOST, "newline", port=port)
+        assert pool.request(HOST, "get_battery", port=port, timeout=0.3) == "55"
+        assert pool._state((HOST, port)).protocol == "text"
+    finally:
+        stop(server)
@@ -0,0 +1,87 @@
+"""Frames and payloads of the binary drone protocol."""
+import struct
+
+import pytest
+
+import drone_protocol as protocol
+
+
+def test_frame_round_trip():
+    frame = protocol.pack_frame(protocol.REQUEST, 7, protocol.OPCODES["go_to"], b"payload")
+    kind, request_id, opcode, payload, consumed = protocol.read_frame(bytearray(frame + b"next"))
+    assert (kind, request_id, opcode, payload) == (protocol.REQUEST, 7, protocol.OPCODES["go_to"], b"payload")
+    assert consumed == len(frame)
+
+
+def test_incomplete_frames_wait_for_more_bytes():
+    frame = protocol.pack_frame(protocol.REPLY, 1, 1, b"abc")
+    assert protocol.read_frame(bytearray(frame[:1])) is None
+    assert protocol.read_frame(bytearray(frame[:protocol.HEADER.size])) is None
+    assert protocol.read_frame(bytearray(frame[:-1])) is None
+
+
+@pytest.mark.parametrize("data", [
+    b"ok\n",
+    b"93",
+    protocol.HEADER.pack(b"DP", protocol.VERSION + 1, protocol.REPLY, 1, 1, 0),
+    protocol.HEADER.pack(b"DP", protocol.VERSION, protocol.REPLY, 1, 1, protocol.MAX_PAYLOAD + 1),
+])
+def test_text_replies_and_bad_headers_are_protocol_errors(data):
+    with pytest.raises(protocol.ProtocolError):
+        protocol.read_frame(bytearray(data))
+
+
+def test_hello_is_a_frame_ending_in_a_newline():
+    hello = protocol.hello_frame()
+    assert hello.endswith(b"\n") and hello.count(b"\n") == 1
+    kind, _, version, _, _ = protocol.read_frame(bytearray(hello))
+    assert (kind, version) == (protocol.HELLO, protocol.VERSION)
+
+
+def test_encode_command():
+    assert protocol.encode_command("takeoff") == (protocol.OPCODES["takeoff"], b"")
+    opcode, payload = protocol.encode_command("go_to:100, -200.5, 1000")
+    assert opcode == protocol.OPCODES["go_to"]
+    assert protocol.VEC3.unpack(payload) == (100.0, -200.5, 1000.0)
+
+
+@pytest.mark.parametrize("message", ["fly_home", "go_to:1, 2", "go_to:a, b, c", "go_to"])
+def test_commands_the_protocol_cannot_encode(message):
+    with pytest.raises(protocol.InvalidCommand):
+        protocol.encode_command(message)
+
+
+def test_invalid_command_is_a_value_error():
+    assert issubclass(protocol.InvalidCommand, ValueError)
+
+
+@pytest.mark.parametrize("command, result, expected", [
+    ("get_battery", "87", "87"),
+    ("get_battery", "300", "255"),
+    ("get_position", "1.25,2,-3", "1.2,2.0,-3.0"),
+    ("get_status", "in_air", "in_air"),
+    ("takeoff", "", "ok"),
+])
+def test_replies_decode_to_the_text_protocol_answer(command, result, expected):
+    opcode = protocol.OPCODES[command]
+    assert protocol.decode_reply(opcode, protocol.encode_result(opcode, result)) == expected
+
+
+def test_error_replies():
+    assert protocol.decode_reply(protocol.OPCODES["takeoff"], protocol.encode_error("battery empty")) == \
+        "error: battery empty"
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode_reply(protocol.OPCODES["takeoff"], b"")
+
+
+@pytest.mark.parametrize("metric, value, expected", [
+    ("battery", 42, "42"),
+    ("position", (10, 20.5, 30), "10.0,20.5,30.0"),
+    ("status", "landed", "landed"),
+])
+def test_event_round_trip(metric, value, expected):
+    assert protocol.decode_event(*protocol.encode_event(metric, value)) == (metric, expected)
+
+
+def test_header_size():
+    assert protocol.HEADER.size == struct.calcsize("!2sBBIHI") == 14
@@ -0,0 +1,111 @@
+"""Circuit breaker transitions of the HealthMonitor (the probe thread is not started)."""
+import threading
+import time
+
+import pytest
+
+from health import CLOSED, HALF_OPEN, OPEN, HealthMonitor
+
+HOST = "10.0.0.5"
+OPEN_TIMEOUT = 0.05
+
+
+@pytest.fixture
+def changes():
+    return []
+
+
+@pytest.fixture
+def monitor(changes):
+    monitor = HealthMonitor(lambda host: True, lambda: [HOST], lambda *change: changes.append(change[1:3]),
+                            failure_threshold=3, open_timeout=OPEN_TIMEOUT, max_open_timeout=0.15,
+                            degraded_latency=0.5)
+    yield monitor
+    monitor.stop()
+
+
+def breaker(monitor):
+    return monitor.stats()[HOST]["breaker"]
+
+
+def open_breaker(monitor):
+    for _ in range(3):
+        monitor.record_failure(HOST, "timed out")
+
+
+def test_failures_degrade_then_open(monitor, changes):
+    assert monitor.allow(HOST)
+    monitor.record_failure(HOST, "timed out")
+    assert monitor.health(HOST) == "degraded" and breaker(monitor) == CLOSED
+    monitor.record_failure(HOST, "timed out")
+    monitor.record_failure(HOST, "timed out")
+    assert breaker(monitor) == OPEN and monitor.health(HOST) == "offline"
+    assert not monitor.allow(HOST)
+    assert monitor.stats()[HOST]["rejected"] == 1
+    assert changes == [("online", "degraded"), ("degraded", "offline")]
+
+
+def test_success_resets_the_failure_count(monitor):
+    monitor.record_failure(HOST)
+    monitor.record_failure(HOST)
+    monitor.record_success(HOST, 0.01)
+    monitor.record_failure(HOST)
+    monitor.record_failure(HOST)
+    assert breaker(monitor) == CLOSED
+
+
+def test_one_trial_after_the_timeout_and_success_closes(monitor, changes):
+    open_breaker(monitor)
+    time.sleep(OPEN_TIMEOUT * 1.5)
+    assert monitor.allow(HOST)
+    assert breaker(monitor) == HALF_OPEN
+    assert not monitor.allow(HOST)
+    monitor.record_success(HOST, 0.01)
+    assert breaker(monitor) == CLOSED and monitor.health(HOST) == "online"
+    assert changes[-1] == ("offline", "online")
+
+
+def test_failed_trial_reopens_with_a_longer_timeout(monitor):
+    open_breaker(monitor)
+    time.sleep(OPEN_TIMEOUT * 1.5)
+    assert monitor.allow(HOST)
+    monitor.record_failure(HOST, "timed out")
+    assert breaker(monitor) == OPEN
+    time.sleep(OPEN_TIMEOUT * 1.5)
+    assert not monitor.allow(HOST)
+    time.sleep(OPEN_TIMEOUT)
+    assert monitor.allow(HOST)
+
+
+def test_failed_probe_leaves_the_trial_to_a_real_request():
+    probed = threading.Event()
+
+    def probe(host):
+        probed.set()
+        return False
+
+    monitor = HealthMonitor(probe, lambda: [HOST], lambda *change: None, failure_threshold=3,
+                            open_timeout=OPEN_TIMEOUT, tick=0.01)
+    try:
+        open_breaker(monitor)
+        monitor.start()
+        assert probed.wait(1)
+        deadline = time.monotonic() + 1
+        while monitor.probes == 0 or monitor.stats()[HOST]["consecutive_failures"] < 4:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert breaker(monitor) == HALF_OPEN
+        assert monitor.allow(HOST)
+    finally:
+        monitor.stop()
+
+
+def test_slow_replies_degrade(monitor):
+    monitor.record_success(HOST, 2.0)
+    assert monitor.health(HOST) == "degraded"
+
+
+def test_heartbeat_closes_an_open_breaker(monitor):
+    open_breaker(monitor)
+    monitor.heartbeat(HOST)
+    assert breaker(monitor) == CLOSED and monitor.allow(HOST)
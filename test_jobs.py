@@ -0,0 +1,91 @@
+"""JobManager: one drone's regular jobs run in order, other drones and priority jobs do not wait."""
+import threading
+import time
+
+from jobs import JobManager
+
+
+def recorder(delay=0.0):
+    log = []
+    lock = threading.Lock()
+
+    def run(drone_id, command, args):
+        with lock:
+            log.append(("start", drone_id, command))
+        time.sleep(delay)
+        with lock:
+            log.append(("end", drone_id, command))
+        return {"command": command}, 200
+
+    return run, log
+
+
+def wait_all(jobs):
+    for job in jobs:
+        assert job.done.wait(5)
+
+
+def test_one_drone_runs_its_jobs_in_submission_order():
+    run, log = recorder(0.01)
+    manager = JobManager(run, workers=4)
+    commands = ["takeoff", "go_to", "go_to", "patrol", "land"]
+    jobs = [manager.submit(1, command) for command in commands]
+    wait_all(jobs)
+    assert log == [(edge, 1, command) for command in commands for edge in ("start", "end")]
+    assert [job.state for job in jobs] == ["succeeded"] * len(commands)
+
+
+def test_different_drones_run_in_parallel():
+    started = threading.Barrier(2, timeout=2)
+
+    def run(drone_id, command, args):
+        started.wait()
+        return {}, 200
+
+    manager = JobManager(run, workers=2)
+    wait_all([manager.submit(1, "takeoff"), manager.submit(2, "takeoff")])
+
+
+def test_priority_jobs_skip_the_drone_queue():
+    release = threading.Event()
+    order = []
+
+    def run(drone_id, command, args):
+        if command == "go_to":
+            release.wait(2)
+        order.append(command)
+        return {}, 200
+
+    manager = JobManager(run, workers=2)
+    slow = manager.submit(1, "go_to")
+    queued = manager.submit(1, "land")
+    emergency = manager.submit(1, "emergency", priority=True)
+    assert emergency.done.wait(2)
+    assert not queued.done.is_set()
+    release.set()
+    wait_all([slow, queued])
+    assert order == ["emergency", "go_to", "land"]
+
+
+def test_failures_and_exceptions_do_not_stall_the_queue():
+    def run(drone_id, command, args):
+        if command == "crash":
+            raise RuntimeError("boom")
+        return {}, 400 if command == "reject" else 200
+
+    manager = JobManager(run, workers=1)
+    jobs = [manager.submit(1, command) for command in ("crash", "reject", "land")]
+    wait_all(jobs)
+    assert [(job.state, job.status_code) for job in jobs] == [("failed", 500), ("failed", 400), ("succeeded", 200)]
+    assert jobs[0].result == {"error": "boom"}
+
+
+def test_finished_jobs_are_forgotten_beyond_max_jobs():
+    run, _ = recorder()
+    manager = JobManager(run, max_jobs=3)
+    first = manager.submit(1, "get")
+    wait_all([first])
+    later = [manager.submit(1, "get") for _ in range(3)]
+    wait_all(later)
+    assert manager.get(first.id) is None
+    assert all(manager.get(job.id) is job for job in later)
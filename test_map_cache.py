@@ -0,0 +1,83 @@
+"""FingerprintCache: recomputed only when the files it reads change, and never holding a failure."""
+import os
+
+import pytest
+
+import map_cache
+from map_cache import FileFingerprints, FingerprintCache
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "map.txt"
+    path.write_text("v1")
+    return path
+
+
+def counting(compute):
+    def wrapped():
+        wrapped.calls += 1
+        return compute()
+    wrapped.calls = 0
+    return wrapped
+
+
+def test_hit_until_the_file_changes(source):
+    compute = counting(lambda: source.read_text())
+    cache = FingerprintCache(compute, lambda: [str(source)])
+    assert cache.get() == "v1"
+    assert cache.get() == "v1"
+    assert (compute.calls, cache.hits, cache.misses) == (1, 1, 1)
+    source.write_text("v2!")
+    assert cache.get() == "v2!"
+    assert compute.calls == 2
+
+
+def test_content_is_rehashed_only_after_a_stat_change(source):
+    compute = counting(lambda: source.read_text())
+    cache = FingerprintCache(compute, lambda: [str(source)])
+    stat = os.stat(source)
+    assert cache.get() == "v1"
+    source.write_text("v2")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    # Same stat key: the cached hash is trusted, so the old value is kept
+    assert cache.get() == "v1"
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert cache.get() == "v2"
+
+
+def test_missing_and_created_files_change_the_key(tmp_path):
+    path = tmp_path / "calibration.npz"
+    cache = FingerprintCache(counting(lambda: path.exists()), lambda: [str(path)])
+    assert cache.get() is False
+    path.write_bytes(b"x")
+    assert cache.get() is True
+
+
+def test_failed_computations_are_not_cached(source):
+    results = iter([None, "ok"])
+    compute = counting(lambda: next(results))
+    cache = FingerprintCache(compute, lambda: [str(source)])
+    assert cache.get() is None
+    assert cache.get() == "ok"
+    assert cache.get() == "ok"
+    assert compute.calls == 2
+
+
+def test_refresh_recomputes(source):
+    compute = counting(lambda: compute.calls)
+    cache = FingerprintCache(compute, lambda: [str(source)])
+    assert cache.get() == 1
+    assert cache.refresh() == 2
+    assert cache.get() == 2
+
+
+def test_fingerprints_hash_only_after_a_stat_change(source, monkeypatch):
+    hashed = []
+    original = map_cache._sha256
+    monkeypatch.setattr(map_cache, "_sha256", lambda path: hashed.append(path) or original(path))
+    fingerprints = FileFingerprints()
+    first = fingerprints.get(str(source))
+    assert fingerprints.get(str(source)) == first
+    assert len(hashed) == 1
+    assert fingerprints.get(str(source) + ".missing")[1:] == (None, None, None)
@@ -0,0 +1,99 @@
+"""Fleet path planning on small occupancy grids."""
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from planner import OccupancyGrid, plan_fleet, plan_path, simplify  # noqa: E402
+
+
+def grid_of(rows):
+    """Grid from a picture: "#" is blocked, anything else free."""
+    free = np.array([[ch != "#" for ch in row] for row in rows])
+    return OccupancyGrid(free, np.where(free, np.inf, 0), cell_px=10, image_size=(10 * free.shape[1], 10 * free.shape[0]))
+
+
+def assert_valid(grid, path, start, goal):
+    assert path[0] == start and path[-1] == goal
+    for a, b in zip(path, path[1:]):
+        assert max(abs(a[0] - b[0]), abs(a[1] - b[1])) <= 1
+        assert grid.free[b]
+
+
+def test_from_image_blocks_dark_cells_and_their_surroundings():
+    gray = np.full((100, 100), 255, np.uint8)
+    gray[40:60, 40:60] = 0
+    grid = OccupancyGrid.from_image(gray, cell_px=10, robot_radius=1.0)
+    assert grid.free.shape == (10, 10)
+    assert not grid.free[5, 5] and not grid.free[3, 5]
+    assert grid.free[0, 0] and grid.free[9, 9]
+
+
+def test_path_goes_around_a_wall():
+    grid = grid_of([
+        ".....",
+        ".###.",
+        ".#...",
+        ".#.#.",
+        ".....",
+    ])
+    path = plan_path(grid, (2, 2), (0, 0))
+    assert_valid(grid, path, (2, 2), (0, 0))
+    assert all(grid.free[cell] for cell in path)
+
+
+def test_unreachable_goal():
+    grid = grid_of([
+        "..#..",
+        "..#..",
+        "..#..",
+    ])
+    assert plan_path(grid, (0, 0), (0, 4)) is None
+
+
+def test_nearest_free():
+    grid = grid_of([
+        "###",
+        "##.",
+    ])
+    assert grid.nearest_free((0, 0)) == (1, 2)
+    assert grid.nearest_free((1, 2)) == (1, 2)
+
+
+def test_fleet_paths_never_share_a_cell_or_swap():
+    grid = grid_of([
+        ".......",
+        ".......",
+        ".......",
+    ])
+    paths = plan_fleet(grid, [(1, (1, 0), (1, 6)), (2, (1, 6), (1, 0))])
+    first, second = paths[1], paths[2]
+    assert_valid(grid, first, (1, 0), (1, 6))
+    assert_valid(grid, second, (1, 6), (1, 0))
+    for t in range(max(len(first), len(second))):
+        a = first[min(t, len(first) - 1)]
+        b = second[min(t, len(second) - 1)]
+        assert a != b
+        if 0 < t < min(len(first), len(second)):
+            assert (first[t - 1], first[t]) != (second[t], second[t - 1])
+
+
+def test_simplify_keeps_turns_and_holds():
+    path = [(0, 0), (0, 1), (0, 2), (1, 3), (2, 4), (2, 4), (2, 4), (2, 5)]
+    assert simplify(path) == [(0, (0, 0)), (2, (0, 2)), (4, (2, 4)), (6, (2, 4)), (7, (2, 5))]
+
+
+def test_simplify_short_paths():
+    assert simplify([(0, 0)]) == [(0, (0, 0))]
+    assert simplify([(0, 0), (0, 1)]) == [(0, (0, 0)), (1, (0, 1))]
+
+
+def test_simplified_waypoints_rebuild_the_path():
+    grid = grid_of(["......", ".####.", "......"])
+    path = plan_path(grid, (0, 0), (2, 5))
+    waypoints = simplify(path)
+    rebuilt = [waypoints[0][1]]
+    for (t0, a), (t1, b) in zip(waypoints, waypoints[1:]):
+        for step in range(1, t1 - t0 + 1):
+            rebuilt.append((a[0] + (b[0] - a[0]) * step // (t1 - t0), a[1] + (b[1] - a[1]) * step // (t1 - t0)))
+    assert rebuilt == path
@@ -0,0 +1,56 @@
+"""Batched marker pose estimation against OpenCV's per-marker IPPE."""
+import pytest
+
+np = pytest.importorskip("numpy")
+cv = pytest.importorskip("cv2")
+
+from vision import estimate_marker_poses, marker_object_points, rotation_vectors  # noqa: E402
+
+CAMERA = np.array([[900.0, 0, 640], [0, 900, 360], [0, 0, 1]])
+DISTORTION = np.array([0.1, -0.05, 0, 0, 0])
+MARKER_MM = 50
+
+
+def markers(count, seed=0):
+    """Corners of random markers facing the camera, with pixel noise."""
+    rng = np.random.default_rng(seed)
+    facing = cv.Rodrigues(np.array([np.pi, 0, 0]))[0]
+    corners = []
+    for _ in range(count):
+        tilt = rng.normal(size=3)
+        tilt *= rng.uniform(0, 0.8) / np.linalg.norm(tilt)
+        rvec = cv.Rodrigues(cv.Rodrigues(tilt)[0] @ facing)[0]
+        tvec = np.array([rng.uniform(-200, 200), rng.uniform(-150, 150), rng.uniform(400, 1500)])
+        image, _ = cv.projectPoints(marker_object_points(MARKER_MM), rvec, tvec, CAMERA, DISTORTION)
+        corners.append(image.reshape(4, 2) + rng.normal(scale=0.3, size=(4, 2)))
+    return np.array(corners, dtype=np.float32)
+
+
+def test_matches_solvepnp_ippe_square():
+    corners = markers(50)
+    rvecs, tvecs, solved = estimate_marker_poses(corners, CAMERA, DISTORTION, MARKER_MM)
+    assert solved.all()
+    for i, marker in enumerate(corners):
+        ok, rvec, tvec = cv.solvePnP(marker_object_points(MARKER_MM), marker, CAMERA, DISTORTION,
+                                     flags=cv.SOLVEPNP_IPPE_SQUARE)
+        assert ok
+        np.testing.assert_allclose(tvecs[i], tvec.ravel(), atol=1e-6)
+        np.testing.assert_allclose(cv.Rodrigues(rvecs[i])[0], cv.Rodrigues(rvec)[0], atol=1e-6)
+
+
+def test_degenerate_markers_are_not_solved():
+    corners = np.concatenate([markers(1), np.full((1, 4, 2), 100, np.float32)])
+    rvecs, tvecs, solved = estimate_marker_poses(corners, CAMERA, DISTORTION, MARKER_MM)
+    assert solved.tolist() == [True, False]
+    assert not tvecs[1].any() and not rvecs[1].any()
+
+
+def test_no_markers():
+    rvecs, tvecs, solved = estimate_marker_poses(np.empty((0, 4, 2), np.float32), CAMERA, DISTORTION, MARKER_MM)
+    assert rvecs.shape == tvecs.shape == (0, 3) and solved.shape == (0,)
+
+
+@pytest.mark.parametrize("rvec", [[0, 0, 0], [0.3, -0.2, 0.1], [np.pi, 0, 0], [0, np.pi - 1e-7, 0], [1, 2, 2]])
+def test_rotation_vectors_invert_rodrigues(rvec):
+    rotation = cv.Rodrigues(np.array(rvec, dtype=np.float64))[0]
+    np.testing.assert_allclose(cv.Rodrigues(rotation_vectors(rotation[None])[0])[0], rotation, atol=1e-8)
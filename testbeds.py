@@ -0,0 +1,143 @@
+"""Testbeds hosted by the server: their map files, the drones flying in them and their loaded contexts."""
+import json
+import threading
+from collections import OrderedDict
+
+DEFAULT_TESTBED = "default"
+
+
+class Testbed:
+    """Map files of one testbed: the grid map (planning and display), the reference map with the
+    Aruco markers and the camera calibration."""
+
+    def __init__(self, id, name, grid_map, reference_map, calibration):
+        self.id = id
+        self.name = name
+        self.grid_map = grid_map
+        self.reference_map = reference_map
+        self.calibration = calibration
+
+    def paths(self):
+        return self.grid_map, self.reference_map, self.calibration
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "grid_map": self.grid_map,
+            "reference_map": self.reference_map,
+            "calibration": self.calibration,
+        }
+
+
+class TestbedContext:
+    """What a testbed needs in memory once used: map geometry, planning grid and camera localizer.
+
+    geometry and grid are FingerprintCaches, so they are computed on first
+    use and again only when the files change.
+    """
+
+    def __init__(self, testbed, geometry, grid):
+        self.testbed = testbed
+        self.geometry = geometry
+        self.grid = grid
+        self.lock = threading.Lock()
+        self.localizer = None
+        self.localizer_geometry = None
+
+    def close(self):
+        with self.lock:
+            if self.localizer is not None:
+                self.localizer.close()
+            self.localizer = None
+            self.localizer_geometry = None
+
+
+class TestbedRegistry:
+    """Testbed configurations and an LRU of the contexts loaded from them.
+
+    build_context(testbed) runs the first time a testbed is used; at most
+    max_loaded contexts stay loaded, the least recently used one being closed
+    and dropped (with its geometry, grid and localizer) to make room, so
+    memory does not grow with the number of testbeds. Drones fly in the
+    default testbed unless assigned to another one.
+    """
+
+    def __init__(self, testbeds, build_context, default=DEFAULT_TESTBED, max_loaded=2):
+        self.build_context = build_context
+        self.default = default
+        self.max_loaded = max_loaded
+        self._testbeds = {testbed.id: testbed for testbed in testbeds}
+        self._lock = threading.Lock()
+        self._contexts = OrderedDict()
+        self._assignments = {}
+        self.loads = 0
+        self.evictions = 0
+
+    @classmethod
+    def load(cls, path, default, build_context, max_loaded=2):
+        """Registry with the default testbed plus the ones of a JSON file with a "testbeds" list.
+
+        Files a testbed does not set are the default testbed's.
+        """
+        testbeds = {default.id: default}
+        with open(path) as f:
+            config = json.load(f)
+        for entry in config["testbeds"]:
+            fields = dict(default.to_dict(), name=f"Testbed {entry['id']}")
+            fields.update(entry)
+            testbeds[fields["id"]] = Testbed(**fields)
+        return cls(testbeds.values(), build_context, default=default.id, max_loaded=max_loaded)
+
+    def get(self, testbed_id):
+        return self._testbeds.get(testbed_id)
+
+    def all(self):
+        return list(self._testbeds.values())
+
+    def context(self, testbed_id):
+        """Loaded context of a testbed, built on first use; None for an unknown testbed."""
+        testbed = self._testbeds.get(testbed_id)
+        if testbed is None:
+            return None
+        evicted = []
+        with self._lock:
+            context = self._contexts.get(testbed_id)
+            if context is not None:
+                self._contexts.move_to_end(testbed_id)
+                return context
+            context = self._contexts[testbed_id] = self.build_context(testbed)
+            self.loads += 1
+            while len(self._contexts) > self.max_loaded:
+                evicted.append(self._contexts.popitem(last=False)[1])
+                self.evictions += 1
+        for old in evicted:
+            old.close()
+        return context
+
+    def loaded(self):
+        with self._lock:
+            return list(self._contexts.values())
+
+    def assign(self, drone_id, testbed_id):
+        if testbed_id not in self._testbeds:
+            raise KeyError(testbed_id)
+        with self._lock:
+            self._assignments[drone_id] = testbed_id
+
+    def testbed_of(self, drone_id):
+        return self._assignments.get(drone_id, self.default)
+
+    def drones_of(self, testbed_id, drone_ids):
+        return [drone_id for drone_id in drone_ids if self.testbed_of(drone_id) == testbed_id]
+
+    def stats(self):
+        with self._lock:
+            loaded = list(self._contexts)
+        return {
+            "testbeds": sorted(self._testbeds),
+            "loaded": loaded,
+            "max_loaded": self.max_loaded,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,139 @@
+"""High-rate drone pose ingestion over UDP into fixed-size per-drone ring buffers."""
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+TRACK_COLUMNS = ("t", "x", "y", "z", "roll", "pitch", "yaw")
+
+# x, y, z, roll, pitch, yaw as little-endian float32; the sender is identified by its IP
+POSE_PACKET = struct.Struct("<6f")
+# Same pose prefixed with the drone id, for senders whose IP is not in the fleet
+POSE_PACKET_WITH_ID = struct.Struct("<I6f")
+
+
+class TrackBuffer:
+    """Fixed-size ring of timestamped poses for one drone, stored in one NumPy array."""
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, len(TRACK_COLUMNS)), dtype=np.float64)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, t, pose):
+        with self.lock:
+            row = self.data[self.count % self.capacity]
+            row[0] = t
+            row[1:] = pose
+            self.count += 1
+
+    def latest(self):
+        with self.lock:
+            if self.count == 0:
+                return None
+            return self.data[(self.count - 1) % self.capacity].copy()
+
+    def since(self, t=None, max_points=None):
+        """Samples newer than t in time order as a list of rows, thinned to max_points."""
+        with self.lock:
+            segments = self._segments()
+            if t is not None:
+                segments = [seg[np.searchsorted(seg[:, 0], t, side='right'):] for seg in segments]
+            total = sum(len(seg) for seg in segments)
+            step = 1
+            if max_points and total > max_points:
+                step = -(-total // max_points)
+            rows = []
+            offset = 0
+            for seg in segments:
+                # Keep the stride continuous across the wrap-around point
+                rows.extend(seg[(-offset) % step::step].tolist())
+                offset += len(seg)
+            return rows
+
+    def _segments(self):
+        """Views of the filled part of the ring, oldest first, without copying."""
+        if self.count <= self.capacity:
+            return [self.data[:self.count]]
+        head = self.count % self.capacity
+        return [self.data[head:], self.data[:head]]
+
+
+class PoseListener:
+    """Receives pose packets on a UDP port and republishes the latest pose at a lower rate.
+
+    on_pose(drone, row) is called at most publish_hz times per second per drone,
+    with the newest sample received since the previous call.
+    """
+
+    def __init__(self, fleet, on_pose, host='0.0.0.0', port=12307, capacity=4096, publish_hz=5):
+        self.fleet = fleet
+        self.on_pose = on_pose
+        self.host = host
+        self.port = port
+        self.capacity = capacity
+        self.publish_hz = publish_hz
+        self.buffers = {}
+        self._published = {}
+        self._lock = threading.Lock()
+        self._sock = None
+        self.packets = 0
+        self.dropped = 0
+
+    def buffer(self, drone_id):
+        buf = self.buffers.get(drone_id)
+        if buf is None:
+            with self._lock:
+                buf = self.buffers.setdefault(drone_id, TrackBuffer(self.capacity))
+        return buf
+
+    def start(self):
+        if self._sock is not None:
+            return
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        threading.Thread(target=self._receive, name="pose-listener", daemon=True).start()
+        threading.Thread(target=self._publish, name="pose-publisher", daemon=True).start()
+
+    def ingest(self, data, ip, t=None):
+        """Stores one packet; returns False if it is malformed or from an unknown drone."""
+        if len(data) == POSE_PACKET.size:
+            drone = self.fleet.get_by_ip(ip)
+            pose = POSE_PACKET.unpack(data)
+        elif len(data) == POSE_PACKET_WITH_ID.size:
+            drone_id, *pose = POSE_PACKET_WITH_ID.unpack(data)
+            drone = self.fleet.get(drone_id)
+        else:
+            drone = None
+        if drone is None:
+            self.dropped += 1
+            return False
+        self.buffer(drone.id).append(time.time() if t is None else t, pose)
+        self.packets += 1
+        return True
+
+    def _receive(self):
+        while True:
+            try:
+                data, (ip, _) = self._sock.recvfrom(64)
+                self.ingest(data, ip)
+            except Exception as e:
+                print(f"Error recibiendo telemetría de posición: {e}")
+
+    def _publish(self):
+        while True:
+            time.sleep(1.0 / self.publish_hz)
+            for drone_id, buf in list(self.buffers.items()):
+                if buf.count == self._published.get(drone_id):
+                    continue
+                self._published[drone_id] = buf.count
+                drone = self.fleet.get(drone_id)
+                if drone is not None:
+                    try:
+                        self.on_pose(drone, buf.latest())
+                    except Exception as e:
+                        print(f"Error publicando la posición del dron {drone_id}: {e}")
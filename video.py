@@ -0,0 +1,170 @@
+"""Server-side ingest of drone video streams and fan-out to many viewers."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+
+
+class FrameRing:
+    """Last few encoded frames of a stream, shared by every viewer.
+
+    Frames are immutable bytes handed to all viewers as-is. A viewer that keeps
+    up reads them in order; one that falls more than the ring size behind jumps
+    to the newest frame, so a slow client only loses its own frames.
+    """
+
+    def __init__(self, size=8):
+        self.size = size
+        self.frames = [None] * size
+        self.seq = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, frame):
+        with self.cond:
+            self.seq += 1
+            self.frames[self.seq % self.size] = frame
+            self.cond.notify_all()
+
+    def latest(self):
+        with self.cond:
+            return self.seq, self.frames[self.seq % self.size]
+
+    def next(self, last_seq, timeout=5.0):
+        """(seq, frame) after last_seq, waiting up to timeout; None on timeout or close."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > last_seq or self.closed, timeout):
+                return None
+            if self.closed and self.seq <= last_seq:
+                return None
+            seq = last_seq + 1 if self.seq - last_seq < self.size else self.seq
+            return seq, self.frames[seq % self.size]
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class DroneStream:
+    """Reads one drone's stream and publishes JPEG frames into a FrameRing.
+
+    Each stream has a reader thread (OpenCV decodes in native code without the
+    GIL) and encodes on the relay's shared pool. While a frame of this drone is
+    still being encoded, newer decoded frames are dropped instead of queued.
+    """
+
+    def __init__(self, drone_id, url, executor, ring_size=8, max_width=960, quality=80, on_frame=None):
+        self.drone_id = drone_id
+        self.url = url
+        self.executor = executor
+        self.max_width = max_width
+        self.quality = quality
+        self.on_frame = on_frame
+        self.ring = FrameRing(ring_size)
+        self.decoded = 0
+        self.encoded = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self._pending = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"video-{drone_id}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.ring.close()
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "decoded": self.decoded,
+            "encoded": self.encoded,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "sequence": self.ring.seq,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            capture = cv.VideoCapture(self.url, cv.CAP_FFMPEG)
+            while not self._stop.is_set() and capture.isOpened():
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                self.decoded += 1
+                if self.on_frame is not None:
+                    self.on_frame(self.drone_id, frame)
+                if self._pending is not None and not self._pending.done():
+                    self.dropped += 1
+                    continue
+                self._pending = self.executor.submit(self._encode, frame)
+            capture.release()
+            if not self._stop.is_set():
+                self.reconnects += 1
+                self._stop.wait(1.0)
+
+    def _encode(self, frame):
+        height, width = frame.shape[:2]
+        if width > self.max_width:
+            frame = cv.resize(frame, (self.max_width, round(height * self.max_width / width)),
+                              interpolation=cv.INTER_AREA)
+        ok, jpeg = cv.imencode('.jpg', frame, [cv.IMWRITE_JPEG_QUALITY, self.quality])
+        if ok:
+            self.ring.put(jpeg.tobytes())
+            self.encoded += 1
+
+
+class VideoRelay:
+    """Runs one DroneStream per streaming drone on a shared encoding pool."""
+
+    def __init__(self, url_for, workers=4, ring_size=8, max_width=960, quality=80, on_frame=None):
+        self.url_for = url_for
+        self.ring_size = ring_size
+        self.max_width = max_width
+        self.quality = quality
+        self.on_frame = on_frame
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="video-encode")
+        self._lock = threading.Lock()
+        self._streams = {}
+
+    def start(self, drone_id):
+        with self._lock:
+            stream = self._streams.get(drone_id)
+            if stream is None:
+                stream = DroneStream(drone_id, self.url_for(drone_id), self._executor, self.ring_size,
+                                     self.max_width, self.quality, self.on_frame)
+                self._streams[drone_id] = stream
+                stream.start()
+            return stream
+
+    def stop(self, drone_id):
+        with self._lock:
+            stream = self._streams.pop(drone_id, None)
+        if stream is not None:
+            stream.stop()
+
+    def get(self, drone_id):
+        return self._streams.get(drone_id)
+
+    def stats(self):
+        with self._lock:
+            return {drone_id: stream.stats() for drone_id, stream in self._streams.items()}
+
+
+def mjpeg_frames(ring, boundary=b"frame", timeout=5.0):
+    """multipart/x-mixed-replace body that yields the ring's frames without copying them."""
+    seq = max(ring.seq - 1, 0)
+    while True:
+        item = ring.next(seq, timeout)
+        if item is None:
+            if ring.closed:
+                return
+            continue
+        seq, frame = item
+        yield (b"--" + boundary + b"\r\nContent-Type: image/jpeg\r\nContent-Length: "
+               + str(len(frame)).encode() + b"\r\n\r\n")
+        yield frame
+        yield b"\r\n"
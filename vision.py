@@ -0,0 +1,357 @@
+"""Estimación de poses de marcadores Aruco y ajuste de la rejilla del mapa."""
+from functools import lru_cache
+
+import cv2 as cv
+import numpy as np
+
+
+@lru_cache(maxsize=16)
+def marker_object_points(marker_size):
+    """Esquinas 3D de un marcador cuadrado centrado en el origen, en el orden de Aruco (compartidas, solo lectura)"""
+    half = marker_size / 2
+    points = np.array([
+        [-half, half, 0],
+        [half, half, 0],
+        [half, -half, 0],
+        [-half, -half, 0]
+    ], dtype=np.float32)
+    points.setflags(write=False)
+    return points
+
+
+def stack_corners(corners):
+    """Convierte las esquinas devueltas por detectMarkers en un array (N, 4, 2)"""
+    return np.asarray(corners, dtype=np.float32).reshape(-1, 4, 2)
+
+
+# Banderas de imread que decodifican la JPEG ya reducida (el decodificador escala los bloques DCT)
+REDUCED_GRAYSCALE = {
+    1: cv.IMREAD_GRAYSCALE,
+    2: cv.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def read_gray(path, reduction=1):
+    """Imagen en grises decodificada directamente a 1/reduction del tamaño (1, 2, 4 u 8)"""
+    gray = cv.imread(path, REDUCED_GRAYSCALE[reduction])
+    if gray is None:
+        raise ValueError(f"No se pudo cargar la imagen del mapa: {path}")
+    return gray
+
+
+def refine_corners(gray, corners, window=5, iterations=30, epsilon=0.01):
+    """Refina las esquinas (N, 4, 2) con cornerSubPix, cada marcador solo en una ROI a su alrededor.
+
+    La ventana se limita a un cuarto del lado del marcador para no saltar a
+    las esquinas de la cuadrícula interior del código.
+    """
+    refined = stack_corners(corners).copy()
+    criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_COUNT, iterations, epsilon)
+    height, width = gray.shape[:2]
+    for marker in refined:
+        side = np.linalg.norm(marker - np.roll(marker, 1, axis=0), axis=1).min()
+        half = int(max(2, min(window, side / 4)))
+        x0, y0 = np.maximum(np.floor(marker.min(axis=0)).astype(int) - 2 * half - 1, 0)
+        x1, y1 = np.minimum(np.ceil(marker.max(axis=0)).astype(int) + 2 * half + 2, (width, height))
+        local = (marker - (x0, y0)).astype(np.float32).reshape(-1, 1, 2)
+        cv.cornerSubPix(gray[y0:y1, x0:x1], local, (half, half), (-1, -1), criteria)
+        marker[:] = local.reshape(4, 2) + (x0, y0)
+    return refined
+
+
+def detect_markers_pyramid(path, detector, reduction=2, window=None):
+    """Detección de marcadores en dos niveles para mapas de alta resolución.
+
+    Detecta sobre la imagen decodificada a 1/reduction del tamaño y, solo si
+    encuentra marcadores, decodifica la imagen completa en grises y refina las
+    esquinas con cornerSubPix en una ROI alrededor de cada uno. Devuelve las
+    esquinas (N, 4, 2) a resolución completa, los ids (N,) y el tamaño
+    (ancho, alto) de la imagen completa, o None si no hay marcadores.
+    """
+    small = read_gray(path, reduction)
+    corners, ids, _ = detector.detectMarkers(small)
+    if ids is None or len(ids) == 0:
+        return None
+    gray = read_gray(path)
+    height, width = gray.shape[:2]
+    factor = np.array([width / small.shape[1], height / small.shape[0]], dtype=np.float32)
+    # Centro del píxel reducido -> centro del bloque de píxeles completos que cubre
+    corners = (stack_corners(corners) + 0.5) * factor - 0.5
+    corners = refine_corners(gray, corners, window or reduction + 1)
+    return corners, np.asarray(ids).ravel(), (width, height)
+
+
+def estimate_marker_poses(corners, camera_matrix, dist_coeffs, marker_size):
+    """Estima la pose de todos los marcadores de una vez.
+
+    Las esquinas se corrigen de distorsión en una sola llamada y las poses se
+    resuelven con IPPE sobre puntos normalizados, vectorizado para todos los
+    marcadores: homografía cerrada del cuadrado, las dos rotaciones candidatas
+    y la traslación de cada una, quedándose con la de menor error de
+    reproyección. Devuelve rvecs y tvecs como arrays (N, 3) y una máscara con
+    los marcadores resueltos.
+    """
+    corners = stack_corners(corners)
+    n = len(corners)
+    rvecs = np.zeros((n, 3), dtype=np.float64)
+    tvecs = np.zeros((n, 3), dtype=np.float64)
+    ok = np.zeros(n, dtype=bool)
+    if n == 0:
+        return rvecs, tvecs, ok
+
+    normalized = cv.undistortPoints(corners.reshape(-1, 1, 2), camera_matrix, dist_coeffs)
+    normalized = normalized.reshape(n, 4, 2).astype(np.float64)
+    object_points = marker_object_points(marker_size).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        homographies = _marker_homographies(normalized, marker_size)
+        # Cuadriláteros degenerados (esquinas alineadas o repetidas) no tienen homografía
+        solvable = np.isfinite(homographies).all(axis=(1, 2)) & (np.abs(np.linalg.det(homographies)) > 1e-12)
+    normalized, homographies = normalized[solvable], homographies[solvable]
+    best_error = np.full(len(homographies), np.inf)
+    best_rvecs = np.zeros((len(homographies), 3))
+    best_tvecs = np.zeros((len(homographies), 3))
+    for rotations in _ippe_rotations(homographies):
+        translations, error = _fit_translations(rotations, object_points, normalized)
+        better = error < best_error
+        best_error[better] = error[better]
+        best_rvecs[better] = rotation_vectors(rotations[better])
+        best_tvecs[better] = translations[better]
+    solved = np.isfinite(best_error) & (best_tvecs[:, 2] > 0)
+    ok[np.flatnonzero(solvable)[solved]] = True
+    rvecs[ok], tvecs[ok] = best_rvecs[solved], best_tvecs[solved]
+    return rvecs, tvecs, ok
+
+
+def _marker_homographies(normalized, marker_size):
+    """Homografías (N, 3, 3) del plano del marcador (mm) a sus esquinas normalizadas (N, 4, 2).
+
+    Forma cerrada cuadrado unidad -> cuadrilátero (Heckbert), sin una SVD por
+    marcador; las esquinas 0..3 son las (0,0), (1,0), (1,1), (0,1) del cuadrado.
+    """
+    x, y = normalized[..., 0].T, normalized[..., 1].T
+    sx, sy = x[0] - x[1] + x[2] - x[3], y[0] - y[1] + y[2] - y[3]
+    dx1, dx2, dy1, dy2 = x[1] - x[2], x[3] - x[2], y[1] - y[2], y[3] - y[2]
+    den = dx1 * dy2 - dx2 * dy1
+    g = (sx * dy2 - dx2 * sy) / den
+    h = (dx1 * sy - sx * dy1) / den
+    square = np.stack([
+        np.stack([x[1] - x[0] + g * x[1], x[3] - x[0] + h * x[3], x[0]], axis=1),
+        np.stack([y[1] - y[0] + g * y[1], y[3] - y[0] + h * y[3], y[0]], axis=1),
+        np.stack([g, h, np.ones_like(g)], axis=1),
+    ], axis=1)
+    # Plano del marcador en mm -> cuadrado unidad: esquina 0 en (-l/2, l/2), esquina 1 en (l/2, l/2)
+    half = marker_size / 2
+    to_square = np.array([[0.5 / half, 0, 0.5], [0, -0.5 / half, 0.5], [0, 0, 1]])
+    homographies = square @ to_square
+    return homographies / homographies[:, 2:, 2:]
+
+
+def _ippe_rotations(homographies):
+    """Las dos rotaciones (N, 3, 3) que IPPE deduce del jacobiano de la homografía en el centro del marcador"""
+    p, q = homographies[:, 0, 2], homographies[:, 1, 2]
+    center = np.stack([p, q], axis=1)
+    jacobian = homographies[:, :2, :2] - center[:, :, None] * homographies[:, 2, None, :2]
+
+    # Rotación que lleva el eje z a la dirección del centro del marcador
+    s = np.sqrt(p * p + q * q + 1)
+    t = np.sqrt(p * p + q * q)
+    cos, sin = 1 / s, t / s
+    k0 = np.where(t > 0, p / np.where(t > 0, t, 1), 0)
+    k1 = np.where(t > 0, q / np.where(t > 0, t, 1), 0)
+    to_center = np.stack([
+        np.stack([(cos - 1) * k0 * k0 + 1, k0 * k1 * (cos - 1), k0 * sin], axis=1),
+        np.stack([k0 * k1 * (cos - 1), (cos - 1) * k1 * k1 + 1, k1 * sin], axis=1),
+        np.stack([-k0 * sin, -k1 * sin, (cos - 1) * (k0 * k0 + k1 * k1) + 1], axis=1),
+    ], axis=1)
+
+    b = to_center[:, :2, :2] - center[:, :, None] * to_center[:, 2, None, :2]
+    a = np.linalg.solve(b, jacobian)
+    # Mayor valor singular de cada A 2x2, en forma cerrada
+    ata = a.transpose(0, 2, 1) @ a
+    trace, gap = ata[:, 0, 0] + ata[:, 1, 1], ata[:, 0, 0] - ata[:, 1, 1]
+    gamma = np.sqrt(0.5 * (trace + np.sqrt(gap * gap + 4 * ata[:, 0, 1] ** 2)))
+    r = a / gamma[:, None, None]
+    b0 = np.sqrt(np.clip(1 - r[:, 0, 0] ** 2 - r[:, 1, 0] ** 2, 0, None))
+    b1 = np.sqrt(np.clip(1 - r[:, 0, 1] ** 2 - r[:, 1, 1] ** 2, 0, None))
+    b1 = np.where(r[:, 0, 0] * r[:, 0, 1] + r[:, 1, 0] * r[:, 1, 1] > 0, -b1, b1)
+    rotations = []
+    for sign in (1, -1):
+        first = np.stack([r[:, 0, 0], r[:, 1, 0], sign * b0], axis=1)
+        second = np.stack([r[:, 0, 1], r[:, 1, 1], sign * b1], axis=1)
+        rotations.append(to_center @ np.stack([first, second, np.cross(first, second)], axis=2))
+    return rotations
+
+
+def _fit_translations(rotations, object_points, normalized):
+    """Traslación por mínimos cuadrados para cada rotación y su error de reproyección (puntos normalizados)"""
+    rotated = object_points @ rotations.transpose(0, 2, 1)
+    x, y = normalized[..., 0], normalized[..., 1]
+    ones, zeros = np.ones_like(x), np.zeros_like(x)
+    design = np.concatenate([np.stack([ones, zeros, -x], axis=2), np.stack([zeros, ones, -y], axis=2)], axis=1)
+    target = np.concatenate([x * rotated[..., 2] - rotated[..., 0], y * rotated[..., 2] - rotated[..., 1]], axis=1)
+    normal = design.transpose(0, 2, 1)
+    translations = np.linalg.solve(normal @ design, (normal @ target[..., None]))[..., 0]
+    camera = rotated + translations[:, None, :]
+    projected = camera[..., :2] / camera[..., 2:]
+    error = np.sum((projected - normalized) ** 2, axis=(1, 2))
+    return translations, np.where(np.isfinite(error), error, np.inf)
+
+
+def rotation_vectors(rotations):
+    """Rodrigues inverso por lotes: matrices de rotación (N, 3, 3) -> vectores de rotación (N, 3)"""
+    cos = np.clip((np.trace(rotations, axis1=1, axis2=2) - 1) / 2, -1, 1)
+    angle = np.arccos(cos)
+    # Parte antisimétrica: 2·sen(θ)·eje
+    skew = np.stack([rotations[:, 2, 1] - rotations[:, 1, 2],
+                     rotations[:, 0, 2] - rotations[:, 2, 0],
+                     rotations[:, 1, 0] - rotations[:, 0, 1]], axis=1)
+    sin = np.sin(angle)
+    small = sin < 1e-6
+    factor = np.where(small, 0.5, angle / np.where(small, 1, 2 * sin))
+    rvecs = skew * factor[:, None]
+
+    # Cerca de π la parte antisimétrica se anula: el eje sale de (R + I) / 2 = eje·ejeᵀ
+    flipped = small & (cos < 0)
+    if flipped.any():
+        outer = (rotations[flipped] + np.eye(3)) / 2
+        column = np.argmax(np.diagonal(outer, axis1=1, axis2=2), axis=1)
+        axis = outer[np.arange(len(column)), :, column]
+        axis /= np.linalg.norm(axis, axis=1)[:, None]
+        axis *= np.where(np.sum(axis * skew[flipped], axis=1) < 0, -1, 1)[:, None]
+        rvecs[flipped] = axis * angle[flipped][:, None]
+    return rvecs
+
+
+def relative_positions(rvecs, tvecs, ref_idx):
+    """Posiciones de todos los marcadores en el sistema del marcador de referencia"""
+    R_ref, _ = cv.Rodrigues(rvecs[ref_idx])
+    # (R_ref^T · (t_i - t_ref))^T para todos los marcadores con un único producto
+    return (tvecs - tvecs[ref_idx]) @ R_ref
+
+
+def fit_marker_grid(world_xy, pixels):
+    """Ajusta por mínimos cuadrados la transformación mundo (mm) -> imagen (px) con todos los marcadores.
+
+    Devuelve la homografía 3x3, la escala px/mm en X e Y (afín ajustada) y el
+    error cuadrático medio en píxeles, o None si hay menos de 4 marcadores.
+    """
+    world_xy = np.asarray(world_xy, dtype=np.float64)
+    pixels = np.asarray(pixels, dtype=np.float64)
+    if len(world_xy) < 4:
+        return None
+
+    homography, _ = cv.findHomography(world_xy, pixels, 0)
+    if homography is None:
+        return None
+
+    design = np.column_stack([world_xy, np.ones(len(world_xy))])
+    affine, _, _, _ = np.linalg.lstsq(design, pixels, rcond=None)
+    scale = np.linalg.norm(affine[:2], axis=1)
+
+    projected = cv.perspectiveTransform(world_xy.reshape(-1, 1, 2), homography).reshape(-1, 2)
+    rms = float(np.sqrt(np.mean(np.sum((projected - pixels) ** 2, axis=1))))
+    return {
+        "homography": homography,
+        "scale_x": float(scale[0]),
+        "scale_y": float(scale[1]),
+        "rms_px": rms,
+        "markers": len(world_xy),
+    }
+
+
+class MapTransform:
+    """Conversión entre píxeles del mapa de referencia y coordenadas del mundo en mm.
+
+    El mundo es el plano del marcador 0. La homografía se ajusta sobre los
+    centros de los marcadores sin distorsión, y el mapa de initUndistortRectifyMap
+    se calcula una vez para volver a píxeles distorsionados con una consulta.
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, image_size, world_xy, pixels, undistort_maps=None):
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64)
+        self.image_size = image_size  # (ancho, alto)
+        undistorted = self._undistort(pixels)
+        self.homography, _ = cv.findHomography(np.asarray(world_xy, dtype=np.float64), undistorted, 0)
+        if self.homography is None:
+            raise ValueError("No se pudo ajustar la homografía del mapa")
+        self.homography_inv = np.linalg.inv(self.homography)
+        if undistort_maps is None:
+            undistort_maps = cv.initUndistortRectifyMap(
+                self.camera_matrix, self.dist_coeffs, None, self.camera_matrix, image_size, cv.CV_32FC1)
+        self.map_x, self.map_y = undistort_maps
+
+    def pixel_to_world(self, points):
+        """Píxeles (N, 2) de la imagen original -> mm (N, 2) en el sistema del marcador 0"""
+        undistorted = self._undistort(points)
+        return cv.perspectiveTransform(undistorted.reshape(-1, 1, 2), self.homography_inv).reshape(-1, 2)
+
+    def world_to_pixel(self, points):
+        """mm (N, 2) en el sistema del marcador 0 -> píxeles (N, 2) de la imagen original"""
+        world = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        undistorted = cv.perspectiveTransform(world, self.homography).reshape(-1, 2)
+        return self._distort(undistorted)
+
+    def to_dict(self):
+        return {
+            "world_to_pixel": self.homography.tolist(),
+            "pixel_to_world": self.homography_inv.tolist(),
+            "image_size": list(self.image_size),
+            "units": "mm",
+            "origin_marker": 0,
+        }
+
+    def _undistort(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        return cv.undistortPoints(points, self.camera_matrix, self.dist_coeffs,
+                                  P=self.camera_matrix).reshape(-1, 2)
+
+    def _distort(self, undistorted):
+        """Píxeles sin distorsión -> con distorsión, usando el mapa precalculado dentro de la imagen"""
+        width, height = self.image_size
+        result = np.empty_like(undistorted)
+        inside = ((undistorted[:, 0] >= 0) & (undistorted[:, 0] <= width - 1)
+                  & (undistorted[:, 1] >= 0) & (undistorted[:, 1] <= height - 1))
+        if inside.any():
+            lookup = undistorted[inside].astype(np.float32).reshape(1, -1, 2)
+            result[inside, 0] = cv.remap(self.map_x, lookup, None, cv.INTER_LINEAR).ravel()
+            result[inside, 1] = cv.remap(self.map_y, lookup, None, cv.INTER_LINEAR).ravel()
+        if not inside.all():
+            # Fuera de la imagen el mapa no existe: proyectar con el modelo de distorsión
+            outside = undistorted[~inside]
+            normalized = np.column_stack([
+                (outside - self.camera_matrix[:2, 2]) / np.diag(self.camera_matrix)[:2],
+                np.ones(len(outside))
+            ])
+            projected, _ = cv.projectPoints(normalized, np.zeros(3), np.zeros(3),
+                                            self.camera_matrix, self.dist_coeffs)
+            result[~inside] = projected.reshape(-1, 2)
+        return result
+
+
+def marker_world_corners(rvecs, tvecs, ref_idx, marker_size):
+    """Esquinas 3D (N, 4, 3) de cada marcador en mm en el sistema del marcador de referencia"""
+    R_ref, _ = cv.Rodrigues(rvecs[ref_idx])
+    object_points = marker_object_points(marker_size).astype(np.float64)
+    corners = np.empty((len(rvecs), 4, 3), dtype=np.float64)
+    for i, rvec in enumerate(rvecs):
+        R_i, _ = cv.Rodrigues(rvec)
+        corners[i] = object_points @ R_i.T + tvecs[i]
+    # Mismo cambio de sistema que relative_positions, aplicado a todas las esquinas a la vez
+    return (corners - tvecs[ref_idx]) @ R_ref * 10
+
+
+def rotation_to_euler(R):
+    """Ángulos roll, pitch, yaw (grados, convención ZYX) de una matriz de rotación"""
+    sy = np.hypot(R[0, 0], R[1, 0])
+    if sy > 1e-6:
+        roll = np.arctan2(R[2, 1], R[2, 2])
+        pitch = np.arctan2(-R[2, 0], sy)
+        yaw = np.arctan2(R[1, 0], R[0, 0])
+    else:
+        roll = np.arctan2(-R[1, 2], R[1, 1])
+        pitch = np.arctan2(-R[2, 0], sy)
+        yaw = 0.0
+    return tuple(float(np.degrees(a)) for a in (roll, pitch, yaw))
@@ -0,0 +1,109 @@
+"""Objetos de visión compartidos por todo el proceso: calibración, detectores y mapas de corrección."""
+import threading
+from collections import OrderedDict
+
+import cv2 as cv
+import numpy as np
+
+from map_cache import FileFingerprints
+
+DEFAULT_DICTIONARY = cv.aruco.DICT_6X6_250
+
+
+def create_detector(dictionary=DEFAULT_DICTIONARY):
+    """Detector Aruco con los parámetros por defecto para un diccionario predefinido"""
+    return cv.aruco.ArucoDetector(cv.aruco.getPredefinedDictionary(dictionary), cv.aruco.DetectorParameters())
+
+
+class Calibration:
+    """Parámetros intrínsecos de la cámara, de solo lectura para poder compartirlos entre hilos"""
+
+    def __init__(self, camera_matrix, dist_coeffs, fingerprint):
+        self.camera_matrix = _read_only(camera_matrix)
+        self.dist_coeffs = _read_only(dist_coeffs)
+        self.fingerprint = fingerprint
+
+
+class VisionContext:
+    """Registro de los objetos de visión del proceso, creados una vez y reutilizados.
+
+    La calibración se lee una vez por versión del fichero (mtime, tamaño y
+    hash): si el .npz cambia se vuelve a cargar y se descartan los mapas de
+    corrección calculados con la anterior. Los detectores se guardan por
+    diccionario y por hilo, así que pueden usarse en paralelo sin bloqueos.
+    """
+
+    def __init__(self, fingerprints=None, max_undistort_maps=4):
+        self.fingerprints = fingerprints or FileFingerprints()
+        self.max_undistort_maps = max_undistort_maps
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._calibrations = {}
+        self._undistort_maps = OrderedDict()
+        self.loads = 0
+        self.map_builds = 0
+
+    def calibration(self, path):
+        """Calibración del fichero .npz, recargada solo cuando cambia"""
+        fingerprint = self.fingerprints.get(path)
+        if fingerprint[1] is None:
+            raise FileNotFoundError(f"No existe el archivo de calibración: {path}")
+        cached = self._calibrations.get(path)
+        if cached is not None and cached.fingerprint == fingerprint:
+            return cached
+        with self._lock:
+            cached = self._calibrations.get(path)
+            if cached is not None and cached.fingerprint == fingerprint:
+                return cached
+            with np.load(path) as X:
+                calibration = Calibration(X['camera_matrix'], X['dist_coeffs'], fingerprint)
+            self._calibrations[path] = calibration
+            self.loads += 1
+            # Los mapas de la calibración anterior ya no sirven
+            for key in [key for key in self._undistort_maps if key[0] == path and key[1] != fingerprint]:
+                del self._undistort_maps[key]
+            return calibration
+
+    def detector(self, dictionary=DEFAULT_DICTIONARY):
+        """Detector Aruco del hilo actual para el diccionario"""
+        detectors = getattr(self._local, "detectors", None)
+        if detectors is None:
+            detectors = self._local.detectors = {}
+        detector = detectors.get(dictionary)
+        if detector is None:
+            detector = detectors[dictionary] = create_detector(dictionary)
+        return detector
+
+    def undistort_maps(self, path, image_size):
+        """(map_x, map_y) de initUndistortRectifyMap para imágenes de image_size (ancho, alto)"""
+        calibration = self.calibration(path)
+        key = (path, calibration.fingerprint, tuple(image_size))
+        with self._lock:
+            maps = self._undistort_maps.get(key)
+            if maps is not None:
+                self._undistort_maps.move_to_end(key)
+                return maps
+        camera_matrix = np.asarray(calibration.camera_matrix, dtype=np.float64)
+        map_x, map_y = cv.initUndistortRectifyMap(camera_matrix, np.asarray(calibration.dist_coeffs, dtype=np.float64),
+                                                  None, camera_matrix, tuple(image_size), cv.CV_32FC1)
+        maps = (_read_only(map_x), _read_only(map_y))
+        with self._lock:
+            self._undistort_maps[key] = maps
+            self.map_builds += 1
+            while len(self._undistort_maps) > self.max_undistort_maps:
+                self._undistort_maps.popitem(last=False)
+        return maps
+
+    def stats(self):
+        return {
+            "calibrations": sorted(self._calibrations),
+            "calibration_loads": self.loads,
+            "undistort_maps": len(self._undistort_maps),
+            "undistort_map_builds": self.map_builds,
+        }
+
+
+def _read_only(array):
+    array = np.array(array)
+    array.setflags(write=False)
+    return array
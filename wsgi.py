@@ -0,0 +1,18 @@
+"""Production entry point of the control API: gunicorn -c gunicorn.conf.py wsgi:app
+
+The control server keeps the fleet state, the drone connections and the jobs
+in memory, so it runs as a single process with many threads (gthread worker).
+Socket.IO fan-out to the dashboards scales across cores with fanout.py
+workers that share the control server's emits through SOCKETIO_MESSAGE_QUEUE:
+
+    SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 gunicorn -c gunicorn.conf.py wsgi:app
+    SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 GUNICORN_ROLE=fanout gunicorn -c gunicorn.conf.py fanout:app
+
+A reverse proxy sends /socket.io/ to the fan-out port and everything else to
+the control port.
+"""
+from server import app, start_background_services
+
+# Runs in the worker after the fork (preload_app is off), once per process;
+# the lock file keeps a second control process from polling the drones too.
+start_background_services()